@@ -9,7 +9,7 @@ from terminal.api.exports import terminalapi
 
 
 def get_terminal_info(mac):
-    terminal_info = terminalapi.TerminalAPI.get_terminal_register_info(mac)
+    terminal_info = terminalapi.TerminalAPI.get_cached_terminal_register_info(mac)
 
     return terminal_info
 
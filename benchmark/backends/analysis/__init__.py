@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Benchmark task analysis.
+
+The instant task analysis makes one pass over the task records (see instant.py). The charts
+of a finished task (status is False) don't change any more: when a task finishes, its records
+are streamed once from ES into the result snapshot and the engine, all charts are cached, and a
+later chart request is a cache lookup (or a rebuild from the result snapshot).
+
+The result snapshot is the json of {'success': [...], 'error': [...]} with the whole records,
+the http response header and body included.
+
+The organization charts of a running task are built from ES aggregations (the records have
+the organization ancestry of their terminals), the records aren't retrieved.
+
+"""
+from __future__ import unicode_literals
+import io, json, logging
+
+from django.core.cache import cache
+
+from natrix.common.config import natrix_config
+from natrix.common import exception as natrix_exception
+from benchmark.backends import command_dispatcher
+
+from .instant import INSTANT_ANALYSE_CONFIGURATION, INSTANT_ANALYSE_ENGINES, SLICE_COUNT
+from . import columnar
+
+logger = logging.getLogger(__name__)
+
+# python or numpy (columnar engines)
+INSTANT_ANALYSE_BACKEND = natrix_config.get_value('BENCHMARK', 'instant_analyse_backend')
+INSTANT_ANALYSE_CACHE_TIMEOUT = int(natrix_config.get_value('BENCHMARK', 'instant_analyse_cache_timeout'))
+# change it when the chart structures change, so the cached charts are not used
+INSTANT_ANALYSE_CACHE_VERSION = 1
+
+
+def get_instant_engines(backend=None):
+    """Get the instant analyse engines by 'instant_analyse_backend' in natrix.ini.
+
+    The numpy backend falls back to the python engines if NumPy isn't installed.
+    """
+    backend = backend or INSTANT_ANALYSE_BACKEND
+    if backend == 'python':
+        return INSTANT_ANALYSE_ENGINES
+    if backend == 'numpy':
+        if columnar.np is None:
+            logger.warning('NumPy is not installed, use the python instant analyse engines')
+            return INSTANT_ANALYSE_ENGINES
+        return columnar.COLUMNAR_ANALYSE_ENGINES
+
+    raise natrix_exception.ClassInsideException(
+        message='Unknown instant analyse backend: {}'.format(backend))
+
+
+def get_instant_engine(protocol, view_points=None):
+    return get_instant_engines()[protocol](view_points=view_points)
+
+
+def aggregate_organization(engine, task_id):
+    """Load the organization accumulators of an engine from the ES aggregations of a task.
+
+    """
+    engine.load_organization(command_dispatcher.aggregate_task_organizations(
+        task_id, engine.organization_metrics, missing=engine.organization_missing))
+    if engine.protocol == 'dns':
+        engine.load_ptime_distribution(*command_dispatcher.distribute_task_values(
+            task_id, 'ptime', SLICE_COUNT))
+    return engine
+
+
+def _cache_key(task_id, view_point):
+    return 'benchmark_instant_analyse_{}_{}_{}'.format(INSTANT_ANALYSE_CACHE_VERSION, task_id, view_point)
+
+
+def instant_analyse(task, view_point, chart_name='default'):
+    """Analyse an instant task.
+
+    A running task is analysed from the records in ES (only the requested view point). All
+    charts of a finished task are built from the result snapshot, and cached by view point.
+
+    :param task: Task instance
+    :param view_point:
+    :param chart_name:
+    :return: the chart data
+    """
+    protocol = task.command.protocol_type
+
+    if task.status:
+        engine = get_instant_engine(protocol, view_points=[view_point])
+        if view_point == 'organization':
+            aggregate_organization(engine, task.id)
+        else:
+            engine.feed(command_dispatcher.stream_task_data(task.id))
+        return engine.chart(view_point, chart_name)
+
+    charts = cache.get(_cache_key(task.id, view_point))
+    if charts is None:
+        engine = get_instant_engine(protocol)
+        engine.feed(json.loads(task.result_snapshot))
+        all_charts = engine.build()
+        cache.set_many(dict((_cache_key(task.id, v), c) for v, c in all_charts.items()),
+                       INSTANT_ANALYSE_CACHE_TIMEOUT)
+        logger.info('Cache the analyse charts of task({}): {} records'.format(task.id, engine.record_count))
+        charts = all_charts[view_point]
+
+    return charts[chart_name]
+
+
+class SnapshotStream(object):
+    """A task data stream which writes the records into the result snapshot while an engine
+    iterates them, so the records are not materialized.
+
+    The engine gets the records without the fields excluded by command_dispatcher.ANALYSE_SOURCE.
+    """
+
+    KEYS = ('success', 'error')
+
+    def __init__(self, dial_data):
+        self.dial_data = dial_data
+        self.excludes = set(command_dispatcher.ANALYSE_SOURCE['excludes'])
+        self.counts = dict((key, 0) for key in self.KEYS)
+        self._sections = {}
+        self._finished = set()
+
+    def get(self, key, default=None):
+        if key not in self.KEYS:
+            return default
+        return self._write(key)
+
+    def _write(self, key):
+        section = self._sections[key] = io.StringIO()
+        self.counts[key] = 0
+        for record in self.dial_data.get(key):
+            if self.counts[key]:
+                section.write(', ')
+            section.write(json.dumps(record))
+            self.counts[key] += 1
+            yield dict((field, value) for field, value in record.items() if field not in self.excludes)
+        self._finished.add(key)
+
+    def snapshot(self):
+        """The result snapshot json, the records not iterated by the engine are written here.
+
+        """
+        for key in self.KEYS:
+            if key not in self._finished:
+                for _ in self._write(key):
+                    pass
+        return '{{{}}}'.format(', '.join('"{}": [{}]'.format(key, self._sections[key].getvalue())
+                                         for key in self.KEYS))
+
+
+def finish_instant_task(task):
+    """Build the result snapshot and cache all charts of an instant task in one pass over its
+    records. The caller turns off and saves the task.
+
+    :return: the record counts, {'success': 0, 'error': 0}
+    """
+    stream = SnapshotStream(command_dispatcher.stream_task_data(task.id, source=None))
+    engine = get_instant_engine(task.command.protocol_type)
+    engine.feed(stream)
+    task.result_snapshot = stream.snapshot()
+
+    cache.set_many(dict((_cache_key(task.id, v), c) for v, c in engine.build().items()),
+                   INSTANT_ANALYSE_CACHE_TIMEOUT)
+    logger.info('Finish the instant task({}): {} records'.format(task.id, engine.record_count))
+    return stream.counts
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the instant analyse engines: python vs numpy (columnar).
+
+Usage (from the project root):
+
+    python manage.py shell -c \
+        "from benchmark.backends.analysis.benchmarks import instant_analyse; instant_analyse.run()"
+
+"""
+from __future__ import unicode_literals
+import gc, json, random, time
+
+from ..instant import INSTANT_ANALYSE_ENGINES
+from ..columnar import COLUMNAR_ANALYSE_ENGINES
+
+PROVINCES = ['北京', '上海', '广东', '浙江', '江苏', '四川', '湖北', '山东', None]
+ORGANIZATIONS = [(i, 'org {}'.format(i)) for i in range(1, 51)]
+STATUS_CODES = [200, 200, 200, 301, 404, 500]
+
+
+def _base_record(rand):
+    organizations = rand.sample(ORGANIZATIONS, rand.randint(0, 3))
+    return {
+        'terminal': '{:012x}'.format(rand.getrandbits(48)),
+        'province': rand.choice(PROVINCES),
+        'city': '',
+        'operator': '联通',
+        'organization_id': [org[0] for org in organizations],
+        'organization_name': [org[1] for org in organizations],
+    }
+
+
+def sample_record(protocol, rand):
+    record = _base_record(rand)
+    if protocol == 'ping':
+        packet_send = rand.choice([0, 10])
+        min_time = rand.random() * 50
+        record.update({
+            'destination': 'www.baidu.com',
+            'packet_send': packet_send,
+            'packet_loss': rand.randint(0, packet_send),
+            'packet_receive': packet_send,
+            'packet_size': 64,
+            'min_time': min_time,
+            'avg_time': min_time + rand.random() * 50,
+            'max_time': min_time + 50 + rand.random() * 100
+        })
+    elif protocol == 'http':
+        stages = dict((key, rand.random() * 100) for key in (
+            'period_nslookup', 'period_tcp_connect', 'period_ssl_connect', 'period_request',
+            'period_response', 'period_transfer'))
+        record.update(stages)
+        record.update({
+            'status_code': rand.choice(STATUS_CODES),
+            'total_time': sum(stages.values())
+        })
+    elif protocol == 'dns':
+        record.update({
+            'destination': 'www.baidu.com',
+            'ptime': rand.random() * 30,
+            'ips': [{'ip': '1.1.1.1', 'location': {'province': rand.choice(PROVINCES)}}
+                    for _ in range(rand.randint(1, 3))]
+        })
+    return record
+
+
+def sample_dial_data(protocol, count, seed=0):
+    rand = random.Random(seed)
+    error_count = count // 20
+    success = [sample_record(protocol, rand) for _ in range(count - error_count)]
+    error = []
+    for _ in range(error_count):
+        record = _base_record(rand)
+        record.update({'errorcode': rand.choice([1408, 2408]), 'errorinfo': 'timeout'})
+        error.append(record)
+    return {'success': success, 'error': error}
+
+
+def _analyse(engines, protocol, view_points, dial_data):
+    return engines[protocol](view_points=view_points).feed(dial_data).build()
+
+
+def _measure(engines, protocol, view_points, dial_data, repeat):
+    costs = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        _analyse(engines, protocol, view_points, dial_data)
+        costs.append(time.perf_counter() - start)
+    return min(costs)
+
+
+def run(sizes=(1000, 10000, 100000), protocols=('ping', 'http', 'dns'), repeat=3):
+    """Analyse the region, organization (and comprehensiveness) view points of sample records.
+
+    The detail view point is the same code in both engines, it's not measured.
+    """
+    for protocol in protocols:
+        view_points = [v for v in INSTANT_ANALYSE_ENGINES[protocol]().view_points if v != 'detail']
+        for size in sizes:
+            dial_data = sample_dial_data(protocol, size)
+
+            expected = _analyse(INSTANT_ANALYSE_ENGINES, protocol, view_points, dial_data)
+            result = _analyse(COLUMNAR_ANALYSE_ENGINES, protocol, view_points, dial_data)
+            assert json.dumps(expected, sort_keys=True) == json.dumps(result, sort_keys=True), \
+                'The charts of {} ({} records) are different'.format(protocol, size)
+
+            python_cost = _measure(INSTANT_ANALYSE_ENGINES, protocol, view_points, dial_data, repeat)
+            numpy_cost = _measure(COLUMNAR_ANALYSE_ENGINES, protocol, view_points, dial_data, repeat)
+            print('{:5s} {:7d} records: python {:8.2f} ms, numpy {:8.2f} ms, speedup {:4.1f}x'.format(
+                protocol, size, python_cost * 1000, numpy_cost * 1000, python_cost / numpy_cost))
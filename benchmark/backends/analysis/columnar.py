@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""Columnar (NumPy) instant analyse engines.
+
+The records are converted to NumPy columns once, the region and organization accumulators
+are computed by grouped sums (bincount), and the distributions and top N by vectorized
+functions. The engines fill the same accumulators as the engines in instant.py, and the
+charts are built by the same functions, so the chart structures and values are the same.
+
+The group keys are encoded in the first-seen order (not by np.unique), because a chart
+lists the groups in the order they appear in the records, and a key may be None.
+
+The summation order is the record order (bincount and cumsum are sequential), the same as
+the Python engines, so the floating point results are equal.
+
+NumPy is optional, see analysis.get_instant_engines.
+
+"""
+from __future__ import unicode_literals
+import logging
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from natrix.common import exception as natrix_exception
+
+from .instant import (SLICE_COUNT, TOP_COUNT, PING_METRICS, HTTP_ORG_METRICS, HTTP_STAGE_METRICS,
+                      slice_distribution, PingInstantAnalyse, HttpInstantAnalyse, DnsInstantAnalyse,
+                      TracerouteInstantAnalyse)
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnFallback(Exception):
+    """A column can't be converted exactly, the records are analysed by the Python engine."""
+
+
+def factorize(keys):
+    """Encode the keys in the first-seen order.
+
+    :return: (codes, unique keys)
+    """
+    unique_keys = list(dict.fromkeys(keys))
+    index = dict((key, i) for i, key in enumerate(unique_keys))
+    codes = np.fromiter(map(index.__getitem__, keys), dtype=np.intp, count=len(keys))
+    return codes, unique_keys
+
+
+def to_column(values):
+    """Convert numbers to a float column, any other value (None, str, ...) raises ColumnFallback.
+
+    """
+    try:
+        column = np.array(values)
+    except (TypeError, ValueError):
+        raise ColumnFallback()
+    if column.ndim != 1 or column.dtype.kind not in 'biuf':
+        raise ColumnFallback()
+    column = column.astype(np.float64)
+    if np.isnan(column).any():
+        raise ColumnFallback()
+    return column
+
+
+def column(records, key, default=0):
+    return to_column([record.get(key, default) for record in records])
+
+
+def group_sum(codes, size, weights=None):
+    return np.bincount(codes, weights=weights, minlength=size).tolist()
+
+
+def sequential_sum(values):
+    if not len(values):
+        return 0.0
+    return np.cumsum(values)[-1].item()
+
+
+def explode_organizations(records, empty=None):
+    """The (record, organization) pairs in the record order.
+
+    :param empty: the organization id/name of a record without organizations, skip it if None
+    :return: (rows, codes, organization ids, organization names)
+    """
+    if empty is None:
+        organization_ids = [record.get('organization_id') or () for record in records]
+        organization_names = [record.get('organization_name') or () for record in records]
+    else:
+        organization_ids = [record.get('organization_id') for record in records]
+        organization_names = [record.get('organization_name') if ids else (empty,)
+                              for ids, record in zip(organization_ids, records)]
+        organization_ids = [ids if ids else (empty,) for ids in organization_ids]
+
+    id_lengths = np.fromiter(map(len, organization_ids), dtype=np.intp, count=len(records))
+    name_lengths = np.fromiter(map(len, organization_names), dtype=np.intp, count=len(records))
+    lengths = np.minimum(id_lengths, name_lengths)
+    if (id_lengths != name_lengths).any():
+        # zip() pairs
+        organization_ids = [ids[0: length] for ids, length in zip(organization_ids, lengths.tolist())]
+        organization_names = [names[0: length] for names, length in zip(organization_names, lengths.tolist())]
+
+    flat_ids = list(chain.from_iterable(organization_ids))
+    flat_names = list(chain.from_iterable(organization_names))
+    rows = np.repeat(np.arange(len(records), dtype=np.intp), lengths)
+    codes, org_ids = factorize(flat_ids)
+    _, first_index = np.unique(codes, return_index=True)
+    names = [flat_names[i] for i in first_index.tolist()]
+
+    if empty is None and len(flat_names):
+        flat_names = np.array(flat_names + [None], dtype=object)[:-1]
+        unmatched = np.flatnonzero(flat_names != np.array(names + [None], dtype=object)[:-1][codes])
+        for i in unmatched.tolist():
+            logger.error('There is an unmatch organization info, ({org_id}): {old} {new}'.format(
+                org_id=flat_ids[i], old=names[codes[i]], new=flat_names[i]
+            ))
+
+    return rows, codes, org_ids, names
+
+
+class ColumnarAnalyseMixin(object):
+    """Analyse the columnar view points with NumPy, the others record by record.
+
+    An engine is fed once, the records are materialized (a stream is read into lists).
+
+    """
+    columnar_view_points = ()
+
+    @staticmethod
+    def get_max_value(values):
+        if len(values):
+            return np.max(values).item()
+        else:
+            return 10
+
+    @staticmethod
+    def slice_distribution(values, interval, slice_count=SLICE_COUNT):
+        values = np.asarray(values, dtype=np.float64)
+        if not interval or not len(values):
+            return [0] * (slice_count + 1)
+        if (values < 0).any():
+            return slice_distribution(values.tolist(), interval, slice_count)
+        index = np.minimum((values / interval).astype(np.int64), slice_count)
+        return np.bincount(index, minlength=slice_count + 1).tolist()
+
+    @staticmethod
+    def top_values(x_axis, values, reverse=True, count=TOP_COUNT):
+        keys = np.asarray(values, dtype=np.float64)
+        if reverse:
+            keys = -keys
+        if len(keys) > count:
+            # all items not greater than the kth key, with the ties
+            kth = keys[np.argpartition(keys, count - 1)[count - 1]]
+            candidates = np.flatnonzero(keys <= kth)
+        else:
+            candidates = np.arange(len(keys))
+        # the stable sort keeps the record order of the equal values, as sorted()
+        order = candidates[np.argsort(keys[candidates], kind='stable')][0: count].tolist()
+        return [x_axis[i] for i in order], [values[i] for i in order]
+
+    def success_column(self, key, default=0):
+        """A column of the successful records, each column is converted once.
+
+        """
+        if (key, default) not in self._columns:
+            self._columns[(key, default)] = column(self._success, key, default)
+        return self._columns[(key, default)]
+
+    def feed(self, dial_data):
+        if self.record_count:
+            raise natrix_exception.ClassInsideException(message='A columnar engine can only be fed once')
+
+        success = dial_data.get('success', [])
+        error = dial_data.get('error', [])
+        if not isinstance(success, list):
+            success = list(success)
+        if not isinstance(error, list):
+            error = list(error)
+        self.record_count = len(success) + len(error)
+        self._success = success
+        self._columns = {}
+
+        columnar = [v for v in self.view_points if v in self.columnar_view_points]
+        others = [v for v in self.view_points if v not in columnar]
+        try:
+            for view_point in columnar:
+                getattr(self, 'columns_{}'.format(view_point))(success, error)
+        except ColumnFallback:
+            logger.info('The records of {} can not be analysed by columns'.format(self.protocol))
+            self.init_accumulators()
+            others = self.view_points
+
+        success_handlers = self.handlers('success', others)
+        error_handlers = self.handlers('error', others)
+        if success_handlers:
+            for record in success:
+                for handler in success_handlers:
+                    handler(record)
+        if error_handlers:
+            for record in error:
+                for handler in error_handlers:
+                    handler(record)
+
+        self._success = self._columns = None
+        return self
+
+
+class PingColumnarAnalyse(ColumnarAnalyseMixin, PingInstantAnalyse):
+    columnar_view_points = ('region', 'organization')
+
+    def columns_region(self, success, error):
+        codes, provinces = factorize([record.get('province', '') for record in success])
+        size = len(provinces)
+
+        packet_send = to_column([record.get('packet_send') or 0 for record in success])
+        packet_loss = np.array([record.get('packet_loss') for record in success], dtype=object)
+        sent = packet_send != 0
+        packet_loss_rate = np.zeros(len(success))
+        packet_loss_rate[sent] = to_column(packet_loss[sent].tolist()) * 1.0 / packet_send[sent]
+        packet_loss_rate *= 100
+        avg_time = self.success_column('avg_time', 0)
+
+        count = group_sum(codes, size)
+        total_packet_loss_rate = group_sum(codes, size, packet_loss_rate)
+        total_avg_time = group_sum(codes, size, avg_time)
+
+        self.region = dict(
+            (province, {
+                'name': province,
+                'total_packet_loss_rate': total_packet_loss_rate[i],
+                'total_avg_time': total_avg_time[i],
+                'count': count[i]
+            }) for i, province in enumerate(provinces))
+
+    def columns_organization(self, success, error):
+        rows, codes, org_ids, names = explode_organizations(success)
+        size = len(org_ids)
+
+        totals = dict((key, group_sum(codes, size, self.success_column(key, 0)[rows])) for key in PING_METRICS)
+        count = group_sum(codes, size)
+
+        organization = {}
+        for i, org_id in enumerate(org_ids):
+            info = organization[org_id] = {
+                'org_name': names[i],
+                'count': count[i]
+            }
+            for key in PING_METRICS:
+                info[key] = totals[key][i]
+        self.organization = organization
+
+
+class HttpColumnarAnalyse(ColumnarAnalyseMixin, HttpInstantAnalyse):
+    columnar_view_points = ('region', 'organization', 'comprehensiveness')
+
+    def columns_region(self, success, error):
+        codes, provinces = factorize([record.get('province', '') for record in success])
+        size = len(provinces)
+
+        count = group_sum(codes, size)
+        total_time = group_sum(codes, size, self.success_column('total_time', None))
+
+        self.region = dict(
+            (province, {
+                'name': province,
+                'total_time': total_time[i],
+                'count': count[i]
+            }) for i, province in enumerate(provinces))
+
+    def columns_organization(self, success, error):
+        rows, codes, org_ids, names = explode_organizations(success)
+        size = len(org_ids)
+
+        totals = dict((key, group_sum(codes, size, self.success_column(key, 0)[rows]))
+                      for key in HTTP_ORG_METRICS)
+        count = group_sum(codes, size)
+
+        organization = {}
+        for i, org_id in enumerate(org_ids):
+            info = organization[org_id] = {
+                'org_name': names[i],
+                'count': count[i]
+            }
+            for key in HTTP_ORG_METRICS:
+                info[key] = totals[key][i]
+        self.organization = organization
+
+    def _code_counts(self, values, template, message):
+        keys = [template.format(value) for value in values if value is not None]
+        if len(keys) != len(values):
+            logger.error('{} ({} records)'.format(message, len(values) - len(keys)))
+        codes, keys = factorize(keys)
+        return dict(zip(keys, group_sum(codes, len(keys))))
+
+    def columns_comprehensiveness(self, success, error):
+        self.status_codes = self._code_counts([record.get('status_code', None) for record in success],
+                                              'status code {}',
+                                              'There are http response records which status code is None')
+        self.error_codes = self._code_counts([record.get('errorcode', None) for record in error],
+                                             'error code {}',
+                                             'There are http error response records which errorcode is None')
+
+        self.stage_count = len(success)
+        self.stage = dict((key, sequential_sum(self.success_column(key, 0.0)))
+                          for key in HTTP_STAGE_METRICS)
+
+
+class DnsColumnarAnalyse(ColumnarAnalyseMixin, DnsInstantAnalyse):
+    columnar_view_points = ('region', 'organization')
+
+    def columns_region(self, success, error):
+        codes, provinces = factorize([record.get('province', '') for record in success])
+        size = len(provinces)
+
+        count = group_sum(codes, size)
+        parse_time_total = group_sum(codes, size, self.success_column('ptime', None))
+
+        self.region = dict(
+            (province, {
+                'name': province,
+                'parse_time_total': parse_time_total[i],
+                'count': count[i]
+            }) for i, province in enumerate(provinces))
+
+        codes, parse_provinces = factorize([parse_record.get('location', {}).get('province', '')
+                                            for record in success
+                                            for parse_record in record.get('ips', [])])
+        count = group_sum(codes, len(parse_provinces))
+        self.parse_region = dict(
+            (province, {
+                'name': province,
+                'count': count[i]
+            }) for i, province in enumerate(parse_provinces))
+
+    def columns_organization(self, success, error):
+        ptimes = self.success_column('ptime', None)
+        rows, codes, org_ids, names = explode_organizations(success, empty='')
+        size = len(org_ids)
+
+        count = group_sum(codes, size)
+        total_ptime = group_sum(codes, size, ptimes[rows])
+
+        self.organization = dict(
+            (org_id, {
+                'name': names[i],
+                'total_ptime': total_ptime[i],
+                'count': count[i]
+            }) for i, org_id in enumerate(org_ids))
+        self.ptimes = ptimes
+
+
+COLUMNAR_ANALYSE_ENGINES = {
+    'ping': PingColumnarAnalyse,
+    'http': HttpColumnarAnalyse,
+    'dns': DnsColumnarAnalyse,
+    'traceroute': TracerouteInstantAnalyse,
+}
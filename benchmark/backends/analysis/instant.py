@@ -0,0 +1,941 @@
+# -*- coding: utf-8 -*-
+"""Single-pass analysis of instant task records.
+
+An analyse engine (one for each protocol) iterates the successful and failed records once,
+and updates the accumulators of the view points (region, organization, ...). All charts are
+built from the accumulators, so a default (all) chart doesn't iterate the records again.
+
+The chart functions are named as INSTANT_ANALYSE_CONFIGURATION, and return the same
+structures as the former InstantTaskAnalyseSerializer methods.
+
+"""
+from __future__ import unicode_literals
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+INSTANT_ANALYSE_CONFIGURATION = {
+    'ping': {
+        'region': {
+            'packet_loss': {
+                'analyse': 'ping_region_packet_loss'
+            },
+            'delay': {
+                'analyse': 'ping_region_delay'
+            },
+            'default': {
+                'analyse': 'ping_region_all'
+            }
+        },
+        'organization': {
+            'packet_loss': {
+                'analyse': 'ping_organization_packet_loss'
+            },
+            'delay': {
+                'analyse': 'ping_organization_delay'
+            },
+            'distribution': {
+                'analyse': 'ping_organization_distribution'
+            },
+            'top': {
+                'analyse': 'ping_organization_top'
+            },
+            'default': {
+                'analyse': 'ping_organization_all'
+            }
+        },
+        'detail': {
+            'default': {
+                'analyse': 'ping_detail'
+            }
+        }
+    },
+    'http': {
+        'region': {
+            'request': {
+                'analyse': 'http_region_request'
+            },
+            'default': {
+                'analyse': 'http_region_all'
+            }
+        },
+        'organization': {
+            'request': {
+                'analyse': 'http_organization_request'
+            },
+            'distribution': {
+                'analyse': 'http_organization_distribution'
+            },
+            'default': {
+                'analyse': 'http_organization_all'
+            }
+        },
+        'comprehensiveness': {
+            'result_distribution': {
+                'analyse': 'http_com_result_distribution'
+            },
+            'stage_distribution': {
+                'analyse': 'http_com_stage_distribution'
+            },
+            'default': {
+                'analyse': 'http_comprehensiveness_all'
+            }
+        },
+        'detail': {
+            'default': {
+                'analyse': 'http_detail'
+            }
+        }
+    },
+    'dns': {
+        'region': {
+            'parse_time': {
+                'analyse': 'dns_region_parse_time'
+            },
+            'distribution': {
+                'analyse': 'dns_region_distribution'
+            },
+            'top': {
+                'analyse': 'dns_region_top'
+            },
+            'default': {
+                'analyse': 'dns_region_all'
+            },
+        },
+        'organization': {
+            'parse_time': {
+                'analyse': 'dns_organization_parse_time'
+            },
+            'distribution': {
+                'analyse': 'dns_organization_distribution'
+            },
+            'top': {
+                'analyse': 'dns_organization_top'
+            },
+            'default': {
+                'analyse': 'dns_organization_all'
+            }
+        },
+        'detail': {
+            'default': {
+                'analyse': 'dns_detail'
+            }
+        }
+    },
+    'traceroute': {
+        'detail': {
+            'default': {
+                'analyse': 'traceroute_detail'
+            }
+        }
+    }
+}
+
+SLICE_COUNT = 10
+TOP_COUNT = 10
+
+PING_METRICS = ('avg_time', 'min_time', 'max_time', 'packet_send', 'packet_loss', 'packet_receive')
+HTTP_ORG_METRICS = ('total_time', 'period_nslookup', 'period_tcp_connect', 'period_request',
+                    'period_response', 'period_transfer')
+HTTP_STAGE_METRICS = ('period_nslookup', 'period_tcp_connect', 'period_ssl_connect', 'period_request',
+                      'period_response', 'period_transfer')
+
+
+def get_max_value(values):
+    if values:
+        return max(values)
+    else:
+        return 10
+
+
+def slice_axis(interval, slice_count=SLICE_COUNT, precision=2):
+    if precision is None:
+        return ['{}-{}'.format(interval * x, interval * (x + 1)) for x in range(slice_count + 1)]
+    return ['{}-{}'.format(round(interval * x, precision), round(interval * (x + 1), precision))
+            for x in range(slice_count + 1)]
+
+
+def slice_distribution(values, interval, slice_count=SLICE_COUNT):
+    """Count values in slice_count + 1 slices, a value out of range is counted in the last one.
+
+    """
+    distribution = [0] * (slice_count + 1)
+    if interval:
+        for value in values:
+            distribution[min(int(value / interval), slice_count)] += 1
+    return distribution
+
+
+def top_values(x_axis, values, reverse=True, count=TOP_COUNT):
+    """The top items, sorted by value.
+
+    :return: (x_axis, values)
+    """
+    items = sorted(zip(x_axis, values), key=lambda x: x[1], reverse=reverse)[0: count]
+    return [x[0] for x in items], [x[1] for x in items]
+
+
+def extract_error(record):
+    return {
+        'terminal': record.get('terminal', None),
+        'organizations': record.get('organization_name', []),
+        'province': record.get('province', None),
+        'city': record.get('city', None),
+        'operator': record.get('operator', None),
+        'errorinfo': record.get('errorinfo', None)
+    }
+
+
+class BaseInstantAnalyse(object):
+    """The analyse engine of a protocol.
+
+    The accumulators of a view point are updated by success_<view point> and
+    error_<view point> methods.
+
+    :param view_points: the view points to analyse, all view points of the protocol by default.
+                        Only the accumulators of these view points are updated.
+    """
+    protocol = None
+    # the fields summed by organization (see load_organization), and the organization of the
+    # records without organization (skipped if None)
+    organization_metrics = ()
+    organization_missing = None
+
+    get_max_value = staticmethod(get_max_value)
+    slice_distribution = staticmethod(slice_distribution)
+    top_values = staticmethod(top_values)
+
+    def __init__(self, view_points=None):
+        self.configuration = INSTANT_ANALYSE_CONFIGURATION[self.protocol]
+        if view_points is None:
+            self.view_points = tuple(self.configuration.keys())
+        else:
+            self.view_points = tuple(v for v in view_points if v in self.configuration)
+        self.record_count = 0
+        self.init_accumulators()
+        self._success_handlers = self.handlers('success', self.view_points)
+        self._error_handlers = self.handlers('error', self.view_points)
+
+    def handlers(self, record_type, view_points):
+        return [getattr(self, '{}_{}'.format(record_type, view_point)) for view_point in view_points
+                if hasattr(self, '{}_{}'.format(record_type, view_point))]
+
+    def init_accumulators(self):
+        pass
+
+    def add_success(self, record):
+        for handler in self._success_handlers:
+            handler(record)
+
+    def add_error(self, record):
+        for handler in self._error_handlers:
+            handler(record)
+
+    def feed(self, dial_data):
+        """Iterate the records once.
+
+        :param dial_data: {'success': [...], 'error': [...]}, or a TaskDataStream
+        """
+        for record in dial_data.get('success', []):
+            self.record_count += 1
+            self.add_success(record)
+        for record in dial_data.get('error', []):
+            self.record_count += 1
+            self.add_error(record)
+        return self
+
+    def load_organization(self, organizations):
+        """Load the organization accumulators from the aggregations of the records (ES terms
+        aggregation), instead of iterating the records.
+
+        The engines without organization charts (traceroute) ignore the aggregations.
+
+        :param organizations: [{'name': organization name, 'count': record count, <metric>: sum}]
+        """
+
+    def chart(self, view_point, chart_name='default'):
+        analyse = self.configuration[view_point][chart_name]['analyse']
+        return getattr(self, analyse)()
+
+    def charts(self, view_point):
+        """All charts of a view point.
+
+        :return: {chart_name: chart}
+        """
+        return dict((chart_name, self.chart(view_point, chart_name))
+                    for chart_name in self.configuration[view_point])
+
+    def build(self):
+        """All charts of the analysed view points.
+
+        :return: {view_point: {chart_name: chart}}
+        """
+        return dict((view_point, self.charts(view_point)) for view_point in self.view_points)
+
+
+class PingInstantAnalyse(BaseInstantAnalyse):
+    protocol = 'ping'
+    organization_metrics = PING_METRICS
+
+    def init_accumulators(self):
+        self.region = {}
+        self.organization = {}
+        self.success_details = []
+        self.error_details = []
+
+    def success_region(self, record):
+        province = record.get('province', '')
+        info = self.region.get(province)
+        if info is None:
+            info = self.region[province] = {
+                'name': province,
+                'total_packet_loss_rate': 0,
+                'total_avg_time': 0,
+                'count': 0
+            }
+        packet_send = record.get('packet_send')
+        packet_loss = record.get('packet_loss')
+        info['count'] += 1
+        info['total_packet_loss_rate'] += (packet_loss * 1.0 / packet_send if packet_send else 0.0) * 100
+        info['total_avg_time'] += record.get('avg_time', 0)
+
+    def success_organization(self, record):
+        orgs = record.get('organization_id') or []
+        names = record.get('organization_name') or []
+        for org_id, org_name in zip(orgs, names):
+            info = self.organization.get(org_id)
+            if info is None:
+                info = self.organization[org_id] = {
+                    'org_name': org_name,
+                    'avg_time': 0,
+                    'min_time': 0,
+                    'max_time': 0,
+                    'packet_send': 0,
+                    'packet_loss': 0,
+                    'packet_receive': 0,
+                    'count': 0
+                }
+            if org_name != info['org_name']:
+                logger.error('There is an unmatch organization info, ({org_id}): {old} {new} '.format(
+                    org_id=org_id, old=info['org_name'], new=org_name
+                ))
+            info['count'] += 1
+            for key in PING_METRICS:
+                info[key] += record.get(key, 0)
+
+    def load_organization(self, organizations):
+        self.organization = {}
+        for org in organizations:
+            info = self.organization[org['name']] = {
+                'org_name': org['name'],
+                'count': org['count']
+            }
+            for key in PING_METRICS:
+                info[key] = org[key]
+
+    def success_detail(self, record):
+        self.success_details.append({
+            'terminal': record.get('terminal', None),
+            'organizations': record.get('organization_name', []),
+            'province': record.get('province', None),
+            'city': record.get('city', None),
+            'operator': record.get('operator', None),
+            'destination': record.get('destination', None),
+            'destination_ip': record.get('destination_ip', None),
+            'packet_send': record.get('packet_send', None),
+            'packet_loss': record.get('packet_loss', None),
+            'packet_receive': record.get('packet_receive', None),
+            'avg_time': record.get('avg_time', None),
+            'max_time': record.get('max_time', None),
+            'min_time': record.get('min_time', None),
+            'packet_size': record.get('packet_size', None),
+        })
+
+    def error_detail(self, record):
+        self.error_details.append(extract_error(record))
+
+    def ping_region_packet_loss(self):
+        return {
+            'name': 'ping packet_loss region analyse',
+            'values': [{'name': info['name'], 'value': info['total_packet_loss_rate'] / info['count']}
+                       for info in self.region.values()]
+        }
+
+    def ping_region_delay(self):
+        return {
+            'name': 'ping delay region analyse',
+            'values': [{'name': info['name'], 'value': info['total_avg_time'] / info['count']}
+                       for info in self.region.values()]
+        }
+
+    def ping_region_all(self):
+        return {
+            'packet_loss': self.ping_region_packet_loss(),
+            'delay': self.ping_region_delay()
+        }
+
+    def _organization_values(self):
+        x_axis = []
+        packet_loss_values = []
+        avg_time_values = []
+        min_time_values = []
+        max_time_values = []
+        for info in self.organization.values():
+            count = info['count']
+            x_axis.append(info['org_name'])
+            packet_loss_values.append(
+                (info['packet_loss'] * 1.0 / info['packet_send'] if info['packet_send'] else 0) / count)
+            avg_time_values.append(info['avg_time'] / count)
+            min_time_values.append(info['min_time'] / count)
+            max_time_values.append(info['max_time'] / count)
+
+        return x_axis, packet_loss_values, avg_time_values, min_time_values, max_time_values
+
+    def _packet_loss_chart(self, name, x_axis, packet_loss_values):
+        return {
+            'name': name,
+            'x-axis': x_axis,
+            'viewpoints': [
+                {
+                    'name': 'packet_loss',
+                    'values': packet_loss_values
+                }
+            ]
+        }
+
+    def _distribution_chart(self, name, max_values, min_values, avg_values, precision=2):
+        interval = self.get_max_value(max_values) / SLICE_COUNT
+
+        return {
+            'name': name,
+            'x-axis': slice_axis(interval, precision=precision),
+            'viewpoints': [
+                {
+                    'name': 'max_value',
+                    'values': self.slice_distribution(max_values, interval)
+                }, {
+                    'name': 'min_value',
+                    'values': self.slice_distribution(min_values, interval)
+                }, {
+                    'name': 'avg_value',
+                    'values': self.slice_distribution(avg_values, interval)
+                }
+            ]
+        }
+
+    def _top_chart(self, name, x_axis, avg_values):
+        top_axis, top_avg = self.top_values(x_axis, avg_values)
+        return {
+            'name': name,
+            'x-axis': top_axis,
+            'viewpoints': [
+                {
+                    'name': 'avg_value',
+                    'values': top_avg
+                }
+            ]
+        }
+
+    def ping_organization_packet_loss(self):
+        x_axis, packet_loss_values, _, _, _ = self._organization_values()
+        return self._packet_loss_chart('ping packet_loss org analyse', x_axis, packet_loss_values)
+
+    def ping_organization_delay(self):
+        x_axis, _, avg_time_values, min_time_values, max_time_values = self._organization_values()
+
+        return {
+            'name': 'ping delay org analyse',
+            'x-axis': x_axis,
+            'viewpoints': [
+                {
+                    'name': 'avg_value',
+                    'values': avg_time_values
+                }, {
+                    'name': 'min_value',
+                    'values': min_time_values
+                }, {
+                    'name': 'max_value',
+                    'values': max_time_values
+                }
+            ]
+        }
+
+    def ping_organization_distribution(self):
+        _, _, avg_time_values, min_time_values, max_time_values = self._organization_values()
+        return self._distribution_chart('ping delay distribution org analyse',
+                                        max_time_values, min_time_values, avg_time_values)
+
+    def ping_organization_top(self):
+        x_axis, _, avg_time_values, _, _ = self._organization_values()
+        return self._top_chart('top analyse', x_axis, avg_time_values)
+
+    def ping_organization_all(self):
+        x_axis, packet_loss_values, avg_time_values, min_time_values, max_time_values = \
+            self._organization_values()
+
+        return {
+            'packet_loss': self._packet_loss_chart('packet_loss analyse', x_axis, packet_loss_values),
+            'delay': {
+                'name': 'delay analyse',
+                'x-axis': x_axis,
+                'viewpoints': [
+                    {
+                        'name': 'max_value',
+                        'values': max_time_values
+                    }, {
+                        'name': 'min_value',
+                        'values': min_time_values
+                    }, {
+                        'name': 'avg_value',
+                        'values': avg_time_values
+                    }
+                ]
+            },
+            'distribution': self._distribution_chart('distribution analyse', max_time_values,
+                                                     min_time_values, avg_time_values, precision=None),
+            'top': self._top_chart('top analyse', list(x_axis), avg_time_values)
+        }
+
+    def ping_detail(self):
+        return {
+            'error': list(self.error_details),
+            'success': list(self.success_details)
+        }
+
+
+class HttpInstantAnalyse(BaseInstantAnalyse):
+    protocol = 'http'
+    organization_metrics = HTTP_ORG_METRICS
+
+    def init_accumulators(self):
+        self.region = {}
+        self.organization = {}
+        self.status_codes = {}
+        self.error_codes = {}
+        self.stage = dict((key, 0.0) for key in HTTP_STAGE_METRICS)
+        self.stage_count = 0
+        self.error_details = []
+        self.wrong_details = []
+        self.success_details = []
+
+    def success_region(self, record):
+        province = record.get('province', '')
+        info = self.region.get(province)
+        if info is None:
+            info = self.region[province] = {
+                'name': province,
+                'total_time': 0,
+                'count': 0
+            }
+        info['count'] += 1
+        info['total_time'] += record.get('total_time')
+
+    def success_organization(self, record):
+        orgs = record.get('organization_id') or []
+        names = record.get('organization_name') or []
+        for org_id, org_name in zip(orgs, names):
+            info = self.organization.get(org_id)
+            if info is None:
+                info = self.organization[org_id] = {
+                    'org_name': org_name,
+                    'count': 0,
+                    'total_time': 0.0,
+                    'period_nslookup': 0.0,
+                    'period_tcp_connect': 0.0,
+                    'period_request': 0.0,
+                    'period_response': 0.0,
+                    'period_transfer': 0.0
+                }
+            if org_name != info['org_name']:
+                logger.error('There is an unmatch organization info, ({org_id}): {old} {new}'.format(
+                    org_id=org_id, old=info['org_name'], new=org_name
+                ))
+            info['count'] += 1
+            for key in HTTP_ORG_METRICS:
+                info[key] += record.get(key, 0)
+
+    def load_organization(self, organizations):
+        self.organization = {}
+        for org in organizations:
+            info = self.organization[org['name']] = {
+                'org_name': org['name'],
+                'count': org['count']
+            }
+            for key in HTTP_ORG_METRICS:
+                info[key] = org[key]
+
+    def success_comprehensiveness(self, record):
+        status_code = record.get('status_code', None)
+        if status_code is None:
+            logger.error('There is a http response record which status code is None')
+        else:
+            key = 'status code {}'.format(status_code)
+            self.status_codes[key] = self.status_codes.get(key, 0) + 1
+
+        self.stage_count += 1
+        for key in HTTP_STAGE_METRICS:
+            self.stage[key] += record.get(key, 0.0)
+
+    def success_detail(self, record):
+        status_code = record.get('status_code')
+        try:
+            status_code = int(status_code)
+            detail = {
+                'terminal': record.get('terminal', None),
+                'organizations': record.get('organization_name', []),
+                'province': record.get('province', None),
+                'city': record.get('city', None),
+                'operator': record.get('operator', None),
+                'status_code': record.get('status_code', None),
+                'total_time': record.get('total_time', None),
+                'period_nslookup': record.get('period_nslookup', None),
+                'period_tcp_connect': record.get('period_tcp_connect', None),
+                'period_ssl_connect': record.get('period_ssl_connect', None),
+                'period_request': record.get('period_request', None),
+                'period_response': record.get('period_response', None),
+                'period_transfer': record.get('period_transfer', None),
+                'size_download': record.get('size_download', None),
+                'speed_download': record.get('speed_download', None)
+            }
+            if status_code < 400:
+                self.success_details.append(detail)
+            else:
+                self.wrong_details.append(detail)
+        except (TypeError, ValueError):
+            logger.error('Thers is a record with an invalid status code({}).'.format(status_code))
+
+    def error_comprehensiveness(self, record):
+        error_code = record.get('errorcode', None)
+        if error_code is None:
+            logger.error('There is a http error response record which errorcode is None')
+        else:
+            key = 'error code {}'.format(error_code)
+            self.error_codes[key] = self.error_codes.get(key, 0) + 1
+
+    def error_detail(self, record):
+        self.error_details.append(extract_error(record))
+
+    def http_region_request(self):
+        return {
+            'name': 'http request region analyse',
+            'values': [{'name': info['name'], 'value': info['total_time'] * 1.0 / info['count']}
+                       for info in self.region.values()]
+        }
+
+    def http_region_all(self):
+        return {
+            'request': self.http_region_request()
+        }
+
+    def _organization_values(self):
+        x_axis = []
+        total_values = []
+        nslookup_values = []
+        tcp_connect_values = []
+
+        for info in self.organization.values():
+            count = info['count']
+            x_axis.append(info['org_name'])
+            total_values.append(info['total_time'] / count)
+            nslookup_values.append(info['period_nslookup'] / count)
+            tcp_connect_values.append(info['period_tcp_connect'] / count)
+
+        return x_axis, total_values, nslookup_values, tcp_connect_values
+
+    def http_organization_request(self):
+        x_axis, total_values, nslookup_values, tcp_connect_values = self._organization_values()
+
+        return {
+            'name': 'http request org analyse',
+            'x-axis': x_axis,
+            'viewpoints': [
+                {
+                    'name': 'total_time',
+                    'values': total_values
+                }, {
+                    'name': 'namelookup_time',
+                    'values': nslookup_values
+                }, {
+                    'name': 'tcp_connect_time',
+                    'values': tcp_connect_values
+                }
+            ]
+        }
+
+    def http_organization_distribution(self):
+        _, total_values, nslookup_values, tcp_connect_values = self._organization_values()
+
+        if not (total_values or nslookup_values or tcp_connect_values):
+            distribution_axis = []
+            total_list = []
+            nslookup_list = []
+            tcp_connect_list = []
+        else:
+            interval = self.get_max_value(total_values) / SLICE_COUNT
+            distribution_axis = slice_axis(interval)
+            total_list = self.slice_distribution(total_values, interval)
+            nslookup_list = self.slice_distribution(nslookup_values, interval)
+            tcp_connect_list = self.slice_distribution(tcp_connect_values, interval)
+
+        return {
+            'name': 'http request distribution org analyse',
+            'x-axis': distribution_axis,
+            'viewpoints': [
+                {
+                    'name': 'total_time',
+                    'values': total_list
+                }, {
+                    'name': 'namelookup_time',
+                    'values': nslookup_list
+                }, {
+                    'name': 'tcp_connect_time',
+                    'values': tcp_connect_list
+                }
+            ]
+        }
+
+    def http_organization_all(self):
+        return {
+            'request': self.http_organization_request(),
+            'distribution': self.http_organization_distribution()
+        }
+
+    def http_com_result_distribution(self):
+        values = [{'name': code, 'value': value} for code, value in self.status_codes.items()]
+        values.extend({'name': code, 'value': value} for code, value in self.error_codes.items())
+
+        return {
+            'name': 'http result distribution analyse',
+            'values': values
+        }
+
+    def http_com_stage_distribution(self):
+        count = self.stage_count
+        return {
+            'name': 'http request stage distribution analyse',
+            'values': [{'name': key, 'value': 0 if count == 0 else self.stage[key] / count}
+                       for key in HTTP_STAGE_METRICS]
+        }
+
+    def http_comprehensiveness_all(self):
+        return {
+            'result_distribution': self.http_com_result_distribution(),
+            'stage_distribution': self.http_com_stage_distribution()
+        }
+
+    def http_detail(self):
+        return {
+            'error': list(self.error_details),
+            'wrong': list(self.wrong_details),
+            'success': list(self.success_details)
+        }
+
+
+class DnsInstantAnalyse(BaseInstantAnalyse):
+    protocol = 'dns'
+    organization_metrics = ('ptime',)
+    organization_missing = ''
+
+    def init_accumulators(self):
+        self.region = {}
+        self.parse_region = {}
+        self.organization = {}
+        self.ptimes = []
+        # (max value, slice counts) of the parse times, loaded instead of ptimes
+        self.ptime_distribution = None
+        self.success_details = []
+        self.error_details = []
+
+    def success_region(self, record):
+        province = record.get('province', '')
+        info = self.region.get(province)
+        if info is None:
+            info = self.region[province] = {
+                'name': province,
+                'parse_time_total': 0.0,
+                'count': 0
+            }
+        info['parse_time_total'] += record.get('ptime')
+        info['count'] += 1
+
+        for parse_record in record.get('ips', []):
+            p_province = parse_record.get('location', {}).get('province', '')
+            info = self.parse_region.get(p_province)
+            if info is None:
+                info = self.parse_region[p_province] = {
+                    'name': p_province,
+                    'count': 0
+                }
+            info['count'] += 1
+
+    def success_organization(self, record):
+        organization_ids = record.get('organization_id')
+        organization_names = record.get('organization_name')
+        if not organization_ids:
+            organization_ids = ['']
+            organization_names = ['']
+
+        for org_id, org_name in zip(organization_ids, organization_names):
+            info = self.organization.get(org_id)
+            if info is None:
+                info = self.organization[org_id] = {
+                    'name': org_name,
+                    'total_ptime': 0,
+                    'count': 0
+                }
+            info['count'] += 1
+            info['total_ptime'] += record['ptime']
+
+        self.ptimes.append(record['ptime'])
+
+    def load_organization(self, organizations):
+        self.organization = dict((org['name'], {
+            'name': org['name'],
+            'total_ptime': org['ptime'],
+            'count': org['count']
+        }) for org in organizations)
+
+    def load_ptime_distribution(self, max_value, counts):
+        self.ptime_distribution = (max_value, counts)
+
+    def success_detail(self, record):
+        self.success_details.append({
+            'terminal': record.get('terminal', None),
+            'organizations': record.get('organization_name', []),
+            'province': record.get('province', None),
+            'city': record.get('city', None),
+            'operator': record.get('operator', None),
+            'ptime': record.get('ptime', None),
+            'destination': record.get('destination', None),
+            'ips': record.get('ips', [])
+        })
+
+    def error_detail(self, record):
+        self.error_details.append(extract_error(record))
+
+    def _region_values(self):
+        return [{'name': info['name'], 'value': info['parse_time_total'] / info['count']}
+                for info in self.region.values()]
+
+    def dns_region_parse_time(self):
+        return {
+            'name': 'dns parse_time region analyse',
+            'values': self._region_values()
+        }
+
+    def dns_region_distribution(self):
+        return {
+            'name': 'dns parse_result region distribution',
+            'values': [{'name': info['name'], 'value': info['count']}
+                       for info in self.parse_region.values()]
+        }
+
+    def dns_region_top(self):
+        values = self._region_values()
+        x_axis, parse_time_values = self.top_values([x['name'] for x in values],
+                                                    [x['value'] for x in values], reverse=False)
+        return self._parse_time_chart('dns parse top region analyse', x_axis, parse_time_values)
+
+    def dns_region_all(self):
+        return {
+            'parse_time': self.dns_region_parse_time(),
+            'distribution': self.dns_region_distribution(),
+            'top': self.dns_region_top()
+        }
+
+    def _organization_values(self):
+        x_axis = []
+        parse_time_values = []
+        for info in self.organization.values():
+            x_axis.append(info['name'])
+            parse_time_values.append(info['total_ptime'] / info['count'] if info['count'] else 0)
+        return x_axis, parse_time_values
+
+    def _parse_time_chart(self, name, x_axis, values):
+        return {
+            'name': name,
+            'x-axis': x_axis,
+            'viewpoints': [
+                {
+                    'name': 'parse_time',
+                    'values': values
+                }
+            ]
+        }
+
+    def dns_organization_parse_time(self):
+        x_axis, parse_time_values = self._organization_values()
+        return self._parse_time_chart('dns parse_time org analyse', x_axis, parse_time_values)
+
+    def dns_organization_distribution(self):
+        if self.ptime_distribution is None:
+            interval = self.get_max_value(self.ptimes) / SLICE_COUNT
+            values = self.slice_distribution(self.ptimes, interval)
+        else:
+            max_value, values = self.ptime_distribution
+            interval = max_value / SLICE_COUNT
+        return {
+            'name': 'dns parse_time distribution org analyse',
+            'x-axis': slice_axis(interval),
+            'viewpoints': [
+                {
+                    'name': 'parse_time',
+                    'values': values
+                }
+            ]
+        }
+
+    def dns_organization_top(self):
+        x_axis, parse_time_values = self._organization_values()
+        return self._parse_time_chart('dns parse_time top org analyse',
+                                      *self.top_values(x_axis, parse_time_values))
+
+    def dns_organization_all(self):
+        return {
+            'parse_time': self.dns_organization_parse_time(),
+            'distribution': self.dns_organization_distribution(),
+            'top': self.dns_organization_top()
+        }
+
+    def dns_detail(self):
+        return {
+            'error': list(self.error_details),
+            'success': list(self.success_details)
+        }
+
+
+class TracerouteInstantAnalyse(BaseInstantAnalyse):
+    protocol = 'traceroute'
+
+    def init_accumulators(self):
+        self.success_details = []
+        self.error_details = []
+
+    def success_detail(self, record):
+        self.success_details.append({
+            'terminal': record.get('terminal', None),
+            'organizations': record.get('organization_name', []),
+            'province': record.get('province', None),
+            'city': record.get('city', None),
+            'operator': record.get('operator', None),
+            'hop': record.get('hop', None),
+            'paths': record.get('paths', {})
+        })
+
+    def error_detail(self, record):
+        self.error_details.append(extract_error(record))
+
+    def traceroute_detail(self):
+        return {
+            'error': list(self.error_details),
+            'success': list(self.success_details)
+        }
+
+
+INSTANT_ANALYSE_ENGINES = {
+    'ping': PingInstantAnalyse,
+    'http': HttpInstantAnalyse,
+    'dns': DnsInstantAnalyse,
+    'traceroute': TracerouteInstantAnalyse,
+}
@@ -0,0 +1,34 @@
+import unittest
+
+from django.test import SimpleTestCase
+
+from benchmark.backends.analysis import columnar
+from benchmark.backends.analysis.instant import INSTANT_ANALYSE_ENGINES
+from benchmark.backends.analysis.benchmarks.instant_analyse import sample_dial_data
+
+
+@unittest.skipIf(columnar.np is None, 'NumPy is not installed')
+class ColumnarAnalyseTestCase(SimpleTestCase):
+
+    def test_same_charts_as_python_engines(self):
+        for protocol in ('ping', 'http', 'dns', 'traceroute'):
+            dial_data = sample_dial_data(protocol, 500)
+            expected = INSTANT_ANALYSE_ENGINES[protocol]().feed(dial_data).build()
+            result = columnar.COLUMNAR_ANALYSE_ENGINES[protocol]().feed(dial_data).build()
+            self.assertEqual(result, expected, protocol)
+
+    def test_fallback(self):
+        dial_data = sample_dial_data('dns', 50)
+        dial_data['success'][3]['organization_id'] = [1, 2]
+        dial_data['success'][3]['organization_name'] = ['org 1']
+        dial_data['success'][5]['ips'] = [{'location': {}}]
+        dial_data['success'][7]['ptime'] = '3'
+
+        with self.assertRaises(TypeError):
+            INSTANT_ANALYSE_ENGINES['dns']().feed(dial_data)
+        with self.assertRaises(TypeError):
+            columnar.COLUMNAR_ANALYSE_ENGINES['dns']().feed(dial_data)
+
+        dial_data['success'][7]['ptime'] = 3
+        self.assertEqual(columnar.COLUMNAR_ANALYSE_ENGINES['dns']().feed(dial_data).build(),
+                         INSTANT_ANALYSE_ENGINES['dns']().feed(dial_data).build())
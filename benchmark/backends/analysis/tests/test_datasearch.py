@@ -0,0 +1,188 @@
+import inspect
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from natrix.common import exception as natrix_exception
+from benchmark.serializers import datasearch, analyse_serializer
+
+
+def counts(*values):
+    return {'aggregations': {'bucket_aggs': {'buckets': [
+        {'key': key, 'doc_count': count} for key, count in values]}}}
+
+
+class FakeMultiSearch(object):
+    """Answer the searches of a round by their bodies: {'answer': response}."""
+
+    def __init__(self):
+        self.rounds = []
+
+    def __call__(self, conditions):
+        self.rounds.append(conditions)
+        return [body['answer'] for _, body, _, _, _ in conditions]
+
+
+def search(answer):
+    return datasearch.Search({'answer': answer})
+
+
+class RunPlansTestCase(SimpleTestCase):
+
+    def run_plans(self, plans):
+        fake = FakeMultiSearch()
+        with mock.patch.object(datasearch, 'multi_search', fake):
+            results = datasearch.run_plans(plans)
+        return results, fake.rounds
+
+    def test_rounds(self):
+        def two_rounds():
+            first = yield search({'value': 1})
+            second = yield search({'value': first['value'] + 1})
+            return second['value']
+
+        def one_round():
+            res = yield search({'value': 10})
+            return res['value']
+
+        results, rounds = self.run_plans([two_rounds(), one_round(), two_rounds()])
+        self.assertEqual(results, [2, 10, 2])
+        # the searches of a round are sent together
+        self.assertEqual([len(conditions) for conditions in rounds], [3, 2])
+
+    def test_multi_search_round(self):
+        def task_search(body, *args, **kwargs):
+            record_type = body['query']['bool']['must'][0]['term']['_type']
+            return search(counts((200, 5)) if record_type == 'http' else counts((1408, 2)))
+
+        with mock.patch.object(datasearch, 'task_search', side_effect=task_search):
+            results, rounds = self.run_plans([datasearch.http_result_dist('t', 0, 60000),
+                                              datasearch.http_result_dist('t', 0, 60000)])
+        self.assertEqual(results[0], [{'name': 200, 'value': 5}, {'name': 1408, 'value': 2}])
+        self.assertEqual(results[1], results[0])
+        # both searches of both plans in one msearch
+        self.assertEqual([len(conditions) for conditions in rounds], [4])
+
+    def test_failed_search(self):
+        def recovered():
+            try:
+                yield search({'error': 'shard failure'})
+            except natrix_exception.ClassInsideException:
+                return 'recovered'
+
+        def failed():
+            yield [search({'value': 1}), search({'error': 'shard failure'})]
+            return 'unreachable'
+
+        def succeeded():
+            res = yield search({'value': 1})
+            return res['value']
+
+        results, _ = self.run_plans([recovered(), failed(), succeeded()])
+        self.assertEqual(results[0], 'recovered')
+        self.assertIsInstance(results[1], natrix_exception.ClassInsideException)
+        self.assertEqual(results[2], 1)
+
+    def test_plan_raises(self):
+        def broken():
+            res = yield search({'value': 1})
+            raise ValueError(res['value'])
+
+        def broken_at_start():
+            raise KeyError('chart')
+            yield
+
+        def succeeded():
+            first = yield search({'value': 1})
+            second = yield search({'value': 2})
+            return first['value'] + second['value']
+
+        results, rounds = self.run_plans([broken(), broken_at_start(), succeeded()])
+        self.assertIsInstance(results[0], ValueError)
+        self.assertIsInstance(results[1], KeyError)
+        self.assertEqual(results[2], 3)
+        self.assertEqual([len(conditions) for conditions in rounds], [2, 1])
+
+
+class FakeTask(object):
+    id = 'task'
+    scope = 'public'
+    group = None
+
+    class command:
+        protocol_type = 'ping'
+
+
+class TimedTaskBatchAnalyseSerializerTestCase(SimpleTestCase):
+
+    def is_valid(self, charts):
+        serializer = analyse_serializer.TimedTaskBatchAnalyseSerializer(data={
+            'task_id': str(uuid.uuid4()),
+            'charts': charts,
+            'start_time': 0,
+            'end_time': 60000,
+        })
+        with mock.patch.object(analyse_serializer.Task.objects, 'get', return_value=FakeTask()):
+            return serializer.is_valid(), serializer.errors
+
+    def test_charts(self):
+        valid, _ = self.is_valid([{'view_point': 'time', 'chart_name': 'delay'},
+                                  {'view_point': 'region', 'chart_name': 'packet_loss'}])
+        self.assertTrue(valid)
+
+        valid, errors = self.is_valid([{'view_point': 'time', 'chart_name': 'delay'},
+                                       {'view_point': 'time', 'chart_name': 'request'},
+                                       {'view_point': 'unknown', 'chart_name': 'delay'}])
+        self.assertFalse(valid)
+        self.assertEqual(len(errors['charts']), 2)
+
+        valid, errors = self.is_valid([])
+        self.assertFalse(valid)
+        self.assertIn('charts', errors)
+
+        valid, errors = self.is_valid([{'view_point': 'time', 'chart_name': 'delay'}] * 33)
+        self.assertFalse(valid)
+        self.assertIn('charts', errors)
+
+        valid, errors = self.is_valid([{'view_point': 'time'}])
+        self.assertFalse(valid)
+        self.assertIn('charts', errors)
+
+    def test_analyse(self):
+        serializer = analyse_serializer.TimedTaskBatchAnalyseSerializer(data={})
+        serializer.instance = FakeTask()
+        serializer._validated_data = {
+            'charts': [{'view_point': 'region', 'chart_name': 'delay'},
+                       {'view_point': 'region', 'chart_name': 'packet_loss'}],
+            'start_time': 0,
+            'end_time': 60000,
+        }
+        with mock.patch.object(datasearch, 'run_plans',
+                               return_value=[{'name': 'delay'}, natrix_exception.ClassInsideException(
+                                   message='shard failure')]):
+            analyse_data = serializer.analyse()
+        self.assertEqual(analyse_data[0], {'view_point': 'region', 'chart_name': 'delay',
+                                           'info': {'name': 'delay'}})
+        # a failed chart doesn't fail the others
+        self.assertIn('shard failure', analyse_data[1]['error'])
+
+
+class TimedTaskAnalysePlanTestCase(SimpleTestCase):
+
+    def test_configured_charts(self):
+        # every chart of the configuration is a plan
+        for protocol_type, view_points in analyse_serializer.TimedTaskAnalyseSerializer.ANALYSE_CONFIGURATION.items():
+            for view_point, charts in view_points.items():
+                for chart_name, chart_configuration in charts.items():
+                    analyse_function = getattr(analyse_serializer.TimedTaskAnalyseSerializer,
+                                               chart_configuration['analyse'], None)
+                    self.assertTrue(inspect.isgeneratorfunction(analyse_function),
+                                    (protocol_type, view_point, chart_name))
+
+    def test_unknown_chart(self):
+        serializer = analyse_serializer.TimedTaskAnalyseSerializer(instance=FakeTask())
+        self.assertTrue(inspect.isgenerator(serializer.analyse_plan('region', 'delay')))
+        for view_point, chart_name in (('region', 'request'), ('unknown', 'delay')):
+            with self.assertRaises(natrix_exception.ClassInsideException):
+                serializer.analyse_plan(view_point, chart_name)
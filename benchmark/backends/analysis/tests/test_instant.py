@@ -0,0 +1,121 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from benchmark.backends import analysis
+from benchmark.backends.analysis.instant import INSTANT_ANALYSE_ENGINES
+
+
+def ping_record(province, orgs, avg_time, packet_send=10, packet_loss=1):
+    return {
+        'terminal': 't1',
+        'province': province,
+        'organization_id': [org[0] for org in orgs],
+        'organization_name': [org[1] for org in orgs],
+        'packet_send': packet_send,
+        'packet_loss': packet_loss,
+        'packet_receive': packet_send - packet_loss,
+        'avg_time': avg_time,
+        'min_time': avg_time / 2,
+        'max_time': avg_time * 2,
+    }
+
+
+class PingInstantAnalyseTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.dial_data = {
+            'success': [
+                ping_record('bj', [(1, 'a')], 10.0),
+                ping_record('bj', [(1, 'a'), (2, 'b')], 30.0),
+                ping_record('sh', [], 50.0, packet_loss=0),
+            ],
+            'error': [{'terminal': 't2', 'errorinfo': 'timeout'}]
+        }
+
+    def test_charts(self):
+        engine = INSTANT_ANALYSE_ENGINES['ping']().feed(self.dial_data)
+        self.assertEqual(engine.record_count, 4)
+
+        self.assertEqual(engine.chart('region', 'delay')['values'],
+                         [{'name': 'bj', 'value': 20.0}, {'name': 'sh', 'value': 50.0}])
+        top = engine.chart('organization', 'top')
+        self.assertEqual(top['x-axis'], ['b', 'a'])
+        self.assertEqual(top['viewpoints'][0]['values'], [30.0, 20.0])
+        self.assertEqual(sum(engine.chart('organization', 'distribution')['viewpoints'][0]['values']), 2)
+        self.assertEqual(len(engine.chart('detail')['error']), 1)
+
+    def test_build_is_same_as_view_point_engine(self):
+        charts = INSTANT_ANALYSE_ENGINES['ping']().feed(self.dial_data).build()
+        self.assertEqual(set(charts), {'region', 'organization', 'detail'})
+
+        for view_point, view_charts in charts.items():
+            engine = INSTANT_ANALYSE_ENGINES['ping'](view_points=[view_point]).feed(self.dial_data)
+            self.assertEqual(engine.charts(view_point), view_charts)
+
+    def test_load_organization_is_same_as_feed(self):
+        # the terms aggregation of the successful records by organization name
+        organizations = {}
+        for record in self.dial_data['success']:
+            for name in record['organization_name']:
+                org = organizations.setdefault(name, {'name': name, 'count': 0})
+                org['count'] += 1
+                for key in INSTANT_ANALYSE_ENGINES['ping'].organization_metrics:
+                    org[key] = org.get(key, 0) + record[key]
+
+        engine = INSTANT_ANALYSE_ENGINES['ping'](view_points=['organization'])
+        engine.load_organization(list(organizations.values()))
+        self.assertEqual(engine.charts('organization'),
+                         INSTANT_ANALYSE_ENGINES['ping'](view_points=['organization'])
+                         .feed(self.dial_data).charts('organization'))
+
+
+class FakeTask(object):
+    id = 'task'
+    result_snapshot = None
+
+    class command:
+        protocol_type = 'ping'
+
+
+class FinishInstantTaskTestCase(SimpleTestCase):
+
+    def setUp(self):
+        success = [ping_record('bj', [(1, 'a')], 10.0), ping_record('sh', [], 50.0)]
+        success[0]['response_body'] = 'body'
+        self.dial_data = {'success': success, 'error': [{'terminal': 't2', 'errorinfo': 'timeout'}]}
+
+    def test_snapshot(self):
+        class Records(object):
+            # a record stream, it can be iterated once
+            def __init__(self, records):
+                self.records = iter(records)
+
+            def __iter__(self):
+                return self.records
+
+        stream = {'success': Records(self.dial_data['success']), 'error': Records(self.dial_data['error'])}
+        task = FakeTask()
+        with mock.patch.object(analysis.command_dispatcher, 'stream_task_data', return_value=stream) as stream_task_data, \
+                mock.patch.object(analysis, 'cache') as cache, \
+                mock.patch.object(analysis, 'get_instant_engines', return_value=INSTANT_ANALYSE_ENGINES):
+            counts = analysis.finish_instant_task(task)
+
+        stream_task_data.assert_called_once_with('task', source=None)
+        self.assertEqual(counts, {'success': 2, 'error': 1})
+        # the snapshot has the whole records
+        self.assertEqual(json.loads(task.result_snapshot), self.dial_data)
+
+        charts = cache.set_many.call_args[0][0]
+        self.assertEqual(set(charts), {analysis._cache_key('task', v) for v in ('region', 'organization', 'detail')})
+        expected = INSTANT_ANALYSE_ENGINES['ping']().feed(self.dial_data).build()
+        self.assertEqual(charts[analysis._cache_key('task', 'region')], expected['region'])
+
+    def test_not_iterated(self):
+        # the sections which the engine doesn't iterate are written by snapshot()
+        stream = analysis.SnapshotStream(self.dial_data)
+        self.assertEqual([record.get('response_body') for record in stream.get('success')], [None, None])
+        self.assertEqual(json.loads(stream.snapshot()), self.dial_data)
+        self.assertEqual(json.loads(analysis.SnapshotStream({'success': [], 'error': []}).snapshot()),
+                         {'success': [], 'error': []})
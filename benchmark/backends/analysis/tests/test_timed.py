@@ -0,0 +1,53 @@
+from django.test import SimpleTestCase, override_settings
+
+from benchmark.backends.analysis import timed
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'timed-analyse-tests',
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedHistogramTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.searches = []
+
+    def search(self, start_time, end_time):
+        self.searches.append((start_time, end_time))
+        return dict((key, {'count': key}) for key in range(start_time, end_time, 1000))
+
+    def histogram(self, start_time, end_time, now):
+        return timed.cached_histogram('task', 'chart', start_time, end_time, 1000, self.search,
+                                      now=now + timed.TIMED_ANALYSE_CACHE_DELAY)
+
+    def test_bucket_keys(self):
+        self.assertEqual(timed.bucket_keys(1500, 3000, 1000), [1000, 2000, 3000])
+        self.assertEqual(timed.bucket_keys(1000, 2999, 1000), [1000, 2000])
+
+    def test_closed_buckets_cached(self):
+        buckets = self.histogram(10500, 14200, now=14500)
+        self.assertEqual([key for key, _ in buckets], [10000, 11000, 12000, 13000, 14000])
+        self.assertEqual(buckets[0], (10000, {'count': 10000}))
+        self.assertEqual(self.searches, [(10000, 15000)])
+
+        # only the open tail bucket is searched again
+        self.histogram(10500, 14900, now=14900)
+        self.assertEqual(self.searches[-1], (14000, 15000))
+
+        # a moved window searches the open buckets
+        buckets = self.histogram(11000, 15100, now=15200)
+        self.assertEqual(self.searches[-1], (14000, 16000))
+        self.assertEqual(buckets[-1], (15000, {'count': 15000}))
+
+    def test_ingest_delay(self):
+        clean_time = timed.TIMED_ANALYSE_CACHE_DELAY - timed.TIMED_ANALYSE_INGEST_DELAY
+        # past command_clean_time, but the records may still be ingested
+        timed.cached_histogram('task', 'ingest', 10000, 10999, 1000, self.search,
+                               now=11000 + clean_time + timed.TIMED_ANALYSE_INGEST_DELAY - 1)
+        timed.cached_histogram('task', 'ingest', 10000, 10999, 1000, self.search,
+                               now=11000 + clean_time + timed.TIMED_ANALYSE_INGEST_DELAY - 1)
+        self.assertEqual(len(self.searches), 2)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Bucket-aligned cache of the timed task analysis (time view point).
+
+A time chart is a date histogram, the buckets are aligned to the multiples of the interval
+(epoch millisecond), so the value of a bucket doesn't depend on the requested window. Each
+bucket is cached by (task, chart, interval, bucket key):
+
+ - a closed bucket (its end plus command_clean_time plus the ingest delay is in the past, no
+   more record can arrive) is cached for timed_analyse_cache_timeout;
+ - an open bucket (the tail of a running task) is never cached, it's recomputed.
+
+The ingest delay is the time a response takes to reach a search: the store batch age, the bulk
+interval and the refresh of Elasticsearch, plus timed_analyse_ingest_delay. A record delayed
+longer (e.g. spooled during a store outage) may be missing in a cached bucket, so the closed
+buckets expire after timed_analyse_cache_timeout, instead of never.
+
+A chart request reads all buckets with one cache read, and searches only the buckets which
+are not cached (one search from the first missed bucket to the last one). BucketCache splits
+these steps, so the search can be sent with the searches of other charts.
+
+"""
+from __future__ import unicode_literals
+import logging, time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from natrix.common.config import natrix_config
+
+logger = logging.getLogger(__name__)
+
+# the refresh interval (millisecond) of the benchmark indices, the default of Elasticsearch
+ES_REFRESH_INTERVAL = 1000
+# a record is searchable at most TIMED_ANALYSE_INGEST_DELAY (millisecond) after its response
+TIMED_ANALYSE_INGEST_DELAY = (settings.BENCHMARK_STORE_BATCH_AGE +
+                              int(natrix_config.get_value('ELASTICSEARCH', 'bulk_interval')) +
+                              ES_REFRESH_INTERVAL +
+                              int(natrix_config.get_value('BENCHMARK', 'timed_analyse_ingest_delay')))
+# a response arrives at most command_clean_time (millisecond) after the task is generated
+TIMED_ANALYSE_CACHE_DELAY = int(natrix_config.get_value('BENCHMARK', 'command_clean_time')) + \
+    TIMED_ANALYSE_INGEST_DELAY
+# 0 means the closed buckets never expire
+TIMED_ANALYSE_CACHE_TIMEOUT = int(natrix_config.get_value('BENCHMARK', 'timed_analyse_cache_timeout')) or None
+# change it when the bucket values change, so the cached buckets are not used
+TIMED_ANALYSE_CACHE_VERSION = 1
+
+
+def bucket_keys(start_time, end_time, interval):
+    """The keys of the buckets which cover [start_time, end_time]."""
+    first_key = start_time // interval * interval
+    last_key = end_time // interval * interval
+    return list(range(first_key, last_key + interval, interval))
+
+
+def _cache_key(task_id, chart, interval, key):
+    return 'benchmark_timed_analyse_{}_{}_{}_{}_{}'.format(
+        TIMED_ANALYSE_CACHE_VERSION, task_id, chart, interval, key)
+
+
+class BucketCache(object):
+    """The buckets of a time chart in a window: the cached buckets are read when it's created,
+    the missed buckets are searched by the caller (missed_range) and stored (update).
+
+    """
+
+    def __init__(self, task_id, chart, start_time, end_time, interval, now=None):
+        """
+        :param task_id:
+        :param chart: the chart name, a part of the cache key
+        :param start_time: millisecond
+        :param end_time: millisecond
+        :param interval: the bucket interval (millisecond, integer)
+        :param now: millisecond, the current time by default
+        """
+        self.task_id = task_id
+        self.chart = chart
+        self.interval = int(interval)
+        if now is None:
+            now = int(time.time() * 1000)
+        self.closed_time = now - TIMED_ANALYSE_CACHE_DELAY
+
+        self.keys = bucket_keys(int(start_time), int(end_time), self.interval)
+        self.cache_keys = dict((key, _cache_key(task_id, chart, self.interval, key)) for key in self.keys)
+        closed_keys = [key for key in self.keys if self.is_closed(key)]
+        cached = cache.get_many([self.cache_keys[key] for key in closed_keys])
+
+        self.buckets = dict((key, cached[self.cache_keys[key]])
+                            for key in closed_keys if self.cache_keys[key] in cached)
+        self.missed_keys = [key for key in self.keys if key not in self.buckets]
+
+    def is_closed(self, key):
+        return key + self.interval <= self.closed_time
+
+    def missed_range(self):
+        """The range [start_time, end_time) of the buckets to search, None if all are cached.
+
+        """
+        if not self.missed_keys:
+            return None
+        return self.missed_keys[0], self.missed_keys[-1] + self.interval
+
+    def update(self, searched):
+        """Store the searched buckets, the closed buckets are cached.
+
+        :param searched: {bucket key: bucket value}
+        """
+        self.buckets.update((key, searched.get(key)) for key in self.missed_keys)
+        cache.set_many(dict((self.cache_keys[key], self.buckets[key]) for key in self.missed_keys
+                            if self.is_closed(key) and self.buckets[key] is not None),
+                       TIMED_ANALYSE_CACHE_TIMEOUT)
+        logger.debug('Timed analyse {} of task({}): {} buckets, {} searched'.format(
+            self.chart, self.task_id, len(self.keys), len(self.missed_keys)))
+        self.missed_keys = []
+
+    def result(self):
+        """
+        :return: [(bucket key, bucket value)], the missing buckets are None
+        """
+        return [(key, self.buckets.get(key)) for key in self.keys]
+
+
+def cached_histogram(task_id, chart, start_time, end_time, interval, search, now=None):
+    """The buckets of a time chart, read from the cache or searched.
+
+    :param search: search(start_time, end_time) -> {bucket key: bucket value}, the bucket values
+                   of the whole buckets in the range [start_time, end_time)
+    :return: [(bucket key, bucket value)], the missing buckets are None
+    """
+    bucket_cache = BucketCache(task_id, chart, start_time, end_time, interval, now=now)
+    missed_range = bucket_cache.missed_range()
+    if missed_range is not None:
+        bucket_cache.update(search(*missed_range))
+
+    return bucket_cache.result()
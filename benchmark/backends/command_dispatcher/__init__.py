@@ -8,7 +8,8 @@ import pprint
 from .processor import DispatchProcessor, ResponseExpiryProcessor
 from .channels.rabbitmq import RabbitMQChannel
 from .states import CommandAPI
-from .query import get_command_data, get_task_data
+from .query import (get_command_data, get_task_data, count_task_data, stream_task_data,
+                    aggregate_task_organizations, distribute_task_values, ANALYSE_SOURCE)
 
 def dispatch_command(data):
     """
@@ -38,16 +39,38 @@ def dispatch_command(data):
     fail_record = processor.get_fail_record()
 
 
+def dispatch_internal_command(data):
+    """Dispatch a task command from a trusted internal caller.
+
+    The data must be constructed by Task.task_command_represent, it's not validated again.
+    The external (API) input must use dispatch_command.
+
+    :param data: the same structure as dispatch_command
+    :return:
+    """
+    processor = DispatchProcessor(data, trusted=True)
+    processor.process()
+
+    fail_record = processor.get_fail_record()
+
+
 def get_process_client(channel, type):
     return RabbitMQChannel(channel, type)
 
 
 def response_expired_process(freshness=300000):
-    expired_list = CommandAPI.clean_expired_commands(freshness=freshness)
+    """Process the expired command instances.
+
+    :return: the clean stats, {'scanned': 0, 'expired': 0}
+    """
+    stats = {'scanned': 0, 'expired': 0}
+    expired_list = CommandAPI.clean_expired_commands(freshness=freshness, stats=stats)
     for command in expired_list:
         processor = ResponseExpiryProcessor(data=command)
         processor.process()
 
+    return stats
+
 
 def test():
     terminal_info = {
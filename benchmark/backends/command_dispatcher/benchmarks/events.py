@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the response pipeline objects: plain dicts vs slotted events.
+
+Usage (from the project root):
+
+    python manage.py shell -c \
+        "from benchmark.backends.command_dispatcher.benchmarks import events; events.run()"
+
+"""
+from __future__ import unicode_literals
+import time, tracemalloc
+
+from ..serializers.compiled_response import CompiledTerminalResponse
+from .response_validation import sample_responses
+
+TASK_INFO = {'task_id': '78b05299-8f64-4d0b-af42-b3df4ab90461', 'task_generate_time': 1111.1}
+
+
+def _serializers():
+    serializers = []
+    for response, command_protocols in sample_responses():
+        serializer = CompiledTerminalResponse(data=response,
+                                              context={'command_protocols': command_protocols})
+        assert serializer.is_valid()
+        serializers.append(serializer)
+    return serializers
+
+
+def dict_pipeline(serializer):
+    """The dict pipeline: representation, the task template and the store record."""
+    data_template = serializer.representation()
+    data_template['province'] = '北京'
+    data_template['city'] = '北京'
+    record = dict(data_template)
+    record['task_id'] = TASK_INFO['task_id']
+    record['task_generate_time'] = int(TASK_INFO['task_generate_time'] * 1000)
+    message = {'_type': serializer.get_message_type()}
+    message.update(record)
+    return data_template, message
+
+
+def event_pipeline(serializer):
+    """The event pipeline: an event, serialized once at the store boundary."""
+    event = serializer.to_event()
+    event.province = '北京'
+    event.city = '北京'
+    event.set_task(TASK_INFO)
+    return event, event.to_record()
+
+
+def _measure(pipeline, serializers, count):
+    # the retained memory of the pipeline objects (before the store boundary)
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    retained = [pipeline(serializers[i % len(serializers)])[0] for i in range(count)]
+    retained_size = sum(stat.size_diff for stat in
+                        tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    del retained
+    tracemalloc.stop()
+
+    # the allocated blocks and the cost of each response
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    results = [pipeline(serializers[i % len(serializers)]) for i in range(count)]
+    blocks = sum(stat.count_diff for stat in
+                 tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    del results
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for i in range(count):
+        pipeline(serializers[i % len(serializers)])
+    cost = time.perf_counter() - start
+
+    return retained_size / count, blocks / count, cost * 1e6 / count
+
+
+def run(count=10000):
+    serializers = _serializers()
+    for serializer in serializers:
+        representation = serializer.representation()
+        representation.pop('response_process_time')
+        event = serializer.to_event().to_dict()
+        event.pop('response_process_time')
+        assert representation == event, (representation, event)
+
+    print('Process {} responses'.format(count))
+    for name, pipeline in [('dict', dict_pipeline), ('event', event_pipeline)]:
+        retained, blocks, cost = _measure(pipeline, serializers, count)
+        print('  {:6s} retained {:7.1f} bytes/event, {:5.1f} blocks/response, {:5.2f} us/response'.format(
+            name, retained, blocks, cost))
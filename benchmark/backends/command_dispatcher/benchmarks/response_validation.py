@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of terminal response validation: DRF serializer vs compiled specs.
+
+Usage (from the project root):
+
+    python manage.py shell -c \
+        "from benchmark.backends.command_dispatcher.benchmarks import response_validation; response_validation.run()"
+
+"""
+from __future__ import unicode_literals
+import copy, time, uuid
+
+from ..serializers.response import TerminalResponse
+from ..serializers.compiled_response import CompiledTerminalResponse
+
+LOCATION = {
+    'country': '中国',
+    'region': '华北',
+    'province': '北京',
+    'city': '北京',
+    'county': '海淀',
+    'isp': '联通'
+}
+
+
+def _stamp():
+    now = time.time()
+    return {
+        'server_request_generate_time': now - 3,
+        'terminal_request_receive_time': now - 2,
+        'terminal_request_send_time': now - 1,
+        'terminal_response_receive_time': now - 0.5,
+        'terminal_response_return_time': now,
+    }
+
+
+def sample_responses():
+    """A response of each protocol and an error response.
+
+    :return: a list of (response, command_protocols)
+    """
+    ping = {
+        'destination': 'www.baidu.com',
+        'destination_ip': '220.181.38.148',
+        'destination_location': LOCATION,
+        'packet_send': 5,
+        'packet_receive': 5,
+        'packet_loss': 0,
+        'packet_size': 64,
+        'avg_time': 20.5,
+        'max_time': 31.2,
+        'min_time': 'null',
+    }
+    http = {
+        'url': 'https://www.baidu.com',
+        'last_url': 'https://www.baidu.com/index.html',
+        'status_code': 200,
+        'redirect_count': 1,
+        'redirect_time': 0.01,
+        'remote_ip': '220.181.38.148',
+        'remote_location': LOCATION,
+        'remote_port': 443,
+        'local_ip': '10.0.0.2',
+        'local_location': LOCATION,
+        'local_port': 52011,
+        'total_time': 0.3,
+        'period_nslookup': 0.01,
+        'period_tcp_connect': 0.02,
+        'period_ssl_connect': 0.05,
+        'period_request': 0.01,
+        'period_response': 0.1,
+        'period_transfer': 0.11,
+        'size_upload': 0,
+        'size_download': 2381,
+        'speed_upload': 0,
+        'speed_download': 21645.4,
+        'response_header': 'HTTP/1.1 200 OK',
+    }
+    dns = {
+        'ips': [{'ip': '220.181.38.148', 'location': LOCATION},
+                {'ip': '220.181.38.149', 'location': None}],
+        'destination': 'www.baidu.com',
+        'ptime': 12.3,
+        'dns_server': {'ip': '114.114.114.114', 'location': LOCATION},
+    }
+    traceroute = [
+        {'seq': seq, 'routes': [{'ip': '10.0.{}.1'.format(seq), 'hostname': 'hop-{}'.format(seq),
+                                 'location': LOCATION, 'response_times': 1.2 * seq}]}
+        for seq in range(1, 16)
+    ]
+    error = {'errorcode': 1404, 'errorinfo': 'Can not resolve the domain name'}
+
+    responses = []
+    for protocol, data, status in [('ping', ping, 0), ('http', http, 0), ('dns', dns, 0),
+                                   ('traceroute', traceroute, 0), ('ping', error, 1)]:
+        command_uuid = str(uuid.uuid4())
+        responses.append(({
+            'command': {'uuid': command_uuid, 'terminal': '00:16:3e:00:00:01'},
+            'status': status,
+            'data': data,
+            'stamp': _stamp()
+        }, {command_uuid: protocol}))
+    return responses
+
+
+def _validate(serializer_class, responses, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        for response, command_protocols in responses:
+            serializer = serializer_class(data=response, context={'command_protocols': command_protocols})
+            if not serializer.is_valid():
+                raise AssertionError(serializer.format_errors())
+            serializer.representation()
+    return time.perf_counter() - start
+
+
+def check_equivalence(responses):
+    """The compiled path produces the same output as the DRF serializer.
+
+    """
+    for response, command_protocols in responses:
+        context = {'command_protocols': command_protocols}
+        drf = TerminalResponse(data=copy.deepcopy(response), context=context)
+        compiled = CompiledTerminalResponse(data=copy.deepcopy(response), context=context)
+        assert drf.is_valid() and compiled.is_valid()
+        drf_message, compiled_message = drf.representation(), compiled.representation()
+        drf_message.pop('response_process_time')
+        compiled_message.pop('response_process_time')
+        assert drf_message == compiled_message, (drf_message, compiled_message)
+        assert drf.get_message_type() == compiled.get_message_type()
+
+
+def run(count=2000):
+    responses = sample_responses()
+    check_equivalence(responses)
+
+    total = count * len(responses)
+    drf_cost = _validate(TerminalResponse, responses, count)
+    compiled_cost = _validate(CompiledTerminalResponse, responses, count)
+    print('Validate {} responses'.format(total))
+    print('  drf:      {:.3f}s, {:.1f} us/response'.format(drf_cost, drf_cost * 1e6 / total))
+    print('  compiled: {:.3f}s, {:.1f} us/response'.format(compiled_cost, compiled_cost * 1e6 / total))
+    print('  speedup:  {:.1f}x'.format(drf_cost / compiled_cost))
+
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 """
 """
-import json, time
+import json, os, threading, time
+
+import paho.mqtt.client as mqtt
 
 from natrix.common.natrixlog import NatrixLogging
 from natrix.common import exception as natrix_exceptions
+from natrix.common.config import natrix_config
 from utils.natrixmqtt import natrix_mqttclient, publish_result_analyse
 
 from .base import DispachClient
@@ -13,6 +16,181 @@ logger = NatrixLogging(__name__)
 
 
 client_id = 'command_dispacher_{}'
+publisher_id = 'command_publisher_{}_{}'
+
+# The command topics, the subscription contract of terminals:
+#  - natrix/benchmark/{mac}: each terminal, always subscribed;
+#  - the group topics, only used if dispatch_fanout (BENCHMARK) is enabled, a terminal subscribes
+#    natrix/benchmark/region/{province} of its registered province, and natrix/benchmark/org/{id}
+#    of each registered organization and all of its ancestors (the group of an organization
+#    includes the terminals of its descendants, see TerminalAPI.get_group_terminals).
+# A group command is published only if the selected terminals are all available terminals of the
+# group, so no state is registered for a subscribed terminal which is not available (inactive
+# terminal or device): it still runs the command, and its response is processed as a response
+# without task info (a responseDiscard record). Terminals should subscribe the group topics only
+# while they are active.
+GROUP_TOPICS = {
+    'region': 'natrix/benchmark/region/{}',
+    'organization': 'natrix/benchmark/org/{}',
+}
+
+CONFIG_TOPIC = 'MQTT'
+DISPATCH_QOS = int(natrix_config.get_value(CONFIG_TOPIC, 'dispatch_qos'))
+DISPATCH_INFLIGHT = int(natrix_config.get_value(CONFIG_TOPIC, 'dispatch_inflight'))
+DISPATCH_QUEUED = int(natrix_config.get_value(CONFIG_TOPIC, 'dispatch_queued'))
+DISPATCH_TIMEOUT = 10  # second, the longest time waiting for an in-flight slot
+DISPATCH_ACK_TIMEOUT = 30  # second, the slot of a message unacknowledged for longer is released
+
+RESPONSE_CONSUMERS = int(natrix_config.get_value(CONFIG_TOPIC, 'response_consumers'))
+RESPONSE_SHARE_GROUP = natrix_config.get_value(CONFIG_TOPIC, 'response_share_group')
+SHARED_TOPIC = '$share/{group}/{topic}'
+
+
+class MQTTPublisher(object):
+    """A long-lived MQTT publisher.
+
+    The publisher runs the paho network loop in a background thread (loop_start), so the
+    connection is kept alive and reconnected automatically. Publishing is asynchronous and the
+    number of unacknowledged messages is bounded by the in-flight window: publish blocks until a
+    slot is free (back-pressure) instead of waiting for each handshake.
+
+    The slot of a QoS>0 message is released when it is acknowledged, when the connection is lost
+    (paho resends the message after reconnecting, its acknowledgement may never come), or when it
+    is unacknowledged for DISPATCH_ACK_TIMEOUT. Paho keeps at most `queued` messages, the others
+    are rejected (MQTT_ERR_QUEUE_SIZE).
+
+    """
+
+    def __init__(self, inflight=DISPATCH_INFLIGHT, qos=DISPATCH_QOS, queued=DISPATCH_QUEUED):
+        self.qos = qos
+        self.inflight = inflight
+        self.queued = max(queued, inflight)
+        self._slots = threading.BoundedSemaphore(inflight)
+        self._connected = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = {}      # mid -> publish time, the messages holding a slot
+        self._acked = {}        # mid -> acknowledge time, acknowledged before publish returned
+
+        self.client = natrix_mqttclient(publisher_id.format(os.getpid(), time.time()))
+        self.client.max_inflight_messages_set(inflight)
+        self.client.max_queued_messages_set(self.queued)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+
+        self.client.connect_async()
+        self.client.loop_start()
+
+    def _release(self, count=1):
+        for _ in range(count):
+            try:
+                self._slots.release()
+            except ValueError:
+                break
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == mqtt.MQTT_ERR_SUCCESS:
+            logger.info('MQTT publisher is connected')
+            self._connected.set()
+        else:
+            logger.error('MQTT publisher connect with error: {}'.format(mqtt.connack_string(rc)))
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected.clear()
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.error('MQTT publisher is disconnected unexpectedly, reconnecting ...')
+        with self._lock:
+            released = len(self._pending)
+            self._pending.clear()
+        self._release(released)
+
+    def _on_publish(self, client, userdata, mid):
+        # Called by the network thread, it may run before publish returns the mid
+        if self.qos == 0:
+            return
+        with self._lock:
+            if self._pending.pop(mid, None) is None:
+                self._acked[mid] = time.time()
+                return
+        self._release()
+
+    def _expire_pending(self):
+        """Release the slots of the messages unacknowledged for DISPATCH_ACK_TIMEOUT.
+
+        """
+        deadline = time.time() - DISPATCH_ACK_TIMEOUT
+        with self._lock:
+            # in the order of publishing
+            expired = []
+            for mid, publish_time in self._pending.items():
+                if publish_time >= deadline:
+                    break
+                expired.append(mid)
+            for mid in expired:
+                del self._pending[mid]
+            for mid in [mid for mid, ack_time in self._acked.items() if ack_time < deadline]:
+                del self._acked[mid]
+        if expired:
+            logger.error('MQTT publisher releases {} unacknowledged messages'.format(len(expired)))
+        self._release(len(expired))
+
+    def wait_connected(self, timeout=DISPATCH_TIMEOUT):
+        return self._connected.wait(timeout)
+
+    def publish(self, topic, payload):
+        """Publish a serialized payload.
+
+        :return: mqtt.MQTTMessageInfo
+        """
+        if not self._slots.acquire(blocking=False):
+            self._expire_pending()
+            if not self._slots.acquire(timeout=DISPATCH_TIMEOUT):
+                raise natrix_exceptions.ClassInsideException(
+                    message=u'MQTT publisher in-flight window({}) is full'.format(self.inflight))
+
+        res = self.client.publish(topic=topic, payload=payload, qos=self.qos, retain=False)
+        if self.qos == 0 or not self.is_queued(res):
+            # No acknowledgement will come for this message
+            self._release()
+            return res
+
+        with self._lock:
+            if self._acked.pop(res.mid, None) is None:
+                self._pending[res.mid] = time.time()
+                return res
+        self._release()
+        return res
+
+    def is_queued(self, res):
+        """Whether the message is accepted, QoS>0 messages are resent after reconnecting.
+
+        """
+        return res.rc == mqtt.MQTT_ERR_SUCCESS or \
+            (res.rc == mqtt.MQTT_ERR_NO_CONN and self.qos > 0)
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+_publisher = None
+_publisher_pid = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    """Get the publisher of the current process.
+
+    A publisher is created for each (forked) worker process and reused by all dispatches.
+
+    """
+    global _publisher, _publisher_pid
+    with _publisher_lock:
+        if _publisher is None or _publisher_pid != os.getpid():
+            _publisher = MQTTPublisher()
+            _publisher_pid = os.getpid()
+        return _publisher
 
 
 class MQTTDispachClient(DispachClient):
@@ -22,46 +200,139 @@ class MQTTDispachClient(DispachClient):
 
     def __init__(self):
         super(MQTTDispachClient, self).__init__()
+        self.client = None
 
     def __enter__(self):
-        client = natrix_mqttclient(client_id.format(time.time()))
-        self.client = client
         return self
 
+    @property
+    def publisher(self):
+        return get_publisher()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        print('end of connection')
-        self.client.disconnect()
+        # The publisher is shared by the process, only close the subscribe connection.
+        if self.client is not None:
+            self.client.disconnect()
 
-    def command_dispach(self, mac, command_info):
-        if not self.client.is_connected():
-            self.client.connect()
+    def command_dispach(self, mac, command_info, payload=None):
+        """Dispatch command to a terminal.
+
+        :param payload: the serialized command_info, serialize command_info if it is None
+        """
+        if payload is None:
+            payload = json.dumps(command_info)
         logger.info('MQTT dispatch command | {} | {} | {}'.format(
             mac, command_info.get('uuid'), command_info.get('generate_timestamp')))
         topic_str = 'natrix/benchmark/{}'.format(mac)
-        res = self.client.publish(topic=topic_str,
-                                  payload=json.dumps(command_info),
-                                  qos=2,
-                                  retain=False)
+        res = self.publisher.publish(topic=topic_str, payload=payload)
 
         publish_result_analyse(res, logger=logger, service='Benchmark command dispach')
+        return res
+
+    def command_dispach_batch(self, macs, command_info):
+        """Dispatch the same command to a list of terminals.
+
+        The command is serialized once, and publishing is only throttled by the in-flight window.
+
+        :return: a dict, mac -> error, the terminals which are failed to publish
+        """
+        if not macs:
+            return {}
 
-    def response_subscribe(self, topic='natrix/response', celery_task=None):
+        payload = json.dumps(command_info)
+        if not self.publisher.wait_connected():
+            logger.error('MQTT publisher is not connected, messages are queued to publish')
+
+        failures = {}
+        for mac in macs:
+            try:
+                res = self.command_dispach(mac, command_info, payload=payload)
+                if not self.publisher.is_queued(res):
+                    failures[mac] = mqtt.error_string(res.rc)
+            except Exception as e:
+                natrix_exceptions.natrix_traceback()
+                failures[mac] = e
+
+        return failures
+
+    def command_dispach_group(self, group_type, value, command_info):
+        """Dispatch command to a group topic, all terminals in the group subscribe it.
+
+        :return: True if the command is accepted by publisher
+        """
+        topic_str = GROUP_TOPICS[group_type].format(value)
+        logger.info('MQTT dispatch group command | {} | {} | {}'.format(
+            topic_str, command_info.get('uuid'), command_info.get('generate_timestamp')))
+        if not self.publisher.wait_connected():
+            logger.error('MQTT publisher is not connected, messages are queued to publish')
+        res = self.publisher.publish(topic=topic_str, payload=json.dumps(command_info))
+
+        publish_result_analyse(res, logger=logger, service='Benchmark group command dispach')
+        return self.publisher.is_queued(res)
+
+    def response_subscribe(self, topic='natrix/response', celery_task=None, batch_size=1,
+                           batch_interval=200):
+        """Subscribe terminal responses.
+
+        If batch_size > 1, the responses are collected for up to batch_size messages or
+        batch_interval milliseconds, and the celery_task is called with a list of responses.
+
+        """
+        batch = []
+        batch_lock = threading.Lock()
+
+        def flush():
+            with batch_lock:
+                if not batch:
+                    return
+                data_list = list(batch)
+                del batch[:]
+            try:
+                celery_task.delay(data_list)
+            except Exception as e:
+                natrix_exceptions.natrix_traceback()
+                logger.error('Process testing response batch with error: {}'.format(e))
 
         def process_response(client, userdata, message):
             try:
                 response_data = json.loads(str(message.payload, encoding='utf-8'))
                 logger.info(response_data)
-                celery_task.delay(response_data)
+                if batch_size > 1:
+                    with batch_lock:
+                        batch.append(response_data)
+                        full = len(batch) >= batch_size
+                    if full:
+                        flush()
+                else:
+                    celery_task.delay(response_data)
             except Exception as e:
                 natrix_exceptions.natrix_traceback()
                 logger.error('Process testing response with error: {}'.format(e))
 
+        # The broker delivers each message to one of the consumers in the shared group, and the
+        # messages are still published with the origin topic.
+        if RESPONSE_CONSUMERS > 1:
+            subscribe_topic = SHARED_TOPIC.format(group=RESPONSE_SHARE_GROUP, topic=topic)
+        else:
+            subscribe_topic = topic
+
         def on_connect(client, userdta, flags, rc):
-            print('subscribe ....')
-            client.subscribe(topic, qos=1)
+            logger.info('Subscribe terminal responses: {}'.format(subscribe_topic))
+            client.subscribe(subscribe_topic, qos=1)
             client.message_callback_add(topic, process_response)
 
+        self.client = natrix_mqttclient(client_id.format('{}_{}'.format(os.getpid(), time.time())))
         self.client.on_connect = on_connect
         self.client.connect(keepalive=10)
 
-        self.client.loop_forever()
+        if batch_size > 1:
+            # The network loop runs in background, and the partial batch is flushed periodically.
+            self.client.loop_start()
+            try:
+                while True:
+                    time.sleep(batch_interval / 1000.0)
+                    flush()
+            finally:
+                self.client.loop_stop()
+        else:
+            self.client.loop_forever()
@@ -7,6 +7,7 @@ import logging, json
 import pika
 
 from natrix.common import exception as natrix_exception
+from natrix.common.mqservice import channel_pool
 from .base import DispachClient
 
 
@@ -45,6 +46,8 @@ class RabbitMQChannel(object):
     def init_request_queue(self, tag):
         try:
             exchange_name = EXCHANGE_REQUEST_TEMPLATE.format(tag=tag)
+            if channel_pool.is_declared(exchange_name):
+                return
 
             self.channel.exchange_declare(exchange=exchange_name, exchange_type='direct')
             self.channel.queue_declare(queue=exchange_name,
@@ -57,6 +60,7 @@ class RabbitMQChannel(object):
             self.channel.queue_bind(exchange=exchange_name,
                                     queue=exchange_name,
                                     routing_key='command')
+            channel_pool.mark_declared(exchange_name)
 
         except Exception as e:
             natrix_exception.natrix_traceback()
@@ -108,6 +112,12 @@ class RabbitMQChannel(object):
             raise natrix_exception.ClassInsideException(message=str(e))
 
     def publish_request(self, data, terminal):
+        """Publish a command request to terminal.
+
+        The message is mandatory, in confirms mode a message not routed to a queue is returned.
+
+        :return: False if the broker nacks or returns the message (in confirms mode)
+        """
         try:
             self.init_request_queue(terminal)
             exchange_name = EXCHANGE_REQUEST_TEMPLATE.format(tag=terminal)
@@ -115,13 +125,22 @@ class RabbitMQChannel(object):
             res = self.channel.basic_publish(exchange=exchange_name,
                                         routing_key='command',
                                         body=json.dumps(data),
-                                        properties=pika.BasicProperties(delivery_mode=2))
+                                        properties=pika.BasicProperties(delivery_mode=2),
+                                        mandatory=True)
 
             logger.debug('Publish a command({}) reqeust: {}'.format(terminal, res))
+            if res is False:
+                logger.error('Command publish: terminal({}), the broker does not deliver'.format(terminal))
+                # The request queue (declared in the cache) may be deleted, declare it again next time
+                channel_pool.clear_declarations()
+                return False
+            return True
 
         except Exception as e:
             natrix_exception.natrix_traceback()
             logger.error('Command publish: terminal({}), error({})'.format(terminal, e))
+            channel_pool.clear_declarations()
+            raise
 
 
 class RabbitMQClient(DispachClient):
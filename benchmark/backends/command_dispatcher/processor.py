@@ -7,19 +7,22 @@ import logging, time
 
 from natrix.common import exception as natrix_exception
 from natrix.common import mqservice
+from benchmark.types.events import ErrorEvent
 
-from .serializers.task import TaskCommandInfo, ExpiredResponseInfo
+from .serializers.task import TaskCommandInfo, InternalTaskCommand, ExpiredResponseInfo
 from .serializers.command import TerminalCommand
-from .serializers.response import TerminalResponse
+from .serializers.compiled_response import get_response_serializer
 
 from .states import CommandAPI
 from .channels.rabbitmq import RabbitMQChannel
 from .channels.mqtt import MQTTDispachClient
-from .store import store_message
+from .store import store_message, store_event, store_events
 from .terminalapi import TerminalAPI
 
 logger = logging.getLogger(__name__)
 
+ResponseSerializer = get_response_serializer()
+
 
 class Processor(object):
     pass
@@ -27,15 +30,24 @@ class Processor(object):
 
 class DispatchProcessor(Processor):
 
-    def __init__(self, data):
+    def __init__(self, data, trusted=False):
+        """
+
+        :param data: task command data
+        :param trusted: the data is from a trusted internal caller (Task.task_command_represent),
+                        which is not validated again.
+        """
         self.data = data
-        serializer = TaskCommandInfo(data=data)
-        if serializer.is_valid():
-            self.serializer = serializer
+        if trusted:
+            self.serializer = InternalTaskCommand.from_represent(data)
         else:
-            logger.error('Dispatch task with wrong format data: {}'.format(
-                    serializer.format_errors()))
-            raise natrix_exception.ClassInsideException('Dispatch task error !')
+            serializer = TaskCommandInfo(data=data)
+            if serializer.is_valid():
+                self.serializer = serializer
+            else:
+                logger.error('Dispatch task with wrong format data: {}'.format(
+                        serializer.format_errors()))
+                raise natrix_exception.ClassInsideException('Dispatch task error !')
 
         self.command_timestamp = time.time()
         self.fail_records = []
@@ -58,7 +70,7 @@ class DispatchProcessor(Processor):
         :return:
         """
         try:
-            with mqservice.MQService.get_purge_channel() as channel:
+            with mqservice.MQService.get_pooled_channel() as channel:
                 terminal_channel = RabbitMQChannel(channel=channel, type='request')
                 data['terminal'] = terminal
                 terminal_channel.publish_request(data=data, terminal=terminal)
@@ -70,35 +82,36 @@ class DispatchProcessor(Processor):
         terminals = self.serializer.get_terminals()
         command_info = self.serializer.get_terminal_command(self.command_timestamp)
         task_tag = self.serializer.get_task_tag()
+        fanout = self.serializer.get_fanout()
         command_uuid = command_info.get('uuid')
+        protocol_type = command_info.get('protocol')
+
+        macs = [terminal.get('mac', None) for terminal in terminals]
+        registry_results = CommandAPI.registry_command_batch(command_uuid=command_uuid,
+                                                             terminals=macs,
+                                                             command_timestamp=self.command_timestamp,
+                                                             command_info=command_info,
+                                                             task_info=task_tag)
 
+        dispatch_macs = []
         with MQTTDispachClient() as client:
-            for terminal in terminals:
-                mac = terminal.get('mac', None)
+            for mac, registry_result in registry_results.items():
+                operation = registry_result.get('operation')
                 try:
-                    available_response = CommandAPI.available_response(command_uuid, mac)
-                    if not(available_response is None):
-                        protocol_type = CommandAPI.get_command_protocol(command_uuid)
-
+                    if operation == 'reused':
+                        available_response = registry_result.get('response')
                         available_response['task_id'] = task_tag.get('task_id', None)
                         available_response['task_generate_time'] = int(task_tag.get('task_generate_time') * 1000)
                         store_message(protocol_type, available_response)
-                        continue
-
-                    registry_result = CommandAPI.registry_command(command_uuid=command_uuid,
-                                                                  terminal=mac,
-                                                                  command_timestamp=self.command_timestamp,
-                                                                  command_info=command_info,
-                                                                  task_info=task_tag)
-                    if registry_result is None:
+                    elif operation == 'update':
+                        pass
+                    elif operation == 'create':
+                        dispatch_macs.append(mac)
+                    elif operation == 'failed':
                         logger.error('Registry command failed.')
                         self.__add_fail_record(mac, command_uuid, 'Registry command error!')
-                    elif registry_result == 'update':
-                        pass
-                    elif registry_result == 'create':
-                        client.command_dispach(mac, command_info)
                     else:
-                        logger.error('Registry command with an unexpected result: {}'.format(registry_result))
+                        logger.error('Registry command with an unexpected result: {}'.format(operation))
                         self.__add_fail_record(mac, command_uuid, 'Registry command error!')
 
                 except Exception as e:
@@ -108,6 +121,22 @@ class DispatchProcessor(Processor):
                     ))
                     self.__add_fail_record(mac, command_uuid, e)
 
+            # Publish to the group topic only if all terminals of the group need the command
+            if fanout and dispatch_macs and len(dispatch_macs) == len(registry_results):
+                try:
+                    if client.command_dispach_group(fanout['type'], fanout['value'], command_info):
+                        return
+                except Exception as e:
+                    natrix_exception.natrix_traceback()
+                    logger.error('Dispatch group({}-{}) command({}) with error: {}'.format(
+                        fanout['type'], fanout['value'], command_uuid, e))
+
+            failures = client.command_dispach_batch(dispatch_macs, command_info)
+            for mac, error in failures.items():
+                logger.error('Dispatch terminal({mac}) command({command_uuid}) with error: {error}'.format(
+                    mac=mac, command_uuid=command_uuid, error=error))
+                self.__add_fail_record(mac, command_uuid, error)
+
 
 class CommandExpiredProcessor(Processor):
     """
@@ -124,13 +153,11 @@ class CommandExpiredProcessor(Processor):
                 serializer.format_errors()))
             raise natrix_exception.ClassInsideException('Process expired command error !')
 
-    def store_expired_result(self, task_tags, data_template):
+    def store_expired_result(self, task_tags, event):
 
         for task_info in task_tags:
-            data_template['task_id'] = task_info.get('task_id', None)
-            data_template['task_generate_time'] = int(task_info.get('task_generate_time', 0) * 1000)
-
-            store_message(type='error', data=data_template)
+            event.set_task(task_info)
+            store_event(event)
 
     def process(self):
         command_uuid = str(self.serializer.validated_data.get('uuid'))
@@ -139,35 +166,35 @@ class CommandExpiredProcessor(Processor):
 
         terminal_info = TerminalAPI(terminal)
 
-        data_template = {
-            'errorcode': 1408,
-            'errorinfo': u'Terminal do not consume',
-            'command_uuid': command_uuid,
-            'command_generate_time': int(command_generate_time * 1000),
-            'terminal': terminal,
-            'response_process_time': int(time.time() * 1000),
-            'terminal_request_receive_time': 0,
-            'terminal_request_send_time': 0,
-            'terminal_response_receive_time': 0,
-            'terminal_response_return_time': 0
-
-        }
-
-        data_template['province'] = terminal_info.get_register_province()
-        data_template['city'] = terminal_info.get_register_city()
+        event = ErrorEvent(
+            errorcode=1408,
+            errorinfo=u'Terminal do not consume',
+            command_uuid=command_uuid,
+            command_generate_time=int(command_generate_time * 1000),
+            terminal=terminal,
+            response_process_time=int(time.time() * 1000),
+            terminal_request_receive_time=0,
+            terminal_request_send_time=0,
+            terminal_response_receive_time=0,
+            terminal_response_return_time=0,
+            province=terminal_info.get_register_province(),
+            city=terminal_info.get_register_city(),
+            organization_id=terminal_info.get_ancestry_ids(),
+            organization_name=terminal_info.get_ancestry_names()
+        )
 
         task_tags = CommandAPI.erase_command(command_uuid, terminal, command_generate_time)
         if task_tags is None:
             logger.error('Expired consuming command without task info!')
         else:
-            self.store_expired_result(task_tags, data_template)
+            self.store_expired_result(task_tags, event)
 
 
 class ResponseProcessor(Processor):
 
     def __init__(self, data):
         self.data = data
-        serializer = TerminalResponse(data=data)
+        serializer = ResponseSerializer(data=data)
         if serializer.is_valid():
             self.serializer = serializer
         else:
@@ -176,19 +203,17 @@ class ResponseProcessor(Processor):
             ))
             raise natrix_exception.ClassInsideException('Process terminal response error!')
 
-    def store_response_result(self, protocol_type, task_tags, data_template):
+    def store_response_result(self, task_tags, event):
         """
         :param task_tags:
-        :param data_template:
+        :param event: the response event
         :return:
         """
         for task_info in task_tags:
-            data_template['task_id'] = task_info.get('task_id', None)
-            data_template['task_generate_time'] = int(task_info.get('task_generate_time', 0) * 1000)
-            res = store_message(protocol_type, data_template)
-            logger.debug('Store response data : {}'.format(res))
+            event.set_task(task_info)
+            store_event(event)
 
-    def store_exception_result(self, data_template):
+    def store_exception_result(self, event):
         """The exception means without task info.
 
         If the command record is timeout, the clean process will clean task information.
@@ -196,51 +221,121 @@ class ResponseProcessor(Processor):
 
         :return:
         """
-        res = store_message('responseDiscard', data_template)
-        logger.debug('Store responseDiscard data : {}'.format(res))
+        store_event(event)
 
     def process(self):
         try:
-            data_template = self.serializer.representation()
-            command_uuid = data_template.get('command_uuid')
-            command_generate_time = data_template.get('command_generate_time') / 1000.0
-            terminal = data_template.get('terminal')
+            event = self.serializer.to_event()
+            command_uuid = event.command_uuid
+            command_generate_time = event.command_generate_time / 1000.0
+            terminal = event.terminal
             logger.info('Command receive process {} | {} | {}'.format(terminal, command_uuid, command_generate_time))
 
             terminal_info = TerminalAPI(terminal)
-            data_template['province'] = terminal_info.get_register_province()
-            data_template['city'] = terminal_info.get_register_city()
+            terminal_info.enrich(event)
 
             # update response data
-            CommandAPI.update_response(command_uuid, terminal, data_template)
+            CommandAPI.update_response(command_uuid, terminal, event.to_dict())
 
             task_tags = CommandAPI.erase_command(command_uuid,
                                                  terminal,
                                                  command_generate_time)
             if task_tags is None:
                 logger.info('Process response data without task info!')
+                self.store_exception_result(self.serializer.to_discard_event())
+            else:
+                logger.debug('Process response data')
+                self.store_response_result(task_tags, event)
 
-                stamp_data = self.serializer.stamp_data()
-                command_data = self.serializer.command_data()
-                response_data = self.serializer.response_data()
-                data_template = {}
+        except Exception as e:
+            natrix_exception.natrix_traceback()
+            logger.error('Process response data with error: {}'.format(e))
+
+
+class ResponseBatchProcessor(Processor):
+    """Process a batch of terminal responses together.
+
+    The command protocols are fetched once, the response updates and the state erases are one
+    call each, terminal register info is looked up once per terminal and all records are stored
+    in one request.
 
-                data_template.update(stamp_data)
-                data_template.update(command_data)
-                data_template['dial_data'] = response_data
-                data_template['expired_time'] = stamp_data['terminal_response_return_time'] - \
-                                                command_data['command_generate_time']
+    """
+
+    def __init__(self, data_list):
+        self.data_list = data_list
+        self.serializers = []
 
-                self.store_exception_result(data_template)
+        command_uuids = set()
+        for data in data_list:
+            try:
+                command_uuids.add(str(data['command']['uuid']))
+            except Exception:
+                continue
+        context = {'command_protocols': CommandAPI.get_command_protocols(command_uuids)}
+
+        for data in data_list:
+            serializer = ResponseSerializer(data=data, context=context)
+            if serializer.is_valid():
+                self.serializers.append(serializer)
             else:
-                logger.debug('Process response data')
-                self.store_response_result(self.serializer.get_message_type(),
-                                           task_tags,
-                                           data_template)
+                logger.error('Process terminal response with wrong format data: {}'.format(
+                    serializer.format_errors()
+                ))
+
+    @staticmethod
+    def get_terminal_info(terminal):
+        """The register info of a terminal, a failed lookup (e.g. the database) only loses the
+        enrichment of the responses of the terminal, not the batch.
 
+        """
+        try:
+            return TerminalAPI(terminal)
         except Exception as e:
             natrix_exception.natrix_traceback()
-            logger.error('Process response data with error: {}'.format(e))
+            logger.error('Get register info of terminal({}) with error: {}'.format(terminal, e))
+            return TerminalAPI(terminal, lookup=False)
+
+    def process(self):
+        responses = []
+        for serializer in self.serializers:
+            try:
+                responses.append((serializer, serializer.to_event()))
+            except Exception as e:
+                natrix_exception.natrix_traceback()
+                logger.error('Process response data with error: {}'.format(e))
+
+        terminal_infos = {}
+        for _, event in responses:
+            terminal = event.terminal
+            if terminal not in terminal_infos:
+                terminal_infos[terminal] = self.get_terminal_info(terminal)
+            terminal_infos[terminal].enrich(event)
+
+        CommandAPI.update_response_batch(
+            [(e.command_uuid, e.terminal, e.to_dict()) for _, e in responses])
+        tags_list = CommandAPI.erase_command_batch(
+            [(e.command_uuid, e.terminal, e.command_generate_time / 1000.0)
+             for _, e in responses])
+
+        events = []
+        for (serializer, event), task_tags in zip(responses, tags_list):
+            try:
+                if task_tags is None:
+                    logger.info('Process response data without task info!')
+                    events.append(serializer.to_discard_event())
+                else:
+                    for index, task_info in enumerate(task_tags):
+                        # an event is copied only for the additional tasks
+                        task_event = event if index == 0 else event.copy()
+                        task_event.set_task(task_info)
+                        events.append(task_event)
+            except Exception as e:
+                natrix_exception.natrix_traceback()
+                logger.error('Process response data with error: {}'.format(e))
+
+        store_events(events)
+        logger.info('Process a batch of {} responses, store {} records'.format(
+            len(self.data_list), len(events)))
 
 
 class ResponseExpiryProcessor(Processor):
@@ -261,12 +356,11 @@ class ResponseExpiryProcessor(Processor):
 
         self._fail_record = []
 
-    def store_expired_result(self, task_tags, data_template):
+    def store_expired_result(self, task_tags, event):
         for task_info in task_tags:
             try:
-                data_template['task_id'] = task_info.get('task_id', None)
-                data_template['task_generate_time'] = int(task_info.get('task_generate_time', 0) * 1000)
-                store_message(type='error', data=data_template)
+                event.set_task(task_info)
+                store_event(event)
             except Exception as e:
                 logger.error('Store ResponseExpired message with error: {}'.format(e))
                 natrix_exception.natrix_traceback()
@@ -283,23 +377,24 @@ class ResponseExpiryProcessor(Processor):
         try:
             terminal_info = TerminalAPI(terminal)
 
-            data_template = {
-                'errorcode': 2408,
-                'errorinfo': u'Terminal response timeout',
-                'command_uuid': command_uuid,
-                'command_generate_time': command_generate_time * 1000,
-                'terminal': terminal,
-                'response_process_time': int(time.time() * 1000),
-                'terminal_request_receive_time': 0,
-                'terminal_request_send_time': 0,
-                'terminal_response_receive_time': 0,
-                'terminal_response_return_time': 0
-            }
-
-            data_template['province'] = terminal_info.get_register_province()
-            data_template['city'] = terminal_info.get_register_city()
-
-            self.store_expired_result(task_tags, data_template)
+            event = ErrorEvent(
+                errorcode=2408,
+                errorinfo=u'Terminal response timeout',
+                command_uuid=command_uuid,
+                command_generate_time=command_generate_time * 1000,
+                terminal=terminal,
+                response_process_time=int(time.time() * 1000),
+                terminal_request_receive_time=0,
+                terminal_request_send_time=0,
+                terminal_response_receive_time=0,
+                terminal_response_return_time=0,
+                province=terminal_info.get_register_province(),
+                city=terminal_info.get_register_city(),
+                organization_id=terminal_info.get_ancestry_ids(),
+                organization_name=terminal_info.get_ancestry_names()
+            )
+
+            self.store_expired_result(task_tags, event)
 
         except Exception as e:
             natrix_exception.natrix_traceback()
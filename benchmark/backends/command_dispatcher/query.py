@@ -1,25 +1,38 @@
 # -*- coding: utf-8 -*-
-"""
+"""Query the dial data (records) of commands and tasks.
+
+The records are retrieved with the scroll API (scan_messages), so there isn't a limit on the
+count of records. get_task_data/get_command_data materialize the records, TaskDataStream
+iterates them page by page and keeps the memory flat for a task with many terminals.
 
 """
 
 import logging
 
 
-from .store import search_messages
+from benchmark.backends.stores import partition
+from .store import scan_messages, origin_search
 
 logger = logging.getLogger(__name__)
 
+# The fields used by the analyses, the http response (header and body) is excluded
+ANALYSE_SOURCE = {
+    'excludes': ['response_header', 'response_body']
+}
+
+# a record has the organization ancestry of its terminal (organization_id, organization_name)
+ORGANIZATION_FIELD = partition.keyword_field('organization_name')
+ORGANIZATION_SIZE = 10000
 
-def get_command_data(command_uuid):
 
+def _term_query(field, value, record_type=None):
     query_body = {
         'query': {
             'bool': {
                 'must': [
                     {
                         'term': {
-                            'command_uuid.keyword': str(command_uuid)
+                            field: str(value)
                         }
                     }
                 ]
@@ -27,11 +40,27 @@ def get_command_data(command_uuid):
         }
     }
 
-    record_list = search_messages(body=query_body)
+    # a record of 'error' type is a failed record, the others are successful
+    if record_type == 'error':
+        query_body['query']['bool']['filter'] = [{'term': {'_type': 'error'}}]
+    elif record_type == 'success':
+        query_body['query']['bool']['must_not'] = [{'term': {'_type': 'error'}}]
+
+    return query_body
+
+
+def _task_query(task_uuid, record_type=None):
+    return _term_query(partition.keyword_field('task_id'), task_uuid, record_type)
+
+
+def _command_query(command_uuid, record_type=None):
+    return _term_query(partition.keyword_field('command_uuid'), command_uuid, record_type)
+
 
+def _classify(query_body, source=None, routing=None):
     successful_records = []
     failed_records = []
-    for record in record_list:
+    for record in scan_messages(body=query_body, source=source, routing=routing):
         record_type = record.get('_type')
         if record_type == 'error':
             failed_records.append(record.get('_source'))
@@ -44,34 +73,165 @@ def get_command_data(command_uuid):
     }
 
 
-def get_task_data(task_uuid):
+def get_command_data(command_uuid, source=None):
 
-    query_body = {
-        'query': {
-            'bool': {
-                'must': [
-                    {
-                        'term': {
-                            'task_id.keyword': str(task_uuid)
-                        }
-                    }
-                ]
+    return _classify(_command_query(command_uuid), source=source)
+
+
+def get_task_data(task_uuid, source=None):
+
+    return _classify(_task_query(task_uuid), source=source, routing=partition.get_routing(task_uuid))
+
+
+def count_task_data(task_uuid):
+    """Count the successful and failed records of a task, without retrieving them.
+
+    :return: {'success': 0, 'error': 0}
+    """
+    query_body = _task_query(task_uuid)
+    query_body['aggs'] = {
+        'types': {
+            'terms': {
+                'field': '_type'
             }
         }
     }
+    res = origin_search(body=query_body, size=0, index=partition.get_search_index(),
+                        routing=partition.get_routing(task_uuid))
 
-    record_list = search_messages(body=query_body)
-
-    successful_records = []
-    failed_records = []
-    for record in record_list:
-        record_type = record.get('_type')
-        if record_type == 'error':
-            failed_records.append(record.get('_source'))
+    counts = {
+        'success': 0,
+        'error': 0
+    }
+    for bucket in res.get('aggregations', {}).get('types', {}).get('buckets', []):
+        if bucket['key'] == 'error':
+            counts['error'] += bucket['doc_count']
         else:
-            successful_records.append(record.get('_source'))
+            counts['success'] += bucket['doc_count']
 
-    return {
-        'success': successful_records,
-        'error': failed_records
-    }
\ No newline at end of file
+    return counts
+
+
+class RecordStream(object):
+    """The successful or failed records of a task, each iteration is a new scroll.
+
+    """
+
+    def __init__(self, task_uuid, record_type, source=None):
+        self.task_uuid = task_uuid
+        self.record_type = record_type
+        self.source = source
+
+    def __iter__(self):
+        query_body = _task_query(self.task_uuid, self.record_type)
+        for record in scan_messages(body=query_body, source=self.source,
+                                    routing=partition.get_routing(self.task_uuid)):
+            yield record.get('_source')
+
+
+class TaskDataStream(object):
+    """The streaming version of get_task_data.
+
+    stream.get('success') and stream.get('error') are iterables (RecordStream) instead of
+    lists, so the analyses can consume them in the same way as the snapshot data.
+
+    """
+
+    def __init__(self, task_uuid, source=ANALYSE_SOURCE):
+        self.task_uuid = task_uuid
+        self.source = source
+
+    def get(self, key, default=None):
+        if key not in ('success', 'error'):
+            return default
+        return RecordStream(self.task_uuid, key, source=self.source)
+
+    def __getitem__(self, key):
+        if key not in ('success', 'error'):
+            raise KeyError(key)
+        return self.get(key)
+
+
+def stream_task_data(task_uuid, source=ANALYSE_SOURCE):
+
+    return TaskDataStream(task_uuid, source=source)
+
+
+def aggregate_task_organizations(task_uuid, metrics, missing=None):
+    """Aggregate the successful records of a task by organization (a terms aggregation), a record
+    is counted in each organization of its terminal ancestry.
+
+    :param metrics: the fields to sum
+    :param missing: the organization of the records without organization, they are skipped if None
+    :return: [{'name': organization name, 'count': record count, <metric>: sum}]
+    """
+    terms = {
+        'field': ORGANIZATION_FIELD,
+        'size': ORGANIZATION_SIZE
+    }
+    if missing is not None:
+        terms['missing'] = missing
+
+    query_body = _task_query(task_uuid, 'success')
+    query_body['aggs'] = {
+        'organizations': {
+            'terms': terms,
+            'aggs': dict(('sum_{}'.format(metric), {'sum': {'field': metric}}) for metric in metrics)
+        }
+    }
+    res = origin_search(body=query_body, size=0, index=partition.get_search_index(),
+                        routing=partition.get_routing(task_uuid))
+
+    organizations = []
+    for bucket in res.get('aggregations', {}).get('organizations', {}).get('buckets', []):
+        organization = {
+            'name': bucket['key'],
+            'count': bucket['doc_count']
+        }
+        for metric in metrics:
+            organization[metric] = bucket.get('sum_{}'.format(metric), {}).get('value') or 0
+        organizations.append(organization)
+
+    return organizations
+
+
+def distribute_task_values(task_uuid, field, slice_count):
+    """Count the values of the successful records of a task in slice_count + 1 slices, the
+    interval is max / slice_count (10 / slice_count without values), a max value is counted in
+    the last slice.
+
+    :return: (max value, counts)
+    """
+    query_body = _task_query(task_uuid, 'success')
+    query_body['aggs'] = {
+        'max_value': {
+            'max': {'field': field}
+        }
+    }
+    res = origin_search(body=query_body, size=0, index=partition.get_search_index(),
+                        routing=partition.get_routing(task_uuid))
+    max_value = res.get('aggregations', {}).get('max_value', {}).get('value')
+    if max_value is None:
+        max_value = 10
+
+    counts = [0] * (slice_count + 1)
+    interval = max_value * 1.0 / slice_count
+    if interval <= 0:
+        return max_value, counts
+
+    query_body['aggs'] = {
+        'slices': {
+            'histogram': {
+                'field': field,
+                'interval': interval,
+                'min_doc_count': 1
+            }
+        }
+    }
+    res = origin_search(body=query_body, size=0, index=partition.get_search_index(),
+                        routing=partition.get_routing(task_uuid))
+    for bucket in res.get('aggregations', {}).get('slices', {}).get('buckets', []):
+        index = min(max(int(round(bucket['key'] / interval)), 0), slice_count)
+        counts[index] += bucket['doc_count']
+
+    return max_value, counts
@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+"""Rollups of the task records.
+
+A rollup document summarizes the records of a task in a time bucket (minute, hour and day of
+task_generate_time), broken down by record type, province, city and errorcode:
+ - count: the count of records
+ - <metric>_sum, <metric>_count, <metric>_min and <metric>_max of each metric of the type,
+   a record without the metric (or not a number) isn't counted
+ - <metric>_sketch: the DDSketch (percentiles) of a latency metric
+ - <name>_hll: the HyperLogLog (distinct count) of the IP addresses, e.g. the resolved IPs
+
+The records are rolled up at ingest (see store.py): the stored records are summarized in
+memory (summarize) and merged by rollup key in the buffer of the process (RollupBuffer), each
+flush adds a summary to its rollup document by one scripted upsert. The summaries are
+additive, so a rollup doesn't depend on how the records are batched, and a rollup document is
+updated once per flush however many records of it are stored in between.
+
+A time chart reads the rollups instead of the records (see datasearch.histogram_time): the
+coarsest granularity which fits the chart interval is used (get_rollup_interval), the
+aggregations of the records are translated to the aggregations of the rollups
+(get_rollup_aggs) and the results are translated back (from_rollup_bucket). The sketches
+aren't aggregated by ES, the rollup documents are scanned and the sketches merged (scan_rollups).
+
+The rollups are enabled by 'rollup' in natrix.ini, only the records stored after it's enabled
+are rolled up.
+
+"""
+from __future__ import unicode_literals
+import atexit, hashlib, json, logging, math, os, threading, time
+
+from elasticsearch import helpers
+
+from natrix.common import exception as natrix_exception
+from natrix.common.config import natrix_config
+from utils.elasticsearch import NatrixESClient, get_es_connection, \
+    ES_BULK_SIZE, ES_BULK_INTERVAL, ES_RETRY_ON_CONFLICT
+from utils.sketches import DDSketch, HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_ENABLED = natrix_config.get_value('BENCHMARK', 'rollup').upper() == 'TRUE'
+ROLLUP_INDEX = natrix_config.get_value('ELASTICSEARCH', 'benchmark_rollup_index')
+ROLLUP_TYPE = 'rollup'
+# the upserts not applied (a version conflict after retry_on_conflict, or a full queue) are
+# retried in the next flushes, at most ROLLUP_RETRIES times
+ROLLUP_RETRY_STATUSES = (409, 429)
+ROLLUP_RETRIES = 3
+
+# (name, length in millisecond), from the finest to the coarsest
+ROLLUP_GRANULARITIES = (
+    ('minute', 60 * 1000),
+    ('hour', 60 * 60 * 1000),
+    ('day', 24 * 60 * 60 * 1000),
+)
+
+ROLLUP_METRICS = {
+    'ping': ('packet_send', 'packet_receive', 'packet_loss', 'avg_time', 'min_time', 'max_time'),
+    'http': ('total_time', 'period_nslookup', 'period_tcp_connect', 'period_ssl_connect',
+             'period_request', 'period_response', 'period_transfer'),
+    'dns': ('ptime',),
+    'traceroute': (),
+    'error': (),
+}
+
+# the latency metrics with a DDSketch
+ROLLUP_SKETCHES = {
+    'ping': ('avg_time',),
+    'http': ('total_time',),
+    'dns': ('ptime',),
+}
+
+
+def _remote_ips(record):
+    return [record.get('remote_ip')]
+
+
+def _resolved_ips(record):
+    return [parse.get('ip') for parse in record.get('ips') or []]
+
+
+# the distinct values with a HyperLogLog: {type: {name: function gets the values of a record}}
+ROLLUP_DISTINCTS = {
+    'http': {'remote_ip': _remote_ips},
+    'dns': {'resolved_ip': _resolved_ips},
+}
+
+ROLLUP_KEYS = ('task_id', 'granularity', 'bucket_time', 'record_type', 'province', 'city', 'errorcode')
+
+ROLLUP_SCRIPT = '''
+for (entry in params.sums.entrySet()) {
+    def value = ctx._source[entry.getKey()];
+    ctx._source[entry.getKey()] = value == null ? entry.getValue() : value + entry.getValue();
+}
+for (entry in params.mins.entrySet()) {
+    def value = ctx._source[entry.getKey()];
+    if (value == null || entry.getValue() < value) {
+        ctx._source[entry.getKey()] = entry.getValue();
+    }
+}
+for (entry in params.maxs.entrySet()) {
+    def value = ctx._source[entry.getKey()];
+    if (value == null || entry.getValue() > value) {
+        ctx._source[entry.getKey()] = entry.getValue();
+    }
+}
+for (entry in params.sketches.entrySet()) {
+    def bins = ctx._source[entry.getKey()];
+    if (bins == null) {
+        ctx._source[entry.getKey()] = entry.getValue();
+        continue;
+    }
+    for (bin in entry.getValue().entrySet()) {
+        def count = bins[bin.getKey()];
+        bins[bin.getKey()] = count == null ? bin.getValue() : count + bin.getValue();
+    }
+}
+for (entry in params.hlls.entrySet()) {
+    def registers = ctx._source[entry.getKey()];
+    if (registers == null) {
+        ctx._source[entry.getKey()] = entry.getValue();
+        continue;
+    }
+    for (register in entry.getValue().entrySet()) {
+        def rank = registers[register.getKey()];
+        if (rank == null || register.getValue() > rank) {
+            registers[register.getKey()] = register.getValue();
+        }
+    }
+}
+'''
+
+
+def get_rollup_mapping():
+    properties = {
+        'task_id': {'type': 'keyword'},
+        'granularity': {'type': 'keyword'},
+        'bucket_time': {'type': 'date', 'format': 'epoch_millis'},
+        'record_type': {'type': 'keyword'},
+        'province': {'type': 'keyword'},
+        'city': {'type': 'keyword'},
+        'errorcode': {'type': 'integer'},
+        'count': {'type': 'long'},
+    }
+    for metrics in ROLLUP_METRICS.values():
+        for metric in metrics:
+            properties['{}_sum'.format(metric)] = {'type': 'double'}
+            properties['{}_count'.format(metric)] = {'type': 'long'}
+            properties['{}_min'.format(metric)] = {'type': 'double'}
+            properties['{}_max'.format(metric)] = {'type': 'double'}
+    # the sketches are only in _source, merged by the script and read by scan_rollups
+    for metrics in ROLLUP_SKETCHES.values():
+        for metric in metrics:
+            properties['{}_sketch'.format(metric)] = {'type': 'object', 'enabled': False}
+    for distincts in ROLLUP_DISTINCTS.values():
+        for name in distincts:
+            properties['{}_hll'.format(name)] = {'type': 'object', 'enabled': False}
+
+    return {
+        ROLLUP_TYPE: {
+            'dynamic': 'strict',
+            'properties': properties
+        }
+    }
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value)
+
+
+def summarize(records):
+    """Summarize the records into rollup documents.
+
+    :param records: the store records (with '_type'), the records without task are skipped
+    :return: {rollup key: rollup document}, the sketches are DDSketch/HyperLogLog objects
+    """
+    documents = {}
+    for record in records:
+        record_type = record.get('_type')
+        metrics = ROLLUP_METRICS.get(record_type)
+        task_id = record.get('task_id')
+        task_generate_time = record.get('task_generate_time')
+        if metrics is None or not task_id or not task_generate_time:
+            continue
+
+        values = [(metric, record.get(metric)) for metric in metrics if _is_number(record.get(metric))]
+        sketch_values = [(metric, record.get(metric)) for metric in ROLLUP_SKETCHES.get(record_type, ())
+                         if _is_number(record.get(metric))]
+        distinct_values = [(name, [value for value in function(record) if value])
+                           for name, function in ROLLUP_DISTINCTS.get(record_type, {}).items()]
+        for granularity, length in ROLLUP_GRANULARITIES:
+            key = (str(task_id), granularity, int(task_generate_time) // length * length, record_type,
+                   record.get('province'), record.get('city'), record.get('errorcode'))
+            document = documents.get(key)
+            if document is None:
+                document = documents[key] = dict(zip(ROLLUP_KEYS, key))
+                document['count'] = 0
+            document['count'] += 1
+
+            for metric, value in values:
+                sum_field = '{}_sum'.format(metric)
+                if sum_field in document:
+                    document[sum_field] += value
+                    document['{}_count'.format(metric)] += 1
+                    document['{}_min'.format(metric)] = min(document['{}_min'.format(metric)], value)
+                    document['{}_max'.format(metric)] = max(document['{}_max'.format(metric)], value)
+                else:
+                    document[sum_field] = value
+                    document['{}_count'.format(metric)] = 1
+                    document['{}_min'.format(metric)] = value
+                    document['{}_max'.format(metric)] = value
+
+            for metric, value in sketch_values:
+                sketch_field = '{}_sketch'.format(metric)
+                if sketch_field not in document:
+                    document[sketch_field] = DDSketch()
+                document[sketch_field].add(value)
+
+            for name, distinct_values_of_record in distinct_values:
+                hll_field = '{}_hll'.format(name)
+                if hll_field not in document:
+                    document[hll_field] = HyperLogLog()
+                for value in distinct_values_of_record:
+                    document[hll_field].add(value)
+
+    return documents
+
+
+def merge_summary(document, other):
+    """Add a summary to the summary of the same rollup key (see summarize).
+
+    """
+    for field, value in other.items():
+        if field in ROLLUP_KEYS:
+            continue
+        current = document.get(field)
+        if current is None:
+            document[field] = value
+        elif isinstance(current, (DDSketch, HyperLogLog)):
+            current.merge(value)
+        elif field.endswith('_min'):
+            document[field] = min(current, value)
+        elif field.endswith('_max'):
+            document[field] = max(current, value)
+        else:
+            document[field] = current + value
+    return document
+
+
+def get_rollup_id(key):
+    return hashlib.sha1(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def get_rollup_document(document):
+    """The rollup document with the sketches converted to JSON objects."""
+    return dict((field, value.to_dict() if isinstance(value, (DDSketch, HyperLogLog)) else value)
+                for field, value in document.items())
+
+
+def get_rollup_script(document):
+    params = {'sums': {}, 'mins': {}, 'maxs': {}, 'sketches': {}, 'hlls': {}}
+    for field, value in document.items():
+        if field.endswith('_sketch'):
+            params['sketches'][field] = value
+        elif field.endswith('_hll'):
+            params['hlls'][field] = value
+        elif field == 'count' or field.endswith('_sum') or field.endswith('_count'):
+            params['sums'][field] = value
+        elif field.endswith('_min'):
+            params['mins'][field] = value
+        elif field.endswith('_max'):
+            params['maxs'][field] = value
+
+    return {
+        'lang': 'painless',
+        'source': ROLLUP_SCRIPT,
+        'params': params
+    }
+
+
+class RollupBuffer(object):
+    """Merge the summaries by rollup key, and upsert them with the bulk API in a background thread.
+
+    A buffer is flushed when it has size rollups or the oldest is older than interval
+    milliseconds. An upsert not applied for a retryable status (ROLLUP_RETRY_STATUSES) is merged
+    back and retried in the next flush, the other failed upserts are reported (the error log
+    and metrics), their records are missing in the rollups.
+
+    """
+
+    def __init__(self, index, size=ES_BULK_SIZE, interval=ES_BULK_INTERVAL):
+        self.index = index
+        self.size = size
+        self.interval = interval
+
+        self._documents = {}    # {rollup key: summary}
+        self._attempts = {}     # {rollup key: failed upserts}
+        self._first_time = None
+        self._condition = threading.Condition()
+        self._metrics = {
+            'upserted_rollups': 0,
+            'retried_rollups': 0,
+            'failed_rollups': 0,
+            'failed_records': 0,
+        }
+        self._thread = threading.Thread(target=self._run, name='es-rollup-{}'.format(index), daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def add(self, documents):
+        """Merge the summaries into the buffer.
+
+        :param documents: {rollup key: summary}, see summarize
+        """
+        with self._condition:
+            self._merge(documents)
+            if len(self._documents) >= self.size:
+                self._condition.notify()
+
+    def _merge(self, documents):
+        if documents and not self._documents:
+            self._first_time = time.time()
+        for key, document in documents.items():
+            if key in self._documents:
+                merge_summary(self._documents[key], document)
+            else:
+                self._documents[key] = document
+
+    def _ready(self):
+        if not self._documents:
+            return False
+        return len(self._documents) >= self.size or \
+            (time.time() - self._first_time) * 1000 >= self.interval
+
+    def _take(self):
+        with self._condition:
+            documents, self._documents = self._documents, {}
+            attempts, self._attempts = self._attempts, {}
+        return documents, attempts
+
+    def _upsert(self, documents):
+        """Upsert the summaries.
+
+        :return: (the keys can be retried, the keys failed)
+        """
+        keys = {}
+        actions = []
+        for key, document in documents.items():
+            rollup_id = get_rollup_id(key)
+            document = get_rollup_document(document)
+            keys[rollup_id] = key
+            actions.append({
+                '_op_type': 'update',
+                '_index': self.index,
+                '_type': ROLLUP_TYPE,
+                '_id': rollup_id,
+                'retry_on_conflict': ES_RETRY_ON_CONFLICT,
+                'script': get_rollup_script(document),
+                'upsert': document
+            })
+        try:
+            _, errors = helpers.bulk(get_es_connection(), actions, chunk_size=self.size,
+                                     raise_on_error=False, raise_on_exception=False)
+        except Exception as e:
+            # the upserts may be partly applied, a retry could count the records twice
+            logger.error('Upsert {} rollups with error: {}'.format(len(actions), e))
+            return [], list(documents)
+
+        retries, failures = [], []
+        for error in errors:
+            info = error.get('update', {})
+            key = keys.get(info.get('_id'))
+            if key is None:
+                continue
+            if info.get('status') in ROLLUP_RETRY_STATUSES:
+                retries.append(key)
+            else:
+                failures.append(key)
+                logger.error('Upsert rollup({}) with error: {}'.format(info.get('_id'), info.get('error')))
+        return retries, failures
+
+    def _flush(self, documents, attempts):
+        if not documents:
+            return True
+        retries, failures = self._upsert(documents)
+
+        with self._condition:
+            self._metrics['upserted_rollups'] += len(documents) - len(retries) - len(failures)
+            for key in retries:
+                if attempts.get(key, 0) >= ROLLUP_RETRIES:
+                    failures.append(key)
+                    continue
+                self._merge({key: documents[key]})
+                self._attempts[key] = attempts.get(key, 0) + 1
+                self._metrics['retried_rollups'] += 1
+            for key in failures:
+                self._metrics['failed_rollups'] += 1
+                self._metrics['failed_records'] += documents[key]['count']
+
+        if failures:
+            logger.error('Upsert {} rollups failed, the rollups miss {} records'.format(
+                len(failures), sum(documents[key]['count'] for key in failures)))
+        return not retries and not failures
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready():
+                    timeout = self.interval / 1000.0
+                    if self._documents:
+                        timeout = max(timeout - (time.time() - self._first_time), 0.001)
+                    self._condition.wait(timeout)
+            self._flush(*self._take())
+
+    def flush(self):
+        """Upsert the buffered summaries in the current thread.
+
+        :return: True if all summaries are upserted
+        """
+        return self._flush(*self._take())
+
+    def metrics(self):
+        """The buffer metrics, include the count of failed rollups and their records.
+
+        """
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics['buffered_rollups'] = len(self._documents)
+        return metrics
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_rollup_buffer():
+    """Get the rollup buffer of the current process.
+
+    """
+    pid = os.getpid()
+    buffer = _buffers.get(pid)
+    if buffer is None:
+        with _buffers_lock:
+            buffer = _buffers.get(pid)
+            if buffer is None:
+                buffer = _buffers[pid] = RollupBuffer(ROLLUP_INDEX)
+    return buffer
+
+
+def rollup_records(records):
+    """Add the records to the rollups, if the rollups are enabled.
+
+    """
+    if not ROLLUP_ENABLED:
+        return
+    try:
+        get_rollup_buffer().add(summarize(records))
+    except Exception as e:
+        natrix_exception.natrix_traceback()
+        logger.error('Rollup records with error: {}'.format(e))
+
+
+def get_rollup_interval(interval, align=False):
+    """The rollup granularity of a histogram interval.
+
+    The coarsest granularity which divides the interval. If align is True (a long range), the
+    interval is rounded up to a multiple of the coarsest granularity not greater than it.
+
+    :return: (interval, granularity), granularity is None if there isn't a fit rollup
+    """
+    for granularity, length in reversed(ROLLUP_GRANULARITIES):
+        if length > interval:
+            continue
+        if interval % length == 0:
+            return interval, granularity
+        if align:
+            return length * int(math.ceil(interval / float(length))), granularity
+
+    return interval, None
+
+
+def get_rollup_aggs(aggs):
+    """Translate the aggregations of the records to the aggregations of the rollups.
+
+    The supported aggregations are sum and avg of a metric and terms (count).
+    """
+    rollup_aggs = {}
+    for name, agg in aggs.items():
+        if 'sum' in agg:
+            rollup_aggs[name] = {'sum': {'field': '{}_sum'.format(agg['sum']['field'])}}
+        elif 'avg' in agg:
+            field = agg['avg']['field']
+            rollup_aggs['{}_sum'.format(name)] = {'sum': {'field': '{}_sum'.format(field)}}
+            rollup_aggs['{}_count'.format(name)] = {'sum': {'field': '{}_count'.format(field)}}
+        elif 'terms' in agg:
+            rollup_aggs[name] = {
+                'terms': agg['terms'],
+                'aggs': {
+                    'record_count': {'sum': {'field': 'count'}}
+                }
+            }
+        else:
+            raise natrix_exception.ClassInsideException(
+                message='Unsupported rollup aggregation: {}'.format(name))
+
+    return rollup_aggs
+
+
+def from_rollup_bucket(record, aggs):
+    """Translate a bucket of the rollup aggregations to the bucket of the record aggregations.
+
+    """
+    bucket = {
+        'key': record.get('key'),
+    }
+    for name, agg in aggs.items():
+        if 'sum' in agg:
+            bucket[name] = record.get(name)
+        elif 'avg' in agg:
+            total = record.get('{}_sum'.format(name), {}).get('value')
+            count = record.get('{}_count'.format(name), {}).get('value')
+            bucket[name] = {'value': total / count if count else None}
+        elif 'terms' in agg:
+            bucket[name] = {
+                'buckets': [{
+                    'key': term.get('key'),
+                    'doc_count': int(term.get('record_count', {}).get('value') or 0)
+                } for term in record.get(name, {}).get('buckets', [])]
+            }
+
+    return bucket
+
+
+def get_rollup_histogram_query(task_id, record_type, granularity, start_time, end_time, interval, aggs=None):
+    """The date histogram of the rollups in [start_time, end_time).
+
+    """
+    histogram = {
+        'date_histogram': {
+            'field': 'bucket_time',
+            'interval': interval,
+            'extended_bounds': {
+                'min': start_time,
+                'max': end_time - 1
+            }
+        }
+    }
+    if aggs:
+        histogram['aggs'] = get_rollup_aggs(aggs)
+
+    es_condition = {
+        'query': get_rollup_query(task_id, record_type, granularity, start_time, end_time),
+        'aggs': {
+            'histogram_datas': histogram
+        },
+    }
+    return es_condition
+
+
+def get_rollup_query(task_id, record_type, granularity, start_time, end_time):
+    return {
+        'bool': {
+            'filter': [
+                {'term': {'task_id': str(task_id)}},
+                {'term': {'granularity': granularity}},
+                {'term': {'record_type': record_type}},
+                {'range': {'bucket_time': {'gte': start_time, 'lt': end_time}}}
+            ]
+        }
+    }
+
+
+def scan_rollups(task_id, record_type, granularity, start_time, end_time, fields):
+    """Iterate the rollup documents (the fields only) in [start_time, end_time).
+
+    """
+    natrix_es_client = NatrixESClient(app='benchmark_rollup')
+    body = {
+        'query': get_rollup_query(task_id, record_type, granularity, start_time, end_time)
+    }
+    for record in natrix_es_client.scan(condition=body, source=['bucket_time'] + list(fields)):
+        yield record.get('_source')
+
+
+def init_rollup_index():
+    """Create the rollup index (with the mapping) if it doesn't exist.
+
+    """
+    natrix_es_client = NatrixESClient(app='benchmark_rollup')
+    es_conn = natrix_es_client.es_conn
+    if not es_conn.indices.exists(natrix_es_client.es_index):
+        es_conn.indices.create(natrix_es_client.es_index)
+    es_conn.indices.put_mapping(index=natrix_es_client.es_index,
+                                doc_type=ROLLUP_TYPE,
+                                body=get_rollup_mapping())
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""Compiled validation of terminal responses.
+
+The DRF serializers in response.py build bound fields, error dicts and OrderedDicts for every
+message, which dominates the cost of response ingestion. Here the serializers are compiled
+once (at import) into per-protocol field specs, a spec is a tuple of
+(name, convert, required, allow_null, default, null_values), and a message is validated by
+plain function calls.
+
+The compiled path only accepts what it can validate exactly as DRF does, anything else
+(an invalid message, an IPv6 address, an unsupported field type) falls back to the DRF
+serializer, so the validated data and the error messages are always the same as
+TerminalResponse.
+
+"""
+from __future__ import unicode_literals
+import re, time, uuid
+
+from rest_framework import fields as rest_fields
+from rest_framework import serializers as rest_serializers
+
+from natrix.common.config import natrix_config
+from natrix.common import exception as natrix_exception
+from natrix.common.natrix_views import fields as natrix_fields
+from ..states import CommandAPI
+from .response import (TerminalResponse, ResponseCommandTag, ResponseTimestampTag,
+                       PingSerializer, HttpSerializer, DnsSerializer, TracerouteSerializer,
+                       ErrorSerializer)
+
+# drf or compiled
+RESPONSE_VALIDATOR = natrix_config.get_value('BENCHMARK', 'response_validator')
+
+_RE_DECIMAL = re.compile(r'\.0*\s*$')
+
+
+class Fallback(Exception):
+    """The value can't be validated by the compiled path."""
+
+
+def _fallback(value):
+    raise Fallback()
+
+
+def _validators_check(validators):
+    def check(value):
+        try:
+            for validator in validators:
+                validator(value)
+        except Exception:
+            raise Fallback()
+    return check
+
+
+def _compile_char(field):
+    allow_blank = field.allow_blank
+    trim_whitespace = field.trim_whitespace
+    check = _validators_check(tuple(field.validators))
+    is_ip = isinstance(field, rest_fields.IPAddressField)
+
+    def convert(value):
+        if type(value) is not str or (is_ip and ':' in value):
+            raise Fallback()
+        if trim_whitespace:
+            value = value.strip()
+        if value == '':
+            if allow_blank:
+                return value
+            raise Fallback()
+        check(value)
+        return value
+
+    return convert
+
+
+def _compile_number(field, cast):
+    min_value = field.min_value
+    max_value = field.max_value
+    max_string_length = field.MAX_STRING_LENGTH
+
+    def convert(value):
+        value_type = type(value)
+        if value_type is str:
+            if len(value) > max_string_length:
+                raise Fallback()
+        elif value_type is not int and value_type is not float:
+            raise Fallback()
+        try:
+            value = cast(value)
+        except (TypeError, ValueError):
+            raise Fallback()
+        if (min_value is not None and value < min_value) or \
+                (max_value is not None and value > max_value):
+            raise Fallback()
+        return value
+
+    return convert
+
+
+def _to_integer(value):
+    if type(value) is int:
+        return value
+    return int(_RE_DECIMAL.sub('', str(value)))
+
+
+def _convert_uuid(value):
+    if isinstance(value, uuid.UUID):
+        return value
+    if type(value) is not str:
+        raise Fallback()
+    try:
+        return uuid.UUID(hex=value)
+    except ValueError:
+        raise Fallback()
+
+
+def _compile_list(field):
+    if not field.allow_empty or getattr(field, 'min_length', None) is not None or \
+            getattr(field, 'max_length', None) is not None:
+        return _fallback
+
+    child = field.child
+    child_convert = compile_field(child)
+    child_allow_null = child.allow_null
+
+    def convert(value):
+        if type(value) is not list:
+            raise Fallback()
+        result = []
+        for item in value:
+            if item is None:
+                if not child_allow_null:
+                    raise Fallback()
+                result.append(None)
+            else:
+                result.append(child_convert(item))
+        return result
+
+    return convert
+
+
+def _compile_json(field):
+    to_internal_value = field.to_internal_value
+
+    def convert(value):
+        # the strict json check (e.g. NaN) of JSONField
+        try:
+            return to_internal_value(value)
+        except Exception:
+            raise Fallback()
+
+    return convert
+
+
+def _has_custom_validation(serializer):
+    if type(serializer).validate is not rest_serializers.Serializer.validate or serializer.validators:
+        return True
+    return any(hasattr(serializer, 'validate_' + name) for name in serializer.fields)
+
+
+def compile_field(field):
+    """Compile a DRF field to a convert function, which returns the internal value or raises
+    Fallback.
+
+    """
+    if isinstance(field, rest_serializers.BaseSerializer):
+        if isinstance(field, rest_serializers.ListSerializer) or _has_custom_validation(field):
+            return _fallback
+        spec = compile_serializer(field)
+        return lambda value: validate_spec(spec, value)
+    if isinstance(field, rest_fields.ListField):
+        return _compile_list(field)
+    if isinstance(field, rest_fields.CharField):
+        return _compile_char(field)
+    if isinstance(field, rest_fields.IntegerField):
+        return _compile_number(field, _to_integer)
+    if isinstance(field, rest_fields.FloatField):
+        return _compile_number(field, float)
+    if isinstance(field, rest_fields.UUIDField):
+        return _convert_uuid
+    if isinstance(field, rest_fields.JSONField):
+        return _compile_json(field)
+    return _fallback
+
+
+def compile_serializer(serializer):
+    """Compile the fields of a serializer (class or instance) to a spec.
+
+    """
+    if isinstance(serializer, type):
+        serializer = serializer()
+
+    spec = []
+    for name, field in serializer.fields.items():
+        if field.read_only or field.source != name:
+            convert = _fallback
+        else:
+            convert = compile_field(field)
+
+        null_values = None
+        if isinstance(field, natrix_fields.NullFloatField):
+            # NullFloatField replaces the null values with its own default before validation
+            null_values = (field.NULL_VALUES, field._default)
+
+        spec.append((name, convert, field.required, field.allow_null, field.default, null_values))
+
+    return tuple(spec)
+
+
+def validate_spec(spec, data):
+    """Validate a dict by a spec, the same as Serializer.to_internal_value.
+
+    """
+    if type(data) is not dict:
+        raise Fallback()
+
+    result = {}
+    for name, convert, required, allow_null, default, null_values in spec:
+        if name not in data:
+            if required:
+                raise Fallback()
+            if default is not rest_fields.empty:
+                result[name] = default() if callable(default) else default
+            continue
+
+        value = data[name]
+        if null_values is not None and (value is None or (type(value) is str and value in null_values[0])):
+            value = null_values[1]
+        if value is None:
+            if not allow_null:
+                raise Fallback()
+            result[name] = None
+        else:
+            result[name] = convert(value)
+
+    return result
+
+
+COMMAND_SPEC = compile_serializer(ResponseCommandTag)
+STAMP_SPEC = compile_serializer(ResponseTimestampTag)
+STATUS_CONVERT = compile_field(TerminalResponse().fields['status'])
+DATA_CONVERT = compile_field(TerminalResponse().fields['data'])
+ERROR_SPEC = compile_serializer(ErrorSerializer)
+TRACEROUTE_SPEC = compile_serializer(TracerouteSerializer)
+PROTOCOL_SPECS = {
+    'ping': compile_serializer(PingSerializer),
+    'http': compile_serializer(HttpSerializer),
+    'dns': compile_serializer(DnsSerializer),
+}
+
+
+class CompiledTerminalResponse(TerminalResponse):
+    """TerminalResponse with the compiled validation.
+
+    The output methods (representation, stamp_data, ...) are inherited from TerminalResponse.
+
+    """
+
+    def is_valid(self, raise_exception=False):
+        if not hasattr(self, '_validated_data'):
+            try:
+                self._validated_data = self.compiled_validate(self.initial_data)
+                self._errors = {}
+            except Fallback:
+                return super(CompiledTerminalResponse, self).is_valid(raise_exception)
+
+        return not bool(self._errors)
+
+    def compiled_validate(self, initial_data):
+        if type(initial_data) is not dict or 'data' not in initial_data or 'status' not in initial_data:
+            raise Fallback()
+
+        command = validate_spec(COMMAND_SPEC, initial_data.get('command'))
+        status = initial_data['status']
+        if type(status) is not int:
+            raise Fallback()
+        status = STATUS_CONVERT(status)
+
+        value = initial_data['data']
+        if value is None:
+            raise Fallback()
+        value = DATA_CONVERT(value)
+        data = self.compiled_validate_data(status, initial_data['command'], value)
+        stamp = validate_spec(STAMP_SPEC, initial_data.get('stamp'))
+
+        return {
+            'command': command,
+            'status': status,
+            'data': data,
+            'stamp': stamp
+        }
+
+    def compiled_validate_data(self, status, command, value):
+        """The same as TerminalResponse.validate_data.
+
+        """
+        self.response_process_time = int(time.time() * 1000)
+        if status != 0:
+            self._message_type = 'error'
+            return validate_spec(ERROR_SPEC, value)
+
+        uuid = str(command.get('uuid'))
+        command_protocols = self.context.get('command_protocols', {})
+        if uuid in command_protocols:
+            command_protocol = command_protocols[uuid]
+        else:
+            command_protocol = CommandAPI.get_command_protocol(uuid)
+        self._message_type = command_protocol
+
+        if command_protocol == 'traceroute':
+            paths = validate_spec(TRACEROUTE_SPEC, {'paths': value})['paths']
+            return {
+                'hop': len(paths),
+                'paths': paths
+            }
+
+        spec = PROTOCOL_SPECS.get(command_protocol)
+        if spec is None:
+            raise Fallback()
+        return validate_spec(spec, value)
+
+
+RESPONSE_SERIALIZERS = {
+    'drf': TerminalResponse,
+    'compiled': CompiledTerminalResponse
+}
+
+
+def get_response_serializer(validator=None):
+    """Get the terminal response serializer class by 'response_validator' in natrix.ini.
+
+    """
+    validator = validator or RESPONSE_VALIDATOR
+    if validator not in RESPONSE_SERIALIZERS:
+        raise natrix_exception.ClassInsideException(
+            message='Unknown response validator: {}'.format(validator))
+    return RESPONSE_SERIALIZERS[validator]
@@ -10,6 +10,7 @@ from rest_framework import serializers as rest_serializers
 from natrix.common.natrix_views import serializers as natrix_serializers
 from natrix.common.natrix_views import fields as natrix_fields
 from natrix.common import exception as natrix_exception
+from benchmark.types.events import EVENT_TYPES, ResponseDiscardEvent
 from ..states import CommandAPI
 
 class ResponseCommandTag(natrix_serializers.NatrixSerializer):
@@ -194,7 +195,12 @@ class TerminalResponse(natrix_serializers.NatrixSerializer):
         if status == 0:
             command = self.initial_data['command']
             uuid = str(command.get('uuid'))
-            command_protocol = CommandAPI.get_command_protocol(uuid)
+            # the command protocols may be prefetched by a batch processor
+            command_protocols = self.context.get('command_protocols', {})
+            if uuid in command_protocols:
+                command_protocol = command_protocols[uuid]
+            else:
+                command_protocol = CommandAPI.get_command_protocol(uuid)
 
             self._message_type = command_protocol
 
@@ -281,6 +287,62 @@ class TerminalResponse(natrix_serializers.NatrixSerializer):
 
         return message
 
+    def _set_event_tags(self, event):
+        command = self._validated_data['command']
+        stamp = self._validated_data['stamp']
+
+        event.command_uuid = str(command.get('uuid'))
+        event.command_generate_time = int(self._get_command_stamp() * 1000)
+        event.terminal = command.get('terminal')
+
+        event.response_process_time = self.response_process_time
+        event.terminal_request_receive_time = int(stamp.get('terminal_request_receive_time') * 1000)
+        event.terminal_request_send_time = int(stamp.get('terminal_request_send_time') * 1000)
+        if stamp.get('terminal_response_receive_time'):
+            event.terminal_response_receive_time = int(stamp.get('terminal_response_receive_time') * 1000)
+        else:
+            event.terminal_response_receive_time = None
+        return stamp
+
+    def to_event(self):
+        """The response event, with the same fields as representation().
+
+        """
+        if not hasattr(self, '_validated_data'):
+            raise natrix_exception.ClassInsideException(
+                message=u'Must call is_valid before using this method')
+
+        event = EVENT_TYPES[self.get_message_type()]()
+        stamp = self._set_event_tags(event)
+        if stamp.get('terminal_response_return_time'):
+            event.terminal_response_return_time = int(stamp.get('terminal_response_return_time') * 1000)
+        else:
+            # TODO: eventhub dont support None
+            event.terminal_response_return_time = 0
+        event.update(self._validated_data['data'])
+
+        return event
+
+    def to_discard_event(self):
+        """The event of a response without task info (command_data, stamp_data and dial_data).
+
+        """
+        if not hasattr(self, '_validated_data'):
+            raise natrix_exception.ClassInsideException(
+                message=u'Must call is_valid before using this method')
+
+        event = ResponseDiscardEvent()
+        stamp = self._set_event_tags(event)
+        if stamp.get('terminal_response_return_time'):
+            event.terminal_response_return_time = int(stamp.get('terminal_response_return_time') * 1000)
+        else:
+            # TODO: eventhub dont support None
+            event.terminal_response_return_time = int(time.time() * 1000)
+        event.dial_data = self._validated_data['data']
+        event.expired_time = event.terminal_response_return_time - event.command_generate_time
+
+        return event
+
     def command_data(self):
         if not hasattr(self, '_validated_data'):
             raise natrix_exception.ClassInsideException(
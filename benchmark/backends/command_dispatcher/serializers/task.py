@@ -40,6 +40,14 @@ class TaskInfo(natrix_serializers.NatrixSerializer):
     task_generate_time = rest_serializers.FloatField()
 
 
+class FanoutInfo(natrix_serializers.NatrixSerializer):
+    """Fan-out group, the terminals subscribe the group topic.
+
+    """
+    type = rest_serializers.ChoiceField(choices=(('region', u'区域'), ('organization', u'组织')))
+    value = rest_serializers.CharField(max_length=64)
+
+
 class TaskCommandInfo(natrix_serializers.NatrixSerializer):
     """Task Information.
 
@@ -50,6 +58,17 @@ class TaskCommandInfo(natrix_serializers.NatrixSerializer):
     command = CommandInfo()
     task_tag = TaskInfo()
     terminals = rest_serializers.ListField(child=TerminalInfo())
+    fanout = FanoutInfo(required=False, allow_null=True)
+
+    def get_fanout(self):
+        if not hasattr(self, '_validated_data'):
+            raise natrix_exception.ClassInsideException(
+                message=u'Must call is_valid before using this method')
+
+        fanout = self._validated_data.get('fanout')
+        if not fanout:
+            return None
+        return {'type': fanout.get('type'), 'value': fanout.get('value')}
 
     def get_task_tag(self):
         if not hasattr(self, '_validated_data'):
@@ -109,6 +128,67 @@ class TaskCommandInfo(natrix_serializers.NatrixSerializer):
             return None
 
 
+class InternalTaskCommand(object):
+    """Task command from the trusted internal callers.
+
+    The data is constructed by Task.task_command_represent from a stored (validated) task, so it
+    isn't validated again, e.g. the IP of each terminal. It provides the same interface as
+    TaskCommandInfo. The external (API) input must use TaskCommandInfo.
+
+    """
+
+    def __init__(self, command, task_tag, terminals, fanout=None):
+        """
+
+        :param command: {'command_uuid': '', 'command_protocol': '', 'command_destination': '',
+                         'command_parameters': {}}
+        :param task_tag: {'task_id': '', 'task_generate_time': 1111.11}
+        :param terminals: [{'mac': '', 'ip': ''}]
+        :param fanout: {'type': 'region', 'value': ''} or None
+        """
+        self.command = command
+        self.task_tag = task_tag
+        self.terminals = terminals
+        self.fanout = fanout
+
+    @classmethod
+    def from_represent(cls, data):
+        """Construct from the result of Task.task_command_represent.
+
+        """
+        try:
+            return cls(command=data['command'],
+                       task_tag=data['task_tag'],
+                       terminals=data['terminals'],
+                       fanout=data.get('fanout'))
+        except (KeyError, TypeError, AttributeError) as e:
+            raise natrix_exception.ClassInsideException(
+                message=u'Internal task command without necessary data: {}'.format(e))
+
+    def get_fanout(self):
+        if not self.fanout:
+            return None
+        return {'type': self.fanout.get('type'), 'value': self.fanout.get('value')}
+
+    def get_task_tag(self):
+        return {
+            'task_id': str(self.task_tag.get('task_id')),
+            'task_generate_time': self.task_tag.get('task_generate_time')
+        }
+
+    def get_terminals(self):
+        return self.terminals
+
+    def get_terminal_command(self, timestamp):
+        return {
+            'uuid': str(self.command.get('command_uuid')),
+            'protocol': self.command.get('command_protocol'),
+            'destination': self.command.get('command_destination'),
+            'parameters': self.command.get('command_parameters'),
+            'generate_timestamp': timestamp,
+        }
+
+
 class ExpiredResponseInfo(natrix_serializers.NatrixSerializer):
     """
 
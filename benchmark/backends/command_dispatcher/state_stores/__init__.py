@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Command state stores.
+
+A state store keeps the command state machine (command register, command instances and the
+last command responses) used by CommandAPI. The backend is configured in natrix.ini:
+
+    [BENCHMARK]
+    command_state_backend = redis       # redis or memory
+
+The memory backend only shares state in one process, use it for single-node deployments
+and tests.
+
+"""
+from __future__ import unicode_literals
+
+from natrix.common.config import natrix_config
+
+from .base import CommandStateStore
+from .redis_store import RedisStateStore
+from .memory_store import MemoryStateStore
+
+STATE_BACKENDS = {
+    'redis': RedisStateStore,
+    'memory': MemoryStateStore,
+}
+
+
+def get_state_store(backend=None):
+    """Create a command state store.
+
+    :param backend: the backend name, use the natrix.ini configuration by default
+    :return: a CommandStateStore
+    """
+    if backend is None:
+        backend = natrix_config.get_value('BENCHMARK', 'command_state_backend')
+
+    store_class = STATE_BACKENDS.get(backend)
+    if store_class is None:
+        raise ValueError('Unsupported command state backend: {}'.format(backend))
+
+    return store_class()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""The interface of command state stores.
+
+"""
+from __future__ import unicode_literals
+
+
+class CommandStateStore(object):
+    """Command state store interface.
+
+    All timestamps are millisecond integers, and each method is an atomic state transition.
+
+    """
+
+    def register(self, command_uuid, terminal, timestamp, command_info, task_info,
+                 acceptable_time, deadline):
+        """Register a command instance, or merge task_info into a running one.
+
+        The task_info is merged into the newest running instance of the terminal if the instance
+        is generated within acceptable_time.
+
+        :return: 'create' or 'update'
+        """
+        raise NotImplementedError()
+
+    def register_batch(self, command_uuid, terminals, timestamp, command_info, task_info,
+                       acceptable_time, deadline):
+        """Register a command instance for each terminal.
+
+        :return: a dict, terminal -> 'create', 'update' or None (failed)
+        """
+        raise NotImplementedError()
+
+    def erase(self, command_uuid, terminal, timestamp):
+        """Finish a running command instance.
+
+        :return: a list of task tags, None if there is not a running instance.
+        """
+        raise NotImplementedError()
+
+    def erase_batch(self, instances):
+        """Finish a list of running command instances.
+
+        :param instances: a list of (command_uuid, terminal, timestamp)
+        :return: a list of task tags (or None), in the order of instances
+        """
+        return [self.erase(*instance) for instance in instances]
+
+    def get_command_protocol(self, command_uuid):
+        """Get the command protocol, None if the command is not registered.
+
+        """
+        raise NotImplementedError()
+
+    def get_command_protocols(self, command_uuids):
+        """Get the protocols of a list of commands.
+
+        :return: a dict, command_uuid -> protocol, without unregistered commands
+        """
+        protocols = {}
+        for command_uuid in command_uuids:
+            protocol = self.get_command_protocol(command_uuid)
+            if protocol is not None:
+                protocols[command_uuid] = protocol
+        return protocols
+
+    def get_response(self, command_uuid, terminal):
+        """Get the last command response.
+
+        :return: {'timestamp': 11111, 'data': {}} or None
+        """
+        raise NotImplementedError()
+
+    def get_responses(self, command_uuid, terminals):
+        """Get the last command responses of terminals.
+
+        :return: a dict, terminal -> {'timestamp': 11111, 'data': {}}, without missing terminals
+        """
+        raise NotImplementedError()
+
+    def update_response(self, command_uuid, terminal, timestamp, data):
+        """Update the last command response, an older response never overwrites a newer one.
+
+        :return: True if updated
+        """
+        raise NotImplementedError()
+
+    def update_response_batch(self, responses):
+        """Update a list of last command responses.
+
+        :param responses: a list of (command_uuid, terminal, timestamp, data)
+        :return: a list of bool, in the order of responses
+        """
+        return [self.update_response(*response) for response in responses]
+
+    def expire(self, cutoff, limit):
+        """Remove at most limit command instances whose deadline is no later than cutoff.
+
+        :return: (scanned, expired), scanned is the count of removed index entries, expired is
+                 a list of the expired command instances.
+        """
+        raise NotImplementedError()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""In-process command state store.
+
+The state only lives in the current process, so it fits single-node deployments (all dispatch,
+response and clean workers in one process) and tests.
+
+"""
+from __future__ import unicode_literals
+import bisect
+import copy
+import threading
+
+from .base import CommandStateStore
+
+
+class MemoryStateStore(CommandStateStore):
+    """Command state store based on python dicts, guarded by a process lock.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}     # command_uuid -> {'protocol': 'http', 'info': {}}
+        self._latest = {}       # (command_uuid, terminal) -> timestamp
+        self._states = {}       # (command_uuid, terminal, timestamp) -> state
+        self._responses = {}    # (command_uuid, terminal) -> {'timestamp': 1111, 'data': {}}
+        self._deadlines = []    # sorted [(deadline, command_uuid, terminal, timestamp)]
+
+    def _register(self, command_uuid, terminal, timestamp, command_info, task_info,
+                  acceptable_time, deadline):
+        if command_uuid not in self._commands:
+            self._commands[command_uuid] = {
+                'protocol': command_info.get('protocol', ''),
+                'info': copy.deepcopy(command_info)
+            }
+
+        latest = self._latest.get((command_uuid, terminal))
+        if latest is not None and timestamp - latest <= acceptable_time:
+            state = self._states.get((command_uuid, terminal, latest))
+            if state is not None and state['state'] == 'running':
+                state['task_tags'].append(copy.deepcopy(task_info))
+                return 'update'
+
+        self._states[(command_uuid, terminal, timestamp)] = {
+            'command_generate_time': timestamp,
+            'state': 'running',
+            'task_tags': [copy.deepcopy(task_info)],
+            'deadline': deadline
+        }
+        self._latest[(command_uuid, terminal)] = timestamp
+        bisect.insort(self._deadlines, (deadline, command_uuid, terminal, timestamp))
+        return 'create'
+
+    def register(self, command_uuid, terminal, timestamp, command_info, task_info,
+                 acceptable_time, deadline):
+        with self._lock:
+            return self._register(command_uuid, terminal, timestamp, command_info, task_info,
+                                  acceptable_time, deadline)
+
+    def register_batch(self, command_uuid, terminals, timestamp, command_info, task_info,
+                       acceptable_time, deadline):
+        with self._lock:
+            return {terminal: self._register(command_uuid, terminal, timestamp, command_info,
+                                             task_info, acceptable_time, deadline)
+                    for terminal in terminals}
+
+    def erase(self, command_uuid, terminal, timestamp):
+        with self._lock:
+            state = self._states.get((command_uuid, terminal, timestamp))
+            if state is None or state['state'] != 'running':
+                return None
+
+            del self._states[(command_uuid, terminal, timestamp)]
+            if self._latest.get((command_uuid, terminal)) == timestamp:
+                del self._latest[(command_uuid, terminal)]
+            entry = (state['deadline'], command_uuid, terminal, timestamp)
+            index = bisect.bisect_left(self._deadlines, entry)
+            if index < len(self._deadlines) and self._deadlines[index] == entry:
+                del self._deadlines[index]
+            return state['task_tags']
+
+    def get_command_protocol(self, command_uuid):
+        with self._lock:
+            command = self._commands.get(command_uuid)
+            return command['protocol'] if command else None
+
+    def get_response(self, command_uuid, terminal):
+        with self._lock:
+            return copy.deepcopy(self._responses.get((command_uuid, terminal)))
+
+    def get_responses(self, command_uuid, terminals):
+        with self._lock:
+            return {terminal: copy.deepcopy(self._responses[(command_uuid, terminal)])
+                    for terminal in terminals if (command_uuid, terminal) in self._responses}
+
+    def update_response(self, command_uuid, terminal, timestamp, data):
+        with self._lock:
+            current = self._responses.get((command_uuid, terminal))
+            if current is not None and current['timestamp'] > timestamp:
+                return False
+
+            self._responses[(command_uuid, terminal)] = {
+                'timestamp': int(timestamp),
+                'data': copy.deepcopy(data)
+            }
+            return True
+
+    def expire(self, cutoff, limit):
+        with self._lock:
+            count = 0
+            while count < len(self._deadlines) and count < limit and \
+                    self._deadlines[count][0] <= cutoff:
+                count += 1
+            entries, self._deadlines = self._deadlines[:count], self._deadlines[count:]
+
+            expired = []
+            for _, command_uuid, terminal, timestamp in entries:
+                state = self._states.pop((command_uuid, terminal, timestamp), None)
+                if self._latest.get((command_uuid, terminal)) == timestamp:
+                    del self._latest[(command_uuid, terminal)]
+                if state is None:
+                    continue
+                expired.append({
+                    'command_uuid': command_uuid,
+                    'terminal': terminal,
+                    'timestamp': timestamp,
+                    'task_tags': state['task_tags']
+                })
+
+            return count, expired
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""Redis-native command state store.
+
+All command state lives in native redis structures and every state transition is a single
+server-side (lua) script, so there is no global lock and each transition costs one round trip.
+
+ - Command Register (expire STATE_TTL_MARGIN after the deadline of the newest instance)
+    'benchmark_command_[command_uuid]': HASH {
+        'protocol': 'http',
+        'info': '{...}'     // json, terminal command information
+    }
+    'benchmark_command_[command_uuid]_latest': HASH {
+        '[terminal]': timestamp     // the newest running instance of each terminal
+    }
+
+ - Command Deadline Index
+    'benchmark_command_deadline': ZSET {
+        '[command_uuid]|[terminal]|[timestamp]': deadline     // running command instances
+    }
+
+ - Command Status (expires as the command register)
+    'benchmark_state_[command_uuid]': HASH {
+        '[terminal]|[timestamp]': '[{"task_id": "111", "task_generate_time": 111111}]'   // json,
+                                    // the task tags of a running command instance
+    }
+
+ - Last Command Response
+    'benchmark_response_[command_uuid]_[terminal]': HASH {
+        'timestamp': 11111,     // terminal_request_send_time, millisecond
+        'data': '{...}'         // json, store data format
+    }
+
+All timestamps in this module are millisecond integers. Every key a script touches is passed in
+KEYS: expire reads the expired index entries first, and its script removes an entry only if it
+is still expired. The deadline index is a single key, so the store requires a standalone redis
+(or a cluster with all the keys in one slot).
+
+"""
+from __future__ import unicode_literals
+import json
+import logging
+import time
+
+from django_redis import get_redis_connection
+
+from .base import CommandStateStore
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_KEY = 'benchmark_command_deadline'
+DEADLINE_MEMBER = '{command_uuid}|{terminal}|{timestamp}'
+
+COMMAND_INFO_KEY = 'benchmark_command_{command_uuid}'
+COMMAND_LATEST_KEY = 'benchmark_command_{command_uuid}_latest'
+COMMAND_STATE_KEY = 'benchmark_state_{command_uuid}'
+
+RESPONSE_KEY = 'benchmark_response_{command_uuid}_{terminal}'
+
+# the command register and status keys outlive the deadline by the margin, an instance which the
+# cleaner doesn't expire in time is still reported (millisecond)
+STATE_TTL_MARGIN = 3600000
+
+
+# KEYS: command info, command latest, command state, deadline index
+# ARGV: command_uuid, terminal, timestamp, acceptable time, protocol, info(json),
+#       task tag(json), deadline, ttl(millisecond)
+REGISTER_SCRIPT = """
+local function extend(key, ttl)
+    if redis.call('PTTL', key) < ttl then
+        redis.call('PEXPIRE', key, ttl)
+    end
+end
+
+local timestamp = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[9])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HMSET', KEYS[1], 'protocol', ARGV[5], 'info', ARGV[6])
+end
+extend(KEYS[1], ttl)
+
+local latest = redis.call('HGET', KEYS[2], ARGV[2])
+if latest and timestamp - tonumber(latest) <= tonumber(ARGV[4]) then
+    local field = ARGV[2] .. '|' .. latest
+    local task_tags = redis.call('HGET', KEYS[3], field)
+    if task_tags then
+        redis.call('HSET', KEYS[3], field, string.sub(task_tags, 1, -2) .. ',' .. ARGV[7] .. ']')
+        return 'update'
+    end
+end
+
+redis.call('HSET', KEYS[3], ARGV[2] .. '|' .. ARGV[3], '[' .. ARGV[7] .. ']')
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+redis.call('ZADD', KEYS[4], ARGV[8], ARGV[1] .. '|' .. ARGV[2] .. '|' .. ARGV[3])
+extend(KEYS[2], ttl)
+extend(KEYS[3], ttl)
+return 'create'
+"""
+
+# KEYS: command state, command latest, deadline index
+# ARGV: terminal, timestamp, deadline member
+ERASE_SCRIPT = """
+local field = ARGV[1] .. '|' .. ARGV[2]
+local task_tags = redis.call('HGET', KEYS[1], field)
+if not task_tags then
+    return {'missing'}
+end
+
+redis.call('HDEL', KEYS[1], field)
+redis.call('ZREM', KEYS[3], ARGV[3])
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+return {'erased', task_tags}
+"""
+
+# KEYS: response
+# ARGV: timestamp, data(json)
+UPDATE_RESPONSE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'timestamp')
+if current and tonumber(current) > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('HMSET', KEYS[1], 'timestamp', ARGV[1], 'data', ARGV[2])
+return 1
+"""
+
+# KEYS: deadline index, then the command state and command latest of each member
+# ARGV: cutoff, then the deadline members
+# Return: the count of removed index entries, then (the member index, task_tags) of each
+#         expired command instance.
+EXPIRE_SCRIPT = """
+local expired = {0}
+for i = 2, #ARGV do
+    local member = ARGV[i]
+    local deadline = redis.call('ZSCORE', KEYS[1], member)
+    if deadline and tonumber(deadline) <= tonumber(ARGV[1]) then
+        local first = string.find(member, '|', 1, true)
+        local second = string.find(member, '|', first + 1, true)
+        local terminal = string.sub(member, first + 1, second - 1)
+        local timestamp = string.sub(member, second + 1)
+        local state_key = KEYS[2 * i - 2]
+        local latest_key = KEYS[2 * i - 1]
+
+        local field = terminal .. '|' .. timestamp
+        local task_tags = redis.call('HGET', state_key, field)
+        if task_tags then
+            redis.call('HDEL', state_key, field)
+            table.insert(expired, i - 1)
+            table.insert(expired, task_tags)
+        end
+        if redis.call('HGET', latest_key, terminal) == timestamp then
+            redis.call('HDEL', latest_key, terminal)
+        end
+        redis.call('ZREM', KEYS[1], member)
+        expired[1] = expired[1] + 1
+    end
+end
+return expired
+"""
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+class RedisStateStore(CommandStateStore):
+    """Command state store based on redis hashes and sorted sets.
+
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._conn = None
+        self._scripts = {}
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = get_redis_connection(self.alias)
+        return self._conn
+
+    def _script(self, name, source):
+        script = self._scripts.get(name)
+        if script is None:
+            script = self.conn.register_script(source)
+            self._scripts[name] = script
+        return script
+
+    @staticmethod
+    def _register_keys(command_uuid):
+        return [COMMAND_INFO_KEY.format(command_uuid=command_uuid),
+                COMMAND_LATEST_KEY.format(command_uuid=command_uuid),
+                COMMAND_STATE_KEY.format(command_uuid=command_uuid),
+                DEADLINE_KEY]
+
+    @staticmethod
+    def _register_args(command_uuid, terminal, timestamp, acceptable_time, protocol,
+                       info_data, task_data, deadline):
+        ttl = max(int(deadline - time.time() * 1000), 0) + STATE_TTL_MARGIN
+        return [command_uuid, terminal, timestamp, acceptable_time, protocol, info_data, task_data,
+                deadline, ttl]
+
+    @staticmethod
+    def _erase_keys(command_uuid):
+        return [COMMAND_STATE_KEY.format(command_uuid=command_uuid),
+                COMMAND_LATEST_KEY.format(command_uuid=command_uuid),
+                DEADLINE_KEY]
+
+    def register(self, command_uuid, terminal, timestamp, command_info, task_info,
+                 acceptable_time, deadline):
+        """Register a command instance, or merge task_info into a running one.
+
+        :return: 'create' or 'update'
+        """
+        script = self._script('register', REGISTER_SCRIPT)
+        args = self._register_args(command_uuid, terminal, timestamp, acceptable_time,
+                                   command_info.get('protocol', ''), json.dumps(command_info),
+                                   json.dumps(task_info), deadline)
+
+        return _to_str(script(keys=self._register_keys(command_uuid), args=args))
+
+    def register_batch(self, command_uuid, terminals, timestamp, command_info, task_info,
+                       acceptable_time, deadline):
+        """Register a command instance for each terminal in one pipelined round trip.
+
+        :return: a dict, terminal -> 'create', 'update' or None (failed)
+        """
+        if not terminals:
+            return {}
+
+        script = self._script('register', REGISTER_SCRIPT)
+        keys = self._register_keys(command_uuid)
+        info_data = json.dumps(command_info)
+        task_data = json.dumps(task_info)
+        protocol = command_info.get('protocol', '')
+
+        pipe = self.conn.pipeline(transaction=False)
+        for terminal in terminals:
+            args = self._register_args(command_uuid, terminal, timestamp, acceptable_time,
+                                       protocol, info_data, task_data, deadline)
+            script(keys=keys, args=args, client=pipe)
+
+        operations = {}
+        for terminal, res in zip(terminals, pipe.execute(raise_on_error=False)):
+            if isinstance(res, Exception):
+                logger.error('Registry command({}-{}) occur error: {}'.format(command_uuid, terminal, res))
+                operations[terminal] = None
+            else:
+                operations[terminal] = _to_str(res)
+
+        return operations
+
+    def erase(self, command_uuid, terminal, timestamp):
+        """Finish a running command instance.
+
+        :return: a list of task tags, None if there is not a running instance.
+        """
+        script = self._script('erase', ERASE_SCRIPT)
+        keys = self._erase_keys(command_uuid)
+        args = [terminal, timestamp,
+                DEADLINE_MEMBER.format(command_uuid=command_uuid, terminal=terminal, timestamp=timestamp)]
+
+        res = script(keys=keys, args=args)
+        status = _to_str(res[0])
+        if status != 'erased':
+            logger.error('Erase on a ({}) command instance({}-{}-{})'.format(
+                status, command_uuid, timestamp, terminal))
+            return None
+
+        return json.loads(_to_str(res[1]))
+
+    def erase_batch(self, instances):
+        """Finish a list of running command instances in one pipelined round trip.
+
+        :param instances: a list of (command_uuid, terminal, timestamp)
+        :return: a list of task tags (or None), in the order of instances
+        """
+        if not instances:
+            return []
+
+        script = self._script('erase', ERASE_SCRIPT)
+        pipe = self.conn.pipeline(transaction=False)
+        for command_uuid, terminal, timestamp in instances:
+            keys = self._erase_keys(command_uuid)
+            args = [terminal, timestamp,
+                    DEADLINE_MEMBER.format(command_uuid=command_uuid, terminal=terminal, timestamp=timestamp)]
+            script(keys=keys, args=args, client=pipe)
+
+        results = []
+        for instance, res in zip(instances, pipe.execute(raise_on_error=False)):
+            if isinstance(res, Exception):
+                logger.error('Erase command instance({}-{}-{}) occur error: {}'.format(
+                    instance[0], instance[2], instance[1], res))
+                results.append(None)
+            elif _to_str(res[0]) != 'erased':
+                logger.error('Erase on a ({}) command instance({}-{}-{})'.format(
+                    _to_str(res[0]), instance[0], instance[2], instance[1]))
+                results.append(None)
+            else:
+                results.append(json.loads(_to_str(res[1])))
+
+        return results
+
+    def get_command_protocol(self, command_uuid):
+        protocol = self.conn.hget(COMMAND_INFO_KEY.format(command_uuid=command_uuid), 'protocol')
+        return _to_str(protocol)
+
+    def get_command_protocols(self, command_uuids):
+        pipe = self.conn.pipeline(transaction=False)
+        for command_uuid in command_uuids:
+            pipe.hget(COMMAND_INFO_KEY.format(command_uuid=command_uuid), 'protocol')
+
+        return {command_uuid: _to_str(protocol)
+                for command_uuid, protocol in zip(command_uuids, pipe.execute())
+                if protocol is not None}
+
+    def get_response(self, command_uuid, terminal):
+        """Get the last command response.
+
+        :return: {'timestamp': 11111, 'data': {}} or None
+        """
+        timestamp, data = self.conn.hmget(
+            RESPONSE_KEY.format(command_uuid=command_uuid, terminal=terminal), 'timestamp', 'data')
+        if timestamp is None:
+            return None
+
+        return {
+            'timestamp': int(timestamp),
+            'data': json.loads(_to_str(data)) if data else None
+        }
+
+    def get_responses(self, command_uuid, terminals):
+        """Get the last command responses of terminals in one pipelined round trip.
+
+        :return: a dict, terminal -> {'timestamp': 11111, 'data': {}}, without missing terminals
+        """
+        pipe = self.conn.pipeline(transaction=False)
+        for terminal in terminals:
+            pipe.hmget(RESPONSE_KEY.format(command_uuid=command_uuid, terminal=terminal),
+                       'timestamp', 'data')
+
+        responses = {}
+        for terminal, (timestamp, data) in zip(terminals, pipe.execute()):
+            if timestamp is None:
+                continue
+            responses[terminal] = {
+                'timestamp': int(timestamp),
+                'data': json.loads(_to_str(data)) if data else None
+            }
+
+        return responses
+
+    def update_response(self, command_uuid, terminal, timestamp, data):
+        """Update the last command response, an older response never overwrites a newer one.
+
+        :return: True if updated
+        """
+        script = self._script('update_response', UPDATE_RESPONSE_SCRIPT)
+        res = script(keys=[RESPONSE_KEY.format(command_uuid=command_uuid, terminal=terminal)],
+                     args=[timestamp, json.dumps(data)])
+        return bool(res)
+
+    def update_response_batch(self, responses):
+        """Update a list of last command responses in one pipelined round trip.
+
+        :param responses: a list of (command_uuid, terminal, timestamp, data)
+        :return: a list of bool, in the order of responses
+        """
+        if not responses:
+            return []
+
+        script = self._script('update_response', UPDATE_RESPONSE_SCRIPT)
+        pipe = self.conn.pipeline(transaction=False)
+        for command_uuid, terminal, timestamp, data in responses:
+            script(keys=[RESPONSE_KEY.format(command_uuid=command_uuid, terminal=terminal)],
+                   args=[timestamp, json.dumps(data)], client=pipe)
+
+        return [not isinstance(res, Exception) and bool(res)
+                for res in pipe.execute(raise_on_error=False)]
+
+    def expire(self, cutoff, limit):
+        """Remove at most limit command instances whose deadline is no later than cutoff.
+
+        :return: (scanned, expired), scanned is the count of removed index entries, expired is
+                 a list of the expired command instances.
+        """
+        members = [_to_str(member) for member in
+                   self.conn.zrangebyscore(DEADLINE_KEY, '-inf', int(cutoff), start=0, num=limit)]
+        if not members:
+            return 0, []
+
+        instances = []
+        keys = [DEADLINE_KEY]
+        for member in members:
+            command_uuid, terminal, timestamp = member.split('|')
+            instances.append((command_uuid, terminal, timestamp))
+            keys.append(COMMAND_STATE_KEY.format(command_uuid=command_uuid))
+            keys.append(COMMAND_LATEST_KEY.format(command_uuid=command_uuid))
+
+        script = self._script('expire', EXPIRE_SCRIPT)
+        res = script(keys=keys, args=[int(cutoff)] + members)
+        expired = []
+        for index in range(1, len(res), 2):
+            command_uuid, terminal, timestamp = instances[int(res[index]) - 1]
+            expired.append({
+                'command_uuid': command_uuid,
+                'terminal': terminal,
+                'timestamp': int(timestamp),
+                'task_tags': json.loads(_to_str(res[index + 1]))
+            })
+
+        return int(res[0]), expired
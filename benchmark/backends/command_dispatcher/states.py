@@ -1,88 +1,45 @@
 # -*- coding: utf-8 -*-
-"""In-memory representation of command state.
+"""Command state API.
 
-We maintain command information in memory, there are three types of data about command information.
+We maintain command information in a state store, there are three types of data about command
+information.
  - Command Register
-    This type information records unfinished command batches. A command batch is identified by
-    command_uuid and a timestamp, and with a list of terminals.
-    So the command register structure likes:
-
-    'benchmark_command_register': set(['command_uuid_1', 'command_uuid_2'])
-    'benchmark_command_register_[command_uuid]': {
-        'info': {    // protocol related information
-            'protocol': 'http',
-        },
-        'batches': {
-            timestamp_1: set(['terminal_1', 'terminal_2']),
-        }
-    }
+    This type information records the command information and the running command instances.
+    The running command instances are indexed by their deadline (command timestamp plus
+    COMMAND_TIMEOUT), so a clean pass only touches the expired instances.
 
  - Command Status
     The command status is a Finite-State Machine, which includes running and finished states.
-    Each command is a FSM, which identified by command_uuid, terminal and timestamp(microsecond).
-    So the command status structure likes:
-    'benchmark_state_[command_uuid]-[terminal]-[timestamp]: {
-        'command_generate_time': timestamp,
-        'state': 'running/finished',
+    Each command is a FSM, which identified by command_uuid, terminal and timestamp(millisecond).
+    The state records the task tags which wait for the command result:
         'task_tags': [{'task_id': 111, 'task_generate_time': 111111}]
-    }
 
  - Last Command Response
     The newest command response depends on terminal_request_send_time which is in terminal response.
+    It records the timestamp(terminal_request_send_time, millisecond) and the store data.
+
+The state store backend is configured by 'command_state_backend' in natrix.ini, and the storage
+layout is described in state_stores. Each state transition (register, erase, update
+and expire) is atomic in the state store, so CommandAPI doesn't take any lock.
 
-    So the last command response structure likes:
-    '[command_uuid]-[terminal]': {
-        'timestamp': 11111, //this is terminal_request_send_time, microsecond
-        'data': {}    // store data formatrer
-    }
 """
 
 from __future__ import unicode_literals
-import logging, time, copy
-import pprint
-
-from django.core.cache import cache
+import logging, time
 
 from natrix.common import exception as natrix_exception
+from natrix.common.config import natrix_config
 
-logger = logging.getLogger(__name__)
-
-REGISTER_KEY = 'benchmark_command_register'
-REGISTER_LOCK = 'benchmark_register_lock'
-COMMAND_REGISTER_KEY = 'benchmark_command_register_{command_uuid}'
-COMMAND_REGISTER_LOCK = 'benchmark_command_register_{command_uuid}_lock'
-
-COMMAND_STATE_KEY = 'benchmark_state_{command_uuid}_{terminal}_{timestamp}'
+from .state_stores import get_state_store
 
-RESPONSE_KEY = 'benchmark_response_{command_uuid}_{terminal}'
-RESPONSE_LOCK = 'benchmark_response_{command_uuid}_{terminal}_lock'
-
-COMMAND_ACCEPTABLE_TIME = 10000  #microsecond
-
-class CacheLock(object):
-
-    @staticmethod
-    def get_lock(lock_name):
-        return cache.lock(lock_name)
-
-    @staticmethod
-    def release_lock(lock):
-        return lock.release()
-
-
-class CacheOpt(object):
+logger = logging.getLogger(__name__)
 
-    @staticmethod
-    def get(key):
-        return cache.get(key)
+COMMAND_ACCEPTABLE_TIME = 10000  # millisecond
+COMMAND_TIMEOUT = int(natrix_config.get_value('BENCHMARK', 'command_clean_time'))  # millisecond
+REGISTER_BATCH_SIZE = 500
+EXPIRE_BATCH_SIZE = 1000
 
-    @staticmethod
-    def set(key, data, timeout=None):
-        return cache.set(key, data, timeout=timeout)
-
-    @staticmethod
-    def delete(key):
-        return cache.delete(key)
+state_store = get_state_store()
 
 
 class CommandAPI(object):
@@ -95,93 +52,16 @@ class CommandAPI(object):
         :param command_info:
         :return operation: None(Do nothing, occur error), update(add task info), create(a new record)
         """
-        def add_command_register():
-            register_lock = CacheLock.get_lock(REGISTER_LOCK)
-            try:
-                register_lock.acquire()
-                register_data = CacheOpt.get(REGISTER_KEY)
-                if register_data is None:
-                    logger.debug('Initialize Register .....')
-                    register_data = set()
-
-                if command_uuid not in register_data:
-                    logger.info('Registry a new command ({})'.format(command_uuid))
-                    register_data.add(command_uuid)
-                    CacheOpt.set(REGISTER_KEY, register_data)
-            finally:
-                CacheLock.release_lock(register_lock)
-
-        def add_terminal_record(command_timestamp):
-            command_register_lock = CacheLock.get_lock(
-                            COMMAND_REGISTER_LOCK.format(command_uuid=command_uuid))
-
-            try:
-                command_register_key = COMMAND_REGISTER_KEY.format(command_uuid=command_uuid)
-                command_register_lock.acquire()
-
-                command_register_record = CacheOpt.get(command_register_key)
-                if command_register_record is None:
-                    command_register_record = {
-                        'info': command_info,
-                        'batches': {}
-                    }
-
-                # Command State Machine process
-                finished = False
-                for key, terminals in command_register_record['batches'].items():
-                    if command_timestamp - key > COMMAND_ACCEPTABLE_TIME:
-                        continue
-
-                    if terminal not in terminals:
-                        continue
-                    command_state_key = COMMAND_STATE_KEY.format(command_uuid=command_uuid,
-                                                                 terminal=terminal,
-                                                                 timestamp=key)
-                    command_state = CacheOpt.get(command_state_key)
-                    if command_state is None:
-                        logger.error('There is an registry command without state machine: '
-                                     '{}-{}-{}'.format(command_uuid, terminal, key))
-                        continue
-
-                    if command_state['state'] == 'finished':
-                        continue
-
-                    command_state['task_tags'].append(task_info)
-                    CacheOpt.set(command_state_key, command_state)
-                    finished = True
-                    break
-
-                if finished:
-                    logger.debug('Update command state!')
-                    return 'update'
-                else:
-                    if command_timestamp in command_register_record['batches']:
-                        command_register_record['batches'][command_timestamp].add(terminal)
-                    else:
-                        command_register_record['batches'][command_timestamp] = set([terminal])
-                    CacheOpt.set(command_register_key, command_register_record)
-
-                    command_state_key = COMMAND_STATE_KEY.format(command_uuid=command_uuid,
-                                                                 terminal=terminal,
-                                                                 timestamp=command_timestamp)
-                    CacheOpt.set(command_state_key, {
-                        'command_generate_time': command_timestamp,
-                        'state': 'running',
-                        'task_tags': [task_info]
-                    })
-                    return 'create'
-
-            except Exception as e:
-                natrix_exception.natrix_traceback()
-                logger.error('Add terminal record (set command state machine) with error: {}'.format(e))
-                return None
-            finally:
-                CacheLock.release_lock(command_register_lock)
-
         try:
             command_timestamp = int(command_timestamp * 1000)
-            add_command_register()
-            operation = add_terminal_record(command_timestamp)
+            operation = state_store.register(command_uuid, terminal, command_timestamp,
+                                             command_info, task_info, COMMAND_ACCEPTABLE_TIME,
+                                             command_timestamp + COMMAND_TIMEOUT)
+            if operation == 'create':
+                logger.debug('Registry a new command instance ({}-{}-{})'.format(
+                    command_uuid, terminal, command_timestamp))
+            else:
+                logger.debug('Update command state!')
             return operation
         except Exception as e:
             natrix_exception.natrix_traceback()
@@ -190,66 +70,67 @@ class CommandAPI(object):
             return None
 
     @staticmethod
-    def erase_command(command_uuid, terminal, command_timestamp):
-
-        def erase_command_record(command_timestamp):
-            command_register_lock = CacheLock.get_lock(
-                COMMAND_REGISTER_LOCK.format(command_uuid=command_uuid))
+    def registry_command_batch(command_uuid, terminals, command_timestamp, command_info, task_info,
+                               freshness=60000):
+        """Registry a command for a list of terminals.
+
+        For each batch of REGISTER_BATCH_SIZE terminals, the response-reuse check is one pipelined
+        read and the registration (state creation and task tags merging) is one pipelined write.
+
+        :param terminals: a list of terminal mac
+        :param freshness: the same as available_response
+        :return: a dict, terminal -> {
+            'operation': create/update/reused/failed,
+            'response': the reused response data (only for reused)
+        }
+        """
+        results = {}
+        command_timestamp = int(command_timestamp * 1000)
 
+        for index in range(0, len(terminals), REGISTER_BATCH_SIZE):
+            batch = terminals[index: index + REGISTER_BATCH_SIZE]
             try:
-                command_register_key = COMMAND_REGISTER_KEY.format(command_uuid=command_uuid)
-                command_state_key = COMMAND_STATE_KEY.format(command_uuid=command_uuid,
-                                                             terminal=terminal,
-                                                             timestamp=command_timestamp)
-                command_register_lock.acquire()
-
-                command_register_record = CacheOpt.get(command_register_key)
-                if command_register_record is None:
-                    logger.error('Erase on a non-exist command register({})!'.format(command_uuid))
-                    return None
-
-                if command_timestamp not in command_register_record['batches']:
-                    logger.error('Erase on a non-exist command batches({}-{})'.format(
-                        command_uuid, command_timestamp
-                    ))
-                    return None
-
-                if terminal not in command_register_record['batches'][command_timestamp]:
-                    logger.error('Erase on a non-exist command instance({}-{}-{})'.format(
-                        command_uuid, command_timestamp, terminal
-                    ))
-                    return None
-
-                command_state = CacheOpt.get(command_state_key)
-                if command_state is None:
-                    logger.error('Erase on a non-exist command state({}-{}-{})'.format(
-                        command_uuid, command_timestamp, terminal
-                    ))
-                    return None
-
-                if command_state['state'] != 'running':
-                    logger.error('Erase an ({}) command({}-{}-{})'.format(
-                        command_state['state'], command_uuid, command_timestamp, terminal
-                    ))
-                    return None
-
-                task_tags = command_state['task_tags']
-                command_register_record['batches'][command_timestamp].remove(terminal)
-                CacheOpt.set(command_register_key, command_register_record)
-                CacheOpt.delete(command_state_key)
-
-                return task_tags
+                curr_time = time.time() * 1000
+                responses = state_store.get_responses(command_uuid, batch)
+
+                register_terminals = []
+                for terminal in batch:
+                    response_record = responses.get(terminal)
+                    if response_record is not None and \
+                            0 <= curr_time - response_record['timestamp'] <= freshness:
+                        results[terminal] = {'operation': 'reused', 'response': response_record['data']}
+                    else:
+                        register_terminals.append(terminal)
+
+                operations = state_store.register_batch(command_uuid, register_terminals,
+                                                        command_timestamp, command_info, task_info,
+                                                        COMMAND_ACCEPTABLE_TIME,
+                                                        command_timestamp + COMMAND_TIMEOUT)
+                for terminal in register_terminals:
+                    operation = operations.get(terminal)
+                    results[terminal] = {
+                        'operation': operation if operation in ('create', 'update') else 'failed',
+                        'response': None
+                    }
             except Exception as e:
                 natrix_exception.natrix_traceback()
-                logger.error('Erase command state with error: {}'.format(e))
-                return None
-            finally:
-                CacheLock.release_lock(command_register_lock)
+                logger.error('Registry command({}) batch occur error: {}'.format(command_uuid, e))
+                for terminal in batch:
+                    results.setdefault(terminal, {'operation': 'failed', 'response': None})
 
+        logger.info('Registry command({}) for {} terminals'.format(command_uuid, len(results)))
+        return results
+
+    @staticmethod
+    def erase_command(command_uuid, terminal, command_timestamp):
+        """Erase a running command instance.
+
+        :return: the task tags of the command instance, None if there is no running instance.
+        """
         try:
             command_timestamp = int(command_timestamp * 1000)
 
-            task_tags = erase_command_record(command_timestamp)
+            task_tags = state_store.erase(command_uuid, terminal, command_timestamp)
 
             return task_tags
 
@@ -260,6 +141,22 @@ class CommandAPI(object):
 
             return None
 
+    @staticmethod
+    def erase_command_batch(commands):
+        """Erase a list of running command instances.
+
+        :param commands: a list of (command_uuid, terminal, command_timestamp)
+        :return: a list of task tags (None if there is no running instance), in the order of commands
+        """
+        try:
+            instances = [(command_uuid, terminal, int(command_timestamp * 1000))
+                         for command_uuid, terminal, command_timestamp in commands]
+            return state_store.erase_batch(instances)
+        except Exception as e:
+            natrix_exception.natrix_traceback()
+            logger.error('Erase command batch occur error: {}'.format(e))
+            return [None] * len(commands)
+
     @staticmethod
     def get_command_protocol(command_uuid):
         """Get command protocol information, this is a read operation.
@@ -270,21 +167,9 @@ class CommandAPI(object):
         :return:
         """
         try:
-            command_key = COMMAND_REGISTER_KEY.format(command_uuid=command_uuid)
-            command_register = CacheOpt.get(command_key)
-            if command_register is None:
-                logger.error('Get an non-exist command: ({})'.format(command_uuid))
-                return None
-
-            command_info = command_register.get('info', None)
-            if command_info is None:
-                logger.error('Command({}) without "info" field, '
-                             'confirm register operation is right!'.format(command_uuid))
-                return None
-            protocol_type = command_info.get('protocol', None)
+            protocol_type = state_store.get_command_protocol(command_uuid)
             if protocol_type is None:
-                logger.error('Command({}) info without "protocol" field, '
-                             'confirm register operation is right'.format(command_uuid))
+                logger.error('Get an non-exist command: ({})'.format(command_uuid))
                 return None
 
             return protocol_type
@@ -294,6 +179,19 @@ class CommandAPI(object):
             logger.error('Getting command({}) protocol occur error: {}.'.format(command_uuid, e))
             return None
 
+    @staticmethod
+    def get_command_protocols(command_uuids):
+        """Get the protocols of a list of commands, this is a read operation.
+
+        :return: a dict, command_uuid -> protocol
+        """
+        try:
+            return state_store.get_command_protocols(list(command_uuids))
+        except Exception as e:
+            natrix_exception.natrix_traceback()
+            logger.error('Getting commands protocol occur error: {}.'.format(e))
+            return {}
+
     @staticmethod
     def available_response(command_uuid, terminal, freshness=60000):
         """Get available response, this is a read operation.
@@ -305,21 +203,13 @@ class CommandAPI(object):
         :return:
         """
         try:
-            response_key = RESPONSE_KEY.format(command_uuid=command_uuid, terminal=terminal)
-
-            response_record = CacheOpt.get(response_key)
+            response_record = state_store.get_response(command_uuid, terminal)
 
             if response_record is None:
                 logger.info('Do not hit command({}-{}) response'.format(command_uuid, terminal))
                 return None
 
-            response_timestamp = response_record.get('timestamp', None)
-            if response_timestamp is None:
-                logger.error('Command({}-{}) response format is wrong!'.format(
-                    command_uuid, terminal))
-                return None
-
-            delta = time.time() * 1000 - response_timestamp
+            delta = time.time() * 1000 - response_record['timestamp']
             if delta > freshness:
                 # Don't hit the command response
                 logger.info('Do not hit command({}-{}) response'.format(command_uuid, terminal))
@@ -346,94 +236,74 @@ class CommandAPI(object):
         :param data:
         :return:
         """
-
         try:
-            response_lock = CacheLock.get_lock(RESPONSE_LOCK.format(command_uuid=command_uuid,
-                                                                    terminal=terminal))
-            response_key = RESPONSE_KEY.format(command_uuid=command_uuid, terminal=terminal)
-            response_lock.acquire()
-
             timestamp = data.get('terminal_request_send_time', None)
             if timestamp is None:
                 logger.error('Update response with an wrong format response data: {}'.format(data))
                 return None
 
-            response_record = {
-                'timestamp': timestamp,
-                'data': data
-            }
-            CacheOpt.set(response_key, response_record, timeout=None)
+            return state_store.update_response(command_uuid, terminal, timestamp, data)
         except Exception as e:
             natrix_exception.natrix_traceback()
             logger.error('Update response record with error: {}'.format(e))
             return None
-        finally:
-            # release lock
-            CacheLock.release_lock(response_lock)
 
     @staticmethod
-    def clean_expired_commands(freshness=300000):
-        """
+    def update_response_batch(responses):
+        """Update a list of response data.
 
-        :param freshness:
+        :param responses: a list of (command_uuid, terminal, data)
         :return:
         """
-        def clean_register(command_uuid, curr_time):
-            command_register_lock = CacheLock.get_lock(
-                    COMMAND_REGISTER_LOCK.format(command_uuid=command_uuid))
-            try:
-                expired_command = []
-                remain_command = {}
-
-                command_register_key = COMMAND_REGISTER_KEY.format(command_uuid=command_uuid)
-                command_register_lock.acquire()
-                command_register_record = CacheOpt.get(command_register_key)
-
-                # key is command_generate_time and v is a list of terminals
-                for key, v in command_register_record['batches'].items():
-                    if curr_time - key < freshness:
-                        remain_command[key] = v
-                        continue
-
-                    for terminal in v:
-                        command_state_key = COMMAND_STATE_KEY.format(
-                            command_uuid=command_uuid, terminal=terminal, timestamp=key)
-
-                        command_state_record = CacheOpt.get(command_state_key)
-                        task_tags = command_state_record.get('task_tags')
+        records = []
+        for command_uuid, terminal, data in responses:
+            timestamp = data.get('terminal_request_send_time', None)
+            if timestamp is None:
+                logger.error('Update response with an wrong format response data: {}'.format(data))
+                continue
+            records.append((command_uuid, terminal, timestamp, data))
 
-                        expired_command.append({
-                            'command_uuid': command_uuid,
-                            'timestamp': int(key) / 1000.0,
-                            'terminal': terminal,
-                            'task_tags': task_tags
-                        })
+        try:
+            return state_store.update_response_batch(records)
+        except Exception as e:
+            natrix_exception.natrix_traceback()
+            logger.error('Update response records with error: {}'.format(e))
+            return None
 
-                        CacheOpt.delete(command_state_key)
+    @staticmethod
+    def clean_expired_commands(freshness=300000, stats=None):
+        """Remove the command instances which are generated before freshness milliseconds ago.
 
-                    logger.info('[Command Clean]: ({command}-{stamp}) is timeout {timeout} ms, '
-                                'which contain {count} terminal!'.format(command=command_uuid,
-                                                                         stamp=key,
-                                                                         timeout=curr_time - key,
-                                                                         count=len(v)))
+        The deadline index is consumed in batches of EXPIRE_BATCH_SIZE, so a pass only touches
+        the expired entries.
 
-                command_register_record['batches'] = remain_command
-                CacheOpt.set(command_register_key, command_register_record)
+        :param freshness:
+        :param stats: a dict, the counts 'scanned' (index entries) and 'expired' are added to it
+        :return: a list of expired command instances
+        """
+        cutoff = time.time() * 1000 - freshness + COMMAND_TIMEOUT
+        expired_list = []
+        scanned_count = 0
 
-                return expired_command
+        while True:
+            try:
+                scanned, expired_commands = state_store.expire(cutoff, EXPIRE_BATCH_SIZE)
             except Exception as e:
                 natrix_exception.natrix_traceback()
                 logger.error('Remove terminal record (clean expired commands) with error: {}'.format(e))
-                return None
-            finally:
-                CacheLock.release_lock(command_register_lock)
+                break
 
-        command_list = list(CacheOpt.get(REGISTER_KEY))
-        curr_time = time.time() * 1000
-        expired_list = []
-
-        for command_uuid in command_list:
-            expired_commands = clean_register(command_uuid, curr_time)
+            for command in expired_commands:
+                command['timestamp'] = command['timestamp'] / 1000.0
             expired_list.extend(expired_commands)
+            scanned_count += scanned
+
+            if scanned < EXPIRE_BATCH_SIZE:
+                break
 
+        if stats is not None:
+            stats['scanned'] = stats.get('scanned', 0) + scanned_count
+            stats['expired'] = stats.get('expired', 0) + len(expired_list)
+        logger.info('[Command Clean]: scanned {} entries, {} command instances are timeout {} ms'.format(
+            scanned_count, len(expired_list), freshness))
         return expired_list
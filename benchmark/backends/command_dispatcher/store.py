@@ -5,28 +5,63 @@
 import logging
 
 from natrix.common import exception as natrix_exception
+from natrix.common.config import natrix_config
 from utils.elasticsearch import NatrixESClient
-from benchmark.backends.stores import eventhub_client
+from benchmark.backends.stores import store_writer, partition
+
+from .rollup import rollup_records
 
 
 logger = logging.getLogger(__name__)
 
 
 def store_message(type, data):
+    """Enqueue a message, the store writer (spool or buffer) stores messages in batches.
+
+    The stored records are rolled up (see rollup.py) if the rollups are enabled.
+    """
     try:
         record = {
             '_type': type
         }
         record.update(data)
-        eventhub_client.put(record)
+        store_writer.put(record)
+        rollup_records([record])
     except natrix_exception.NatrixBaseException as e:
         natrix_exception.natrix_traceback()
         logger.error('store message with exception: {}'.format(e.get_log()))
 
 
-# TODO: The count of records may exceed 1000
+def store_event(event):
+    """Enqueue an event, the event is serialized (to_record) here.
+
+    """
+    try:
+        record = event.to_record()
+        store_writer.put(record)
+        rollup_records([record])
+    except natrix_exception.NatrixBaseException as e:
+        natrix_exception.natrix_traceback()
+        logger.error('store event with exception: {}'.format(e.get_log()))
+
+
+def store_events(events):
+    """Enqueue a list of events.
+
+    """
+    if not events:
+        return
+    try:
+        records = [event.to_record() for event in events]
+        store_writer.puts(records)
+        rollup_records(records)
+    except natrix_exception.NatrixBaseException as e:
+        natrix_exception.natrix_traceback()
+        logger.error('store events with exception: {}'.format(e.get_log()))
+
+
 def search_messages(body=None, size=1000):
-    """Get all data satisfy the condition.
+    """Get the data satisfy the condition, at most size records (use scan_messages for all).
 
     :param body:
     :param size:
@@ -34,13 +69,52 @@ def search_messages(body=None, size=1000):
     """
     if body is None:
         body = {}
-    natrix_es_client = NatrixESClient(app='benchmark')
+    natrix_es_client = NatrixESClient(app='benchmark', index=partition.get_search_index())
     records = natrix_es_client.pull(condition=body, size=size)
     return records
 
 
-def origin_search(body, size=1000):
-    natrix_es_client = NatrixESClient(app='benchmark')
-    res = natrix_es_client.origin_search(condition=body, size=size)
+def scan_messages(body=None, source=None, routing=None):
+    """Iterate all data satisfy the condition, page by page.
+
+    The records of all partitions are scanned (see stores.partition).
+
+    :param body:
+    :param source: _source filtering
+    :param routing: the routing of the records (partition.get_routing)
+    :return: a generator of records
+    """
+    if body is None:
+        body = {}
+    natrix_es_client = NatrixESClient(app='benchmark', index=partition.get_search_index())
+    return natrix_es_client.scan(condition=body, source=source, routing=routing)
+
+
+def origin_search(body, size=1000, app='benchmark', index=None, routing=None):
+    """
+    :param index: the indices to search (partition.get_search_index), the index of app by default
+    :param routing: the routing of the records (partition.get_routing)
+    """
+    natrix_es_client = NatrixESClient(app=app)
+    res = natrix_es_client.origin_search(condition=body, size=size, index=index, routing=routing)
     return res
 
+
+def multi_search(searches):
+    """Send searches (of the benchmark indices) in one msearch request.
+
+    :param searches: a list of (app, body, size, index, routing), app selects the index
+                     ('benchmark', ...) if index is None
+    :return: the responses in the same order, a failed search is {'error': ...}
+    """
+    conditions = []
+    for app, body, size, index, routing in searches:
+        condition = dict(body)
+        condition['size'] = size
+        if index is None:
+            index = natrix_config.get_value('ELASTICSEARCH', '{}_index'.format(app))
+        conditions.append((index, condition, routing))
+
+    natrix_es_client = NatrixESClient(app='benchmark')
+    return natrix_es_client.multi_search(conditions)
+
@@ -9,16 +9,24 @@ from benchmark.api.imports import terminal as terminal_api
 
 class TerminalAPI(object):
 
-    def __init__(self, mac):
+    def __init__(self, mac, lookup=True):
+        """
+        :param mac:
+        :param lookup: False to skip the lookup of the register info, the terminal is treated as
+                       an unregistered terminal (e.g. the lookup failed)
+        """
         self.mac = mac
-        self.register_info = terminal_api.get_terminal_info(mac)
+        self.register_info = terminal_api.get_terminal_info(mac) if lookup else None
 
         if self.register_info is None:
             self.register_orgs = []
+            self.register_ancestry = []
             self.register_isp = ''
             self.register_region = None
         else:
             self.register_orgs = list(self.register_info.get('organizations', []))
+            # the register info cached before the ancestry is added, use the register organizations
+            self.register_ancestry = list(self.register_info.get('ancestry', self.register_orgs))
             self.register_isp = self.register_info.get('isp', '')
             self.register_region = self.register_info.get('region', None)
 
@@ -34,6 +42,21 @@ class TerminalAPI(object):
     def get_org_names(self):
         return list(map(lambda x: x['name'], self.register_orgs))
 
+    def get_ancestry_ids(self):
+        return list(map(lambda x: x['id'], self.register_ancestry))
+
+    def get_ancestry_names(self):
+        return list(map(lambda x: x['name'], self.register_ancestry))
+
+    def enrich(self, event):
+        """Set the register info (region and organization ancestry) of the terminal to an event.
+
+        """
+        event.province = self.get_register_province()
+        event.city = self.get_register_city()
+        event.organization_id = self.get_ancestry_ids()
+        event.organization_name = self.get_ancestry_names()
+
     def get_register_province(self):
         if self.register_region is None:
             return ''
@@ -0,0 +1,33 @@
+import copy
+
+from django.test import SimpleTestCase
+
+from benchmark.backends.command_dispatcher.benchmarks.response_validation import sample_responses
+from benchmark.backends.command_dispatcher.serializers.response import TerminalResponse
+from benchmark.backends.command_dispatcher.serializers.compiled_response import CompiledTerminalResponse
+
+
+class CompiledTerminalResponseTestCase(SimpleTestCase):
+
+    def validate(self, response, command_protocols):
+        context = {'command_protocols': command_protocols}
+        drf = TerminalResponse(data=copy.deepcopy(response), context=context)
+        compiled = CompiledTerminalResponse(data=copy.deepcopy(response), context=context)
+        self.assertEqual(drf.is_valid(), compiled.is_valid())
+        return drf, compiled
+
+    def test_same_representation(self):
+        for response, command_protocols in sample_responses():
+            drf, compiled = self.validate(response, command_protocols)
+            drf_message, compiled_message = drf.representation(), compiled.representation()
+            drf_message.pop('response_process_time')
+            compiled_message.pop('response_process_time')
+            self.assertEqual(drf_message, compiled_message)
+            self.assertEqual(drf.get_message_type(), compiled.get_message_type())
+
+    def test_same_errors(self):
+        response, command_protocols = sample_responses()[0]
+        response['data']['destination_ip'] = '1.1.1'
+        response['stamp']['terminal_request_send_time'] = -1
+        drf, compiled = self.validate(response, command_protocols)
+        self.assertEqual(drf.format_errors(), compiled.format_errors())
@@ -0,0 +1,33 @@
+from django.test import SimpleTestCase
+
+from benchmark.types.events import EVENT_TYPES, PingEvent, benchmark_command_mapping
+from benchmark.backends.command_dispatcher.benchmarks.response_validation import sample_responses
+from benchmark.backends.command_dispatcher.serializers.response import TerminalResponse
+
+
+class EventTestCase(SimpleTestCase):
+
+    def test_fields_of_mapping(self):
+        common = set(benchmark_command_mapping['common']['properties'])
+        for event_type, event_class in EVENT_TYPES.items():
+            self.assertEqual(set(event_class.fields),
+                             common | set(benchmark_command_mapping[event_type]['properties']))
+
+    def test_record(self):
+        event = PingEvent(command_uuid='a', destination='www.baidu.com')
+        self.assertEqual(event.to_record(), {'_type': 'ping', 'command_uuid': 'a',
+                                             'destination': 'www.baidu.com'})
+        task_event = event.copy()
+        task_event.set_task({'task_id': 't', 'task_generate_time': 1.5})
+        self.assertEqual(task_event.to_dict(), {'command_uuid': 'a', 'task_id': 't',
+                                                'task_generate_time': 1500,
+                                                'destination': 'www.baidu.com'})
+        self.assertNotIn('task_id', event.to_dict())
+
+    def test_same_as_representation(self):
+        for response, command_protocols in sample_responses():
+            serializer = TerminalResponse(data=response, context={'command_protocols': command_protocols})
+            self.assertTrue(serializer.is_valid())
+            event = serializer.to_event()
+            self.assertEqual(event.event_type, serializer.get_message_type())
+            self.assertEqual(event.to_dict(), serializer.representation())
@@ -0,0 +1,111 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from benchmark import terminalutil
+from benchmark.backends.command_dispatcher import processor
+
+
+def terminals(*macs):
+    return [{'mac': mac, 'ip': '10.0.0.1'} for mac in macs]
+
+
+def conditions(filter_type, filter_condition, terminal_select=False):
+    return {
+        'terminal_select': terminal_select,
+        'filter_type': filter_type,
+        'filter_condition': filter_condition,
+    }
+
+
+GROUPS = {
+    ('region', 'bj'): {'a', 'b'},
+    ('organization', 5): {'a', 'b'},
+    ('organization', 1): {'a', 'b', 'c'},
+}
+
+
+@mock.patch.multiple(terminalutil, DISPATCH_FANOUT=True, DISPATCH_FANOUT_THRESHOLD=2)
+@mock.patch.object(terminalutil.terminalapi.TerminalAPI, 'get_group_terminals',
+                   side_effect=lambda group_type, value: GROUPS.get((group_type, value), set()))
+class FanoutPolicyTestCase(SimpleTestCase):
+
+    def test_region(self, get_group_terminals):
+        self.assertEqual(terminalutil.fanout_policy(True, conditions('region', ['bj']), terminals('a', 'b')),
+                         {'type': 'region', 'value': 'bj'})
+        self.assertEqual(terminalutil.fanout_policy(True, conditions('region', ['bj', 'all']),
+                                                    terminals('a', 'b')),
+                         {'type': 'region', 'value': 'bj'})
+        # a city, all provinces or a part of the group isn't a group
+        self.assertIsNone(terminalutil.fanout_policy(True, conditions('region', ['bj', 'bj']),
+                                                     terminals('a', 'b')))
+        self.assertIsNone(terminalutil.fanout_policy(True, conditions('region', ['all']), terminals('a', 'b')))
+        self.assertIsNone(terminalutil.fanout_policy(True, conditions('region', ['bj']), terminals('a', 'c')))
+
+    def test_organization(self, get_group_terminals):
+        self.assertEqual(terminalutil.fanout_policy(True, conditions('organization', [1, 5, 'x']),
+                                                    terminals('a', 'b')),
+                         {'type': 'organization', 'value': '5'})
+        # the root organization includes the descendants
+        self.assertEqual(terminalutil.fanout_policy(True, conditions('organization', []),
+                                                    terminals('a', 'b', 'c')),
+                         {'type': 'organization', 'value': '1'})
+        self.assertIsNone(terminalutil.fanout_policy(True, conditions('organization', [1, 5, 'x']),
+                                                     terminals('a', 'b', 'c')))
+
+    def test_not_group(self, get_group_terminals):
+        self.assertIsNone(terminalutil.fanout_policy(False, conditions('region', ['bj']), terminals('a', 'b')))
+        self.assertIsNone(terminalutil.fanout_policy(True, conditions('region', ['bj'], terminal_select=True),
+                                                     terminals('a', 'b')))
+        self.assertIsNone(terminalutil.fanout_policy(True, conditions('operator', ['x']), terminals('a', 'b')))
+
+    def test_threshold(self, get_group_terminals):
+        with mock.patch.object(terminalutil, 'DISPATCH_FANOUT_THRESHOLD', 3):
+            self.assertIsNone(terminalutil.fanout_policy(True, conditions('region', ['bj']),
+                                                         terminals('a', 'b')))
+        get_group_terminals.side_effect = Exception('database is unavailable')
+        self.assertIsNone(terminalutil.fanout_policy(True, conditions('region', ['bj']), terminals('a', 'b')))
+
+
+class DispatchFanoutTestCase(SimpleTestCase):
+
+    def dispatch(self, operations, group_result):
+        dispatch_processor = processor.DispatchProcessor.__new__(processor.DispatchProcessor)
+        dispatch_processor.command_timestamp = 1000.0
+        dispatch_processor.fail_records = []
+        dispatch_processor.serializer = mock.Mock()
+        dispatch_processor.serializer.get_terminals.return_value = terminals(*operations)
+        dispatch_processor.serializer.get_terminal_command.return_value = {'uuid': 'c', 'protocol': 'ping'}
+        dispatch_processor.serializer.get_task_tag.return_value = {'task_id': 't', 'task_generate_time': 1.0}
+        dispatch_processor.serializer.get_fanout.return_value = {'type': 'region', 'value': 'bj'}
+
+        client = mock.MagicMock()
+        client.__enter__.return_value = client
+        if isinstance(group_result, Exception):
+            client.command_dispach_group.side_effect = group_result
+        else:
+            client.command_dispach_group.return_value = group_result
+        client.command_dispach_batch.return_value = {}
+
+        with mock.patch.object(processor, 'CommandAPI') as command_api, \
+                mock.patch.object(processor, 'MQTTDispachClient', return_value=client):
+            command_api.registry_command_batch.return_value = dict(
+                (mac, {'operation': operation}) for mac, operation in operations.items())
+            dispatch_processor.process()
+        return client
+
+    def test_group_published(self):
+        client = self.dispatch({'a': 'create', 'b': 'create'}, True)
+        client.command_dispach_group.assert_called_once_with('region', 'bj', {'uuid': 'c', 'protocol': 'ping'})
+        client.command_dispach_batch.assert_not_called()
+
+    def test_fall_back_to_terminals(self):
+        for group_result in (False, Exception('not connected')):
+            client = self.dispatch({'a': 'create', 'b': 'create'}, group_result)
+            self.assertEqual(sorted(client.command_dispach_batch.call_args[0][0]), ['a', 'b'])
+
+    def test_part_of_group(self):
+        # a terminal has the command already, the group topic would run it twice
+        client = self.dispatch({'a': 'create', 'b': 'update'}, True)
+        client.command_dispach_group.assert_not_called()
+        self.assertEqual(client.command_dispach_batch.call_args[0][0], ['a'])
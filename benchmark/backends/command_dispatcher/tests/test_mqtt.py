@@ -0,0 +1,116 @@
+import time
+from unittest import mock
+
+import paho.mqtt.client as paho
+from django.test import SimpleTestCase
+
+from natrix.common import exception as natrix_exception
+from benchmark.backends.command_dispatcher.channels import mqtt
+
+
+class MessageInfo(object):
+
+    def __init__(self, mid, rc=paho.MQTT_ERR_SUCCESS):
+        self.mid = mid
+        self.rc = rc
+
+
+class MQTTPublisherTestCase(SimpleTestCase):
+
+    def publisher(self, inflight=2, qos=1, queued=0):
+        self.mids = iter(range(1, 1000))
+        self.client = mock.Mock()
+        self.client.publish.side_effect = lambda **kwargs: MessageInfo(next(self.mids))
+        with mock.patch.object(mqtt, 'natrix_mqttclient', return_value=self.client):
+            return mqtt.MQTTPublisher(inflight=inflight, qos=qos, queued=queued)
+
+    def free_slots(self, publisher):
+        return publisher._slots._value
+
+    def test_queue_limit(self):
+        self.publisher(inflight=10, queued=100)
+        self.client.max_queued_messages_set.assert_called_once_with(100)
+        # paho keeps at least the in-flight messages
+        self.publisher(inflight=10, queued=0)
+        self.client.max_queued_messages_set.assert_called_once_with(10)
+
+    def test_acknowledged(self):
+        publisher = self.publisher()
+        first = publisher.publish('t', 'p')
+        publisher.publish('t', 'p')
+        self.assertEqual(self.free_slots(publisher), 0)
+        publisher._on_publish(self.client, None, first.mid)
+        self.assertEqual(self.free_slots(publisher), 1)
+        # an acknowledgement of an unknown message doesn't release a slot
+        publisher._on_publish(self.client, None, 100)
+        self.assertEqual(self.free_slots(publisher), 1)
+
+    def test_acknowledged_before_returned(self):
+        publisher = self.publisher()
+
+        def publish(**kwargs):
+            info = MessageInfo(next(self.mids))
+            publisher._on_publish(self.client, None, info.mid)
+            return info
+
+        self.client.publish.side_effect = publish
+        publisher.publish('t', 'p')
+        self.assertEqual(self.free_slots(publisher), 2)
+        self.assertEqual((publisher._pending, publisher._acked), ({}, {}))
+
+    def test_not_queued(self):
+        publisher = self.publisher()
+        self.client.publish.side_effect = lambda **kwargs: MessageInfo(1, rc=paho.MQTT_ERR_QUEUE_SIZE)
+        self.assertFalse(publisher.is_queued(publisher.publish('t', 'p')))
+        self.assertEqual(self.free_slots(publisher), 2)
+
+        publisher = self.publisher(qos=0)
+        publisher.publish('t', 'p')
+        self.assertEqual(self.free_slots(publisher), 2)
+
+    def test_disconnected(self):
+        publisher = self.publisher()
+        first = publisher.publish('t', 'p')
+        publisher.publish('t', 'p')
+        publisher._on_disconnect(self.client, None, 1)
+        self.assertEqual(self.free_slots(publisher), 2)
+
+        # the message is resent and acknowledged after reconnecting
+        publisher._on_publish(self.client, None, first.mid)
+        publisher.publish('t', 'p')
+        self.assertEqual(self.free_slots(publisher), 1)
+
+    def test_unacknowledged(self):
+        publisher = self.publisher()
+        publisher.publish('t', 'p')
+        publisher.publish('t', 'p')
+        with mock.patch.object(mqtt, 'DISPATCH_TIMEOUT', 0.01):
+            with self.assertRaises(natrix_exception.ClassInsideException):
+                publisher.publish('t', 'p')
+
+            with mock.patch.object(mqtt.time, 'time', return_value=time.time() + mqtt.DISPATCH_ACK_TIMEOUT + 1):
+                publisher.publish('t', 'p')
+        # the slots of the lost acknowledgements are released
+        self.assertEqual(len(publisher._pending), 1)
+        self.assertEqual(self.free_slots(publisher), 1)
+
+
+class ResponseSubscribeTestCase(SimpleTestCase):
+
+    def subscribe(self, consumers):
+        client = mock.Mock()
+        with mock.patch.object(mqtt, 'natrix_mqttclient', return_value=client), \
+                mock.patch.multiple(mqtt, RESPONSE_CONSUMERS=consumers, RESPONSE_SHARE_GROUP='natrix'):
+            mqtt.MQTTDispachClient().response_subscribe(topic='natrix/response', celery_task=mock.Mock())
+        client.loop_forever.assert_called_once_with()
+        client.on_connect(client, None, {}, 0)
+        client.message_callback_add.assert_called_once_with('natrix/response', mock.ANY)
+        return client
+
+    def test_shared_subscription(self):
+        client = self.subscribe(3)
+        client.subscribe.assert_called_once_with('$share/natrix/natrix/response', qos=1)
+
+    def test_single_consumer(self):
+        client = self.subscribe(1)
+        client.subscribe.assert_called_once_with('natrix/response', qos=1)
@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from benchmark.backends.stores import partition
+
+DAY = 86400000
+
+
+class PartitionTestCase(SimpleTestCase):
+
+    def test_not_partitioned(self):
+        with mock.patch.multiple(partition, PARTITION='none', PARTITION_ENABLED=False):
+            self.assertEqual(partition.get_search_index(0, DAY), partition.BENCHMARK_INDEX)
+            self.assertEqual(partition.get_record_index({'task_generate_time': 0}),
+                             partition.BENCHMARK_INDEX)
+            self.assertIsNone(partition.get_routing('t'))
+            self.assertEqual(partition.keyword_field('task_id'), 'task_id.keyword')
+
+    def test_search_index(self):
+        with mock.patch.multiple(partition, PARTITION='day', PARTITION_ENABLED=True, PARTITION_ALIAS='b'):
+            # 2019-06-01 00:00 UTC
+            start = 1559347200000
+            self.assertEqual(partition.get_record_index({'task_generate_time': start + 1000}), 'b-2019.06.01')
+            self.assertEqual(partition.get_search_index(start + 1000, start + DAY + 1000),
+                             'b-2019.06.01,b-2019.06.02')
+            self.assertEqual(partition.get_search_index(start, None), 'b')
+            self.assertEqual(partition.get_search_index(start, start + 400 * DAY), 'b')
+            self.assertEqual(partition.get_routing('t'), 't')
+
+        with mock.patch.multiple(partition, PARTITION='week', PARTITION_ENABLED=True, PARTITION_ALIAS='b'):
+            self.assertEqual(partition.get_search_index(start, start + 10 * DAY), 'b-2019.w22,b-2019.w23,b-2019.w24')
+
+    def test_template(self):
+        with mock.patch.multiple(partition, PARTITION='day', PARTITION_ENABLED=True, PARTITION_ALIAS='b'):
+            template = partition.get_partition_template()
+        self.assertEqual(template['template'], 'b-*')
+        self.assertEqual(template['aliases'], {'b': {}})
+        ping = template['mappings']['ping']
+        self.assertEqual(ping['dynamic'], 'strict')
+        self.assertEqual(ping['properties']['task_id'], {'type': 'keyword', 'doc_values': True})
+        self.assertNotIn('common', template['mappings'])
+
+    def test_object_fields(self):
+        dns = partition.get_partition_mappings()['dns']['properties']
+        # the resolved IPs are aggregated at the root (cardinality by province)
+        self.assertEqual(dns['ips'], {'type': 'object', 'dynamic': True,
+                                      'properties': {'ip': {'type': 'keyword', 'doc_values': True}}})
+        self.assertEqual(partition.get_partition_mappings()['traceroute']['properties']['paths'],
+                         {'type': 'nested', 'dynamic': True})
@@ -0,0 +1,59 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from benchmark.backends.command_dispatcher import processor, terminalapi
+
+
+class FakeEvent(object):
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+        self.command_uuid = 'c-{}'.format(terminal)
+        self.command_generate_time = 1000
+        self.province = None
+        self.organization_id = None
+
+    def to_dict(self):
+        return {'terminal': self.terminal}
+
+    def set_task(self, task_info):
+        self.task_info = task_info
+
+
+class FakeSerializer(object):
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+
+    def to_event(self):
+        return FakeEvent(self.terminal)
+
+
+def get_terminal_info(mac):
+    if mac == 'broken':
+        raise Exception('database is unavailable')
+    return {
+        'organizations': [{'id': 2, 'name': 'a | b'}],
+        'ancestry': [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'a | b'}],
+        'region': {'province': 'bj', 'city': 'bj'},
+    }
+
+
+class ResponseBatchProcessorTestCase(SimpleTestCase):
+
+    def test_terminal_lookup_failed(self):
+        with mock.patch.object(terminalapi.terminal_api, 'get_terminal_info', side_effect=get_terminal_info), \
+                mock.patch.object(processor, 'CommandAPI') as command_api, \
+                mock.patch.object(processor, 'store_events') as store_events:
+            batch = processor.ResponseBatchProcessor([])
+            batch.serializers = [FakeSerializer('ok'), FakeSerializer('broken'), FakeSerializer('ok')]
+            command_api.erase_command_batch.side_effect = lambda items: [[{'task_id': 't'}] for _ in items]
+            batch.process()
+
+        self.assertEqual(len(command_api.update_response_batch.call_args[0][0]), 3)
+        events = store_events.call_args[0][0]
+        self.assertEqual([event.terminal for event in events], ['ok', 'broken', 'ok'])
+        self.assertEqual((events[0].province, events[0].organization_id), ('bj', [1, 2]))
+        # the responses of the broken terminal are stored without the register info
+        self.assertEqual((events[1].province, events[1].organization_id), ('', []))
@@ -0,0 +1,36 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from benchmark.backends.command_dispatcher import query
+
+
+HITS = [
+    {'_type': 'error', '_source': {'errorcode': 1408}},
+    {'_type': 'ping', '_source': {'province': 'p1', 'avg_time': 1.0}},
+    {'_type': 'ping', '_source': {'province': 'p2', 'avg_time': 2.0}},
+]
+
+
+def fake_scan(body=None, source=None, routing=None):
+    condition = body['query']['bool']
+    for hit in HITS:
+        if 'filter' in condition and hit['_type'] != 'error':
+            continue
+        if 'must_not' in condition and hit['_type'] == 'error':
+            continue
+        yield hit
+
+
+@mock.patch.object(query, 'scan_messages', fake_scan)
+class TaskDataQueryTestCase(SimpleTestCase):
+
+    def test_stream_is_same_as_task_data(self):
+        data = query.get_task_data('t1')
+        stream = query.stream_task_data('t1')
+
+        self.assertEqual(list(stream.get('success', [])), data['success'])
+        self.assertEqual(list(stream.get('error', [])), data['error'])
+        # each iteration is a new scan
+        self.assertEqual(len(list(stream.get('success'))), 2)
+        self.assertEqual(stream.get('unknown', []), [])
@@ -0,0 +1,154 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from benchmark.backends.command_dispatcher import rollup
+
+
+def ping_record(task_generate_time, avg_time, province='bj', packet_loss=1):
+    return {
+        '_type': 'ping',
+        'task_id': 't',
+        'task_generate_time': task_generate_time,
+        'province': province,
+        'city': 'c',
+        'packet_send': 10,
+        'packet_loss': packet_loss,
+        'avg_time': avg_time,
+    }
+
+
+class SummarizeTestCase(SimpleTestCase):
+
+    def test_summarize(self):
+        documents = rollup.summarize([
+            ping_record(60000, 10.0),
+            ping_record(61000, 30.0),
+            ping_record(120000, None, packet_loss=10),
+            {'_type': 'error', 'task_id': 't', 'task_generate_time': 60000, 'province': 'bj',
+             'city': 'c', 'errorcode': 1408},
+            {'_type': 'responseDiscard', 'task_generate_time': 60000},
+        ])
+        minute = documents[('t', 'minute', 60000, 'ping', 'bj', 'c', None)]
+        self.assertEqual(minute['count'], 2)
+        self.assertEqual((minute['avg_time_sum'], minute['avg_time_count']), (40.0, 2))
+        self.assertEqual((minute['avg_time_min'], minute['avg_time_max']), (10.0, 30.0))
+
+        hour = documents[('t', 'hour', 0, 'ping', 'bj', 'c', None)]
+        self.assertEqual(hour['count'], 3)
+        self.assertEqual(hour['avg_time_count'], 2)
+        self.assertEqual(hour['packet_loss_sum'], 12)
+
+        error = documents[('t', 'day', 0, 'error', 'bj', 'c', 1408)]
+        self.assertEqual(error['count'], 1)
+        # ping: 2 minutes, 1 hour and 1 day; error: 1 of each granularity
+        self.assertEqual(len(documents), 4 + 3)
+
+        script = rollup.get_rollup_script(minute)
+        self.assertEqual(script['params']['sums']['count'], 2)
+        self.assertEqual(script['params']['maxs'], {'packet_send_max': 10, 'packet_loss_max': 1,
+                                                    'avg_time_max': 30.0})
+
+    def test_rollup_interval(self):
+        self.assertEqual(rollup.get_rollup_interval(30000), (30000, None))
+        self.assertEqual(rollup.get_rollup_interval(90000), (90000, None))
+        self.assertEqual(rollup.get_rollup_interval(90000, align=True), (120000, 'minute'))
+        self.assertEqual(rollup.get_rollup_interval(7200000), (7200000, 'hour'))
+        self.assertEqual(rollup.get_rollup_interval(12960000, align=True), (14400000, 'hour'))
+        self.assertEqual(rollup.get_rollup_interval(86400000 * 2), (86400000 * 2, 'day'))
+
+    def test_rollup_bucket(self):
+        aggs = {
+            'sum_loss': {'sum': {'field': 'packet_loss'}},
+            'avg_avgtime': {'avg': {'field': 'avg_time'}},
+            'bucket_aggs': {'terms': {'field': 'errorcode', 'size': 1000}},
+        }
+        rollup_aggs = rollup.get_rollup_aggs(aggs)
+        self.assertEqual(rollup_aggs['avg_avgtime_count'], {'sum': {'field': 'avg_time_count'}})
+
+        bucket = rollup.from_rollup_bucket({
+            'key': 60000,
+            'sum_loss': {'value': 12.0},
+            'avg_avgtime_sum': {'value': 40.0},
+            'avg_avgtime_count': {'value': 0.0},
+            'bucket_aggs': {'buckets': [{'key': 1408, 'doc_count': 1, 'record_count': {'value': 5.0}}]},
+        }, aggs)
+        self.assertEqual(bucket['sum_loss'], {'value': 12.0})
+        self.assertEqual(bucket['avg_avgtime'], {'value': None})
+        self.assertEqual(bucket['bucket_aggs'], {'buckets': [{'key': 1408, 'doc_count': 5}]})
+
+
+class RollupSketchTestCase(SimpleTestCase):
+
+    def test_sketches(self):
+        records = [{
+            '_type': 'dns',
+            'task_id': 't',
+            'task_generate_time': 60000 + i,
+            'province': 'bj',
+            'ptime': float(i + 1),
+            'ips': [{'ip': '10.0.0.{}'.format(i % 20)}],
+        } for i in range(1000)]
+        documents = rollup.summarize(records[0: 500])
+        for key, document in rollup.summarize(records[500:]).items():
+            documents[key]['ptime_sketch'].merge(document['ptime_sketch'])
+            documents[key]['resolved_ip_hll'].merge(document['resolved_ip_hll'])
+
+        document = rollup.get_rollup_document(documents[('t', 'minute', 60000, 'dns', 'bj', None, None)])
+        sketch = rollup.DDSketch.from_dict(document['ptime_sketch'])
+        self.assertEqual(sketch.count, 1000)
+        for q in (0.5, 0.95, 0.99):
+            exact = q * 999 + 1
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), exact * 0.01)
+
+        hll = rollup.HyperLogLog.from_dict(document['resolved_ip_hll'])
+        self.assertAlmostEqual(hll.count(), 20, delta=2)
+
+        script = rollup.get_rollup_script(document)
+        self.assertEqual(script['params']['sketches']['ptime_sketch'], document['ptime_sketch'])
+        self.assertNotIn('ptime_sketch', script['params']['sums'])
+
+
+class RollupBufferTestCase(SimpleTestCase):
+
+    def setUp(self):
+        # flushed by the tests only
+        self.buffer = rollup.RollupBuffer('rollup', size=1000, interval=3600000)
+
+    def test_merge_before_flush(self):
+        self.buffer.add(rollup.summarize([ping_record(60000, 10.0)]))
+        self.buffer.add(rollup.summarize([ping_record(61000, 30.0)]))
+        self.assertEqual(self.buffer.metrics()['buffered_rollups'], 3)
+
+        with mock.patch.object(rollup, 'get_es_connection'), \
+                mock.patch.object(rollup.helpers, 'bulk', return_value=(3, [])) as bulk:
+            self.assertTrue(self.buffer.flush())
+        actions = bulk.call_args[0][1]
+        self.assertEqual(len(actions), 3)
+        minute = [action for action in actions if action['upsert']['granularity'] == 'minute'][0]
+        self.assertEqual(minute['script']['params']['sums']['count'], 2)
+        self.assertEqual(minute['script']['params']['mins']['avg_time_min'], 10.0)
+        self.assertEqual(self.buffer.metrics()['upserted_rollups'], 3)
+
+    def test_failed_upserts(self):
+        documents = rollup.summarize([ping_record(60000, 10.0)])
+        self.buffer.add(documents)
+        ids = dict((rollup.get_rollup_id(key), key[1]) for key in documents)
+        errors = [{'update': {'_id': rollup_id, 'status': 409 if granularity == 'day' else 400}}
+                  for rollup_id, granularity in ids.items() if granularity != 'minute']
+
+        with mock.patch.object(rollup, 'get_es_connection'), \
+                mock.patch.object(rollup.helpers, 'bulk', return_value=(1, errors)):
+            self.assertFalse(self.buffer.flush())
+        metrics = self.buffer.metrics()
+        self.assertEqual(metrics['failed_rollups'], 1)
+        self.assertEqual(metrics['failed_records'], 1)
+        # the conflicted day rollup is retried
+        self.assertEqual(metrics['buffered_rollups'], 1)
+        self.assertEqual(metrics['retried_rollups'], 1)
+
+        with mock.patch.object(rollup, 'get_es_connection'), \
+                mock.patch.object(rollup.helpers, 'bulk', side_effect=Exception('timeout')):
+            self.assertFalse(self.buffer.flush())
+        self.assertEqual(self.buffer.metrics()['failed_rollups'], 2)
+        self.assertEqual(self.buffer.metrics()['buffered_rollups'], 0)
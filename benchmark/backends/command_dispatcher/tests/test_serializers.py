@@ -1,9 +1,12 @@
 
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase
 
 from benchmark.backends.command_dispatcher.serializers.response import (
     PingSerializer
 )
+from benchmark.backends.command_dispatcher.serializers.task import (
+    TaskCommandInfo, InternalTaskCommand
+)
 
 class ResponseTestCase(TestCase):
 
@@ -24,4 +27,31 @@ class ResponseTestCase(TestCase):
         if serializer.is_valid():
             print('validate succesffully, ', serializer.validated_data)
         else:
-            print(serializer.errors)
\ No newline at end of file
+            print(serializer.errors)
+
+
+class InternalTaskCommandTestCase(SimpleTestCase):
+
+    def test_same_as_task_command_info(self):
+        data = {
+            'command': {
+                'command_uuid': '78b05299-8f64-4d0b-af42-b3df4ab9046b',
+                'command_protocol': 'ping',
+                'command_destination': 'www.baidu.com',
+                'command_parameters': {'count': 5}
+            },
+            'task_tag': {
+                'task_id': '78b05299-8f64-4d0b-af42-b3df4ab90461',
+                'task_generate_time': 111111.1
+            },
+            'terminals': [{'mac': '28d2442aac27', 'ip': '1.1.1.1'}],
+            'fanout': {'type': 'region', 'value': '北京'}
+        }
+        serializer = TaskCommandInfo(data=data)
+        self.assertTrue(serializer.is_valid())
+        command = InternalTaskCommand.from_represent(data)
+
+        self.assertEqual(command.get_terminal_command(1000), serializer.get_terminal_command(1000))
+        self.assertEqual(command.get_task_tag(), serializer.get_task_tag())
+        self.assertEqual(command.get_fanout(), serializer.get_fanout())
+        self.assertEqual(command.get_terminals(), serializer.get_terminals())
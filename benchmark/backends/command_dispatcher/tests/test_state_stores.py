@@ -0,0 +1,164 @@
+import time
+from unittest import mock
+
+import fakeredis
+from django.test import SimpleTestCase
+
+from benchmark.backends.command_dispatcher import states
+from benchmark.backends.command_dispatcher.state_stores import MemoryStateStore, RedisStateStore
+from benchmark.backends.command_dispatcher.state_stores import redis_store
+
+
+class StateStoreTests(object):
+    """The state transitions, the same for each state store."""
+
+    def setUp(self):
+        self.store = self.create_store()
+        self.command_info = {'protocol': 'ping', 'destination': 'www.baidu.com'}
+
+    def register(self, terminal, timestamp, task_id):
+        return self.store.register('c1', terminal, timestamp, self.command_info,
+                                   {'task_id': task_id}, 10000, timestamp + 300000)
+
+    def test_register_and_erase(self):
+        self.assertEqual(self.register('t1', 1000, 'a'), 'create')
+        self.assertEqual(self.register('t1', 5000, 'b'), 'update')
+        self.assertEqual(self.register('t1', 20000, 'c'), 'create')
+        self.assertEqual(self.store.get_command_protocol('c1'), 'ping')
+
+        self.assertEqual(self.store.erase('c1', 't1', 1000), [{'task_id': 'a'}, {'task_id': 'b'}])
+        self.assertIsNone(self.store.erase('c1', 't1', 1000))
+
+        scanned, expired = self.store.expire(cutoff=10 ** 9, limit=100)
+        self.assertEqual(scanned, 1)
+        self.assertEqual([(c['terminal'], c['timestamp']) for c in expired], [('t1', 20000)])
+
+    def test_expire_in_batches(self):
+        operations = self.store.register_batch('c1', ['t1', 't2', 't3'], 1000, self.command_info,
+                                               {'task_id': 'a'}, 10000, 301000)
+        self.assertEqual(set(operations.values()), {'create'})
+        self.register('t1', 100000, 'b')
+
+        self.assertEqual(self.store.expire(cutoff=300000, limit=100), (0, []))
+        scanned, expired = self.store.expire(cutoff=301000, limit=2)
+        self.assertEqual((scanned, len(expired)), (2, 2))
+        scanned, expired = self.store.expire(cutoff=301000, limit=2)
+        self.assertEqual((scanned, len(expired)), (1, 1))
+        self.assertIsNotNone(self.store.erase('c1', 't1', 100000))
+
+    def test_update_response(self):
+        self.assertTrue(self.store.update_response('c1', 't1', 2000, {'value': 2}))
+        self.assertFalse(self.store.update_response('c1', 't1', 1000, {'value': 1}))
+        self.assertEqual(self.store.get_response('c1', 't1'), {'timestamp': 2000, 'data': {'value': 2}})
+        self.assertEqual(self.store.get_responses('c1', ['t1', 't2']),
+                         {'t1': {'timestamp': 2000, 'data': {'value': 2}}})
+
+    def test_batch_operations(self):
+        self.register('t1', 1000, 'a')
+        self.register('t2', 1000, 'a')
+        self.assertEqual(self.store.get_command_protocols(['c1', 'c2']), {'c1': 'ping'})
+        self.assertEqual(self.store.erase_batch([('c1', 't1', 1000), ('c1', 't3', 1000)]),
+                         [[{'task_id': 'a'}], None])
+        self.assertEqual(self.store.update_response_batch([('c1', 't1', 2000, {}), ('c1', 't2', 2000, {})]),
+                         [True, True])
+
+    def test_transitions(self):
+        # register -> consume -> respond
+        self.assertEqual(self.register('t1', 1000, 'a'), 'create')
+        self.assertEqual(self.store.erase('c1', 't1', 1000), [{'task_id': 'a'}])
+        self.assertTrue(self.store.update_response('c1', 't1', 1500, {'value': 1}))
+        # a duplicate response: the instance is consumed, an older response is ignored
+        self.assertIsNone(self.store.erase('c1', 't1', 1000))
+        self.assertFalse(self.store.update_response('c1', 't1', 1200, {'value': 0}))
+        self.assertEqual(self.store.get_response('c1', 't1'), {'timestamp': 1500, 'data': {'value': 1}})
+        self.assertEqual(self.store.expire(cutoff=10 ** 9, limit=100), (0, []))
+
+        # register -> expire -> a late response
+        self.assertEqual(self.register('t1', 20000, 'b'), 'create')
+        scanned, expired = self.store.expire(cutoff=10 ** 9, limit=100)
+        self.assertEqual((scanned, expired), (1, [{'command_uuid': 'c1', 'terminal': 't1', 'timestamp': 20000,
+                                                   'task_tags': [{'task_id': 'b'}]}]))
+        self.assertIsNone(self.store.erase('c1', 't1', 20000))
+        self.assertTrue(self.store.update_response('c1', 't1', 20500, {'value': 2}))
+        # a new instance is created after the expired one
+        self.assertEqual(self.register('t1', 21000, 'c'), 'create')
+
+
+class MemoryStateStoreTestCase(StateStoreTests, SimpleTestCase):
+
+    def create_store(self):
+        return MemoryStateStore()
+
+
+class RedisStateStoreTestCase(StateStoreTests, SimpleTestCase):
+
+    def create_store(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.declared = set()
+        register_script = self.redis.register_script
+
+        def recorded(source):
+            script = register_script(source)
+
+            def call(keys=(), args=(), client=None):
+                self.declared.update(keys)
+                return script(keys=keys, args=args, client=client)
+            return call
+
+        store = RedisStateStore()
+        store._conn = mock.Mock(wraps=self.redis)
+        store._conn.register_script.side_effect = recorded
+        return store
+
+    def tearDown(self):
+        # the scripts only touch the keys passed in KEYS
+        self.assertLessEqual({key.decode() for key in self.redis.keys('*')}, self.declared)
+
+    def test_ttl(self):
+        now = int(time.time() * 1000)
+        self.register('t1', now, 'a')
+        for key in ('benchmark_command_c1', 'benchmark_command_c1_latest', 'benchmark_state_c1'):
+            ttl = self.redis.pttl(key)
+            self.assertGreater(ttl, 300000 + redis_store.STATE_TTL_MARGIN - 5000, key)
+            self.assertLessEqual(ttl, 300000 + redis_store.STATE_TTL_MARGIN, key)
+
+        # an older instance doesn't shorten the ttl
+        self.register('t2', now - 200000, 'a')
+        self.assertGreater(self.redis.pttl('benchmark_state_c1'), 300000 + redis_store.STATE_TTL_MARGIN - 5000)
+
+    def test_expire_concurrently(self):
+        self.register('t1', 1000, 'a')
+        self.register('t2', 1000, 'a')
+        members = self.redis.zrangebyscore(redis_store.DEADLINE_KEY, '-inf', 10 ** 9)
+        # t1 is erased (by a response) after the index entries are read
+        self.store.erase('c1', 't1', 1000)
+        with mock.patch.object(self.store._conn, 'zrangebyscore', return_value=members):
+            scanned, expired = self.store.expire(cutoff=10 ** 9, limit=100)
+        self.assertEqual(scanned, 1)
+        self.assertEqual([command['terminal'] for command in expired], ['t2'])
+
+
+class CleanExpiredCommandsTestCase(SimpleTestCase):
+
+    def test_clean(self):
+        store = MemoryStateStore()
+        for index in range(5):
+            store.register('c1', 't{}'.format(index), 1000, {'protocol': 'ping'}, {'task_id': 'a'},
+                           10000, 1000 + states.COMMAND_TIMEOUT)
+        store.register('c1', 'fresh', int(time.time() * 1000), {'protocol': 'ping'}, {'task_id': 'a'},
+                       10000, int(time.time() * 1000) + states.COMMAND_TIMEOUT)
+
+        stats = {}
+        with mock.patch.object(states, 'state_store', store), \
+                mock.patch.object(states, 'EXPIRE_BATCH_SIZE', 2):
+            expired = states.CommandAPI.clean_expired_commands(freshness=states.COMMAND_TIMEOUT, stats=stats)
+
+        self.assertEqual(sorted(command['terminal'] for command in expired), ['t0', 't1', 't2', 't3', 't4'])
+        # the timestamps are seconds, as the command timestamps of the dispatcher
+        self.assertEqual(expired[0]['timestamp'], 1.0)
+        self.assertEqual(stats, {'scanned': 5, 'expired': 5})
+
+    def test_store_failed(self):
+        with mock.patch.object(states, 'state_store') as store:
+            store.expire.side_effect = ConnectionError('redis is unavailable')
+            self.assertEqual(states.CommandAPI.clean_expired_commands(), [])
@@ -1,7 +1,9 @@
 
 from django.conf import settings
 
-from .eventhub import EventhubClient
+from .eventhub import EventhubClient, BufferedEventhubWriter
+from .spool import SpoolWriter
+from .elasticsearch import ElasticsearchStoreClient
 
 
 store_type = settings.BENCHMARK_STORE_TYPE
@@ -10,8 +12,30 @@ store_type = settings.BENCHMARK_STORE_TYPE
 # todo: move to initialize command
 if store_type == 'eventhub':
     store_url = settings.BENCHMARK_STORE_URL
-    eventhub_client = EventhubClient(service_url=store_url)
+    eventhub_client = EventhubClient(service_url=store_url,
+                                     retries=settings.BENCHMARK_STORE_RETRIES)
+
+    # store_writer is the entrance of storing events
+    if settings.BENCHMARK_STORE_SPOOL_DIR:
+        store_writer = SpoolWriter(eventhub_client,
+                                   directory=settings.BENCHMARK_STORE_SPOOL_DIR,
+                                   segment_size=settings.BENCHMARK_STORE_SPOOL_SEGMENT_SIZE,
+                                   fsync=settings.BENCHMARK_STORE_SPOOL_FSYNC,
+                                   batch_count=settings.BENCHMARK_STORE_BATCH_COUNT,
+                                   interval=settings.BENCHMARK_STORE_BATCH_AGE)
+    else:
+        store_writer = BufferedEventhubWriter(eventhub_client,
+                                              max_count=settings.BENCHMARK_STORE_BATCH_COUNT,
+                                              max_bytes=settings.BENCHMARK_STORE_BATCH_BYTES,
+                                              max_age=settings.BENCHMARK_STORE_BATCH_AGE,
+                                              max_queue=settings.BENCHMARK_STORE_QUEUE_SIZE,
+                                              max_queue_bytes=settings.BENCHMARK_STORE_QUEUE_BYTES,
+                                              max_retry_age=settings.BENCHMARK_STORE_RETRY_AGE)
     # eventhub_client.init_store_service()
 
+elif store_type == 'elasticsearch':
+    # the records are indexed by this process, and partitioned (see partition.py)
+    store_writer = ElasticsearchStoreClient()
+
 else:
     ...
@@ -5,5 +5,5 @@ class BaseStoreClient:
     def put(self, event_data):
         raise NotImplemented()
 
-    def puts(self, events):
+    def puts(self, events, keep_time=False):
         raise NotImplemented()
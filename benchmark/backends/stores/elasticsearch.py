@@ -0,0 +1,34 @@
+"""Store benchmark events to Elasticsearch directly.
+
+The records are indexed with the bulk API (utils.elasticsearch.BulkBuffer), to the partition
+index of the record and routed by task_id if the records are partitioned (see partition.py).
+
+"""
+from utils.elasticsearch import get_bulk_buffer
+
+from .base import BaseStoreClient
+from . import partition
+
+
+class ElasticsearchStoreClient(BaseStoreClient):
+
+    def _action(self, event):
+        record = dict(event)
+        action = {
+            '_index': partition.get_record_index(record),
+            '_type': record.pop('_type'),
+            '_source': record
+        }
+        routing = partition.get_routing(record.get('task_id'))
+        if routing is not None:
+            action['_routing'] = routing
+        return action
+
+    def put(self, event_data):
+        # the buffer (and its thread) is of the current process
+        get_bulk_buffer(partition.BENCHMARK_INDEX).push_action(self._action(event_data))
+
+    def puts(self, events, keep_time=False):
+        buffer = get_bulk_buffer(partition.BENCHMARK_INDEX)
+        for event in events:
+            buffer.push_action(self._action(event))
@@ -1,8 +1,13 @@
 
+from collections import deque
 from copy import deepcopy
+import atexit
+import os
+import threading
 import time
 import json
 import requests
+from requests.adapters import HTTPAdapter
 from typing import List, Dict
 
 from .base import BaseStoreClient
@@ -13,20 +18,71 @@ from benchmark.types.events import benchmark_command_mapping
 
 logger = NatrixLogging(name=__name__)
 
+# the response status which is retried, besides 5xx
+TRANSIENT_STATUS = (408, 429)
+
 
 class EventhubClient(BaseStoreClient):
 
     service_url = None
 
-    def __init__(self, service_url=None):
+    def __init__(self, service_url=None, retries=3, backoff=0.5, pool_size=10, timeout=10):
         if service_url:
             EventhubClient.service_url = service_url
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def session(self):
+        """A pooled session (keep-alive connections) for each process.
+
+        """
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+            self._session_pid = os.getpid()
+        return self._session
+
+    def _post(self, request_url, data):
+        """Post data to eventhub, retry with exponential backoff on transient errors.
+
+        A network error, a timeout, a 5xx, 408 or 429 response is transient and retried, the
+        other responses without a json body are permanent (the request is rejected).
+
+        :return: the eventhub result
+        """
+        retry = 0
+        while True:
+            try:
+                res = self.session.post(request_url, json=data, timeout=self.timeout)
+                if res.status_code >= 500 or res.status_code in TRANSIENT_STATUS:
+                    raise natrix_exception.NetworkException(
+                        message=f'eventhub response status {res.status_code}')
+                try:
+                    return json.loads(res.text)
+                except ValueError:
+                    raise natrix_exception.ParameterInvalidException(
+                        parameter=f'eventhub response({res.status_code}): {res.text[:200]}')
+            except (requests.ConnectionError, requests.Timeout, natrix_exception.NetworkException) as e:
+                if retry >= self.retries:
+                    if isinstance(e, natrix_exception.NetworkException):
+                        raise
+                    raise natrix_exception.NetworkException(message=f'{e}')
+                logger.error(f'Post eventhub({request_url}) with error: {e}, retry {retry + 1}')
+                time.sleep(self.backoff * (2 ** retry))
+                retry += 1
 
     def create_event(self, event_data):
         request_url = self.service_url + '/v1/event/manage/create'
         try:
-            res = requests.post(request_url, json=event_data)
-            result = json.loads(res.text)
+            result = self._post(request_url, event_data)
             if result.get('ret') > 0:
                 raise Exception(result.get('msg'))
         except Exception as e:
@@ -34,32 +90,42 @@ class EventhubClient(BaseStoreClient):
 
     def put(self, event: Dict):
         request_url = self.service_url + '/v1/event/receive/single'
-        try:
-            event['time'] = int(time.time() * 1000)
-            res = requests.post(request_url, json=event)
-            result = json.loads(res.text)
-            logger.debug(f'evenhub response {result}')
-            if result.get('ret') > 0:
-                logger.error(f'Store event to eventhub with error: {result}')
-                raise natrix_exception.NetworkException(result.get('msg'))
-        except Exception as e:
-            raise natrix_exception.NetworkException(message=f'{e}')
+        record = dict(event)
+        record['time'] = int(time.time() * 1000)
+        self._receive(request_url, record)
 
-    def puts(self, events: List):
+    def puts(self, events: List, keep_time=False):
+        """Store a list of events in one request.
+
+        :param keep_time: keep the time of events if it exists
+        :raise NetworkException: a transient error, the events may be stored again
+        :raise ParameterInvalidException: eventhub rejects the events
+        """
         request_url = self.service_url + '/v1/event/receive/batch'
+        curr_timestamp = int(time.time() * 1000)
+        records = []
+        for event in events:
+            record = dict(event)
+            if not (keep_time and 'time' in record):
+                record['time'] = curr_timestamp
+            records.append(record)
+        self._receive(request_url, records)
+
+    def _receive(self, request_url, data):
         try:
-            curr_timestamp =  int(time.time() * 1000)
-            for event in events:
-                event['time'] = curr_timestamp
-            res = requests.post(request_url, json=events)
-            result = json.loads(res.text)
-            logger.debug(f'evenhub response {result}')
-            if result.get('ret') > 0:
-                logger.error(f'Store event to eventhub with error: {result}')
-                raise natrix_exception.NetworkException(result.get('msg'))
+            result = self._post(request_url, data)
+        except natrix_exception.NatrixBaseException:
+            raise
+        except (TypeError, ValueError) as e:
+            raise natrix_exception.ParameterInvalidException(parameter=f'event isn\'t serializable: {e}')
         except Exception as e:
             raise natrix_exception.NetworkException(message=f'{e}')
 
+        logger.debug(f'evenhub response {result}')
+        if (result.get('ret') or 0) > 0:
+            logger.error(f'Store event to eventhub with error: {result}')
+            raise natrix_exception.ParameterInvalidException(parameter=f'{result.get("msg")}')
+
     def init_store_service(self):
         benchmark_event_data = deepcopy(benchmark_command_mapping)
         common_part = benchmark_event_data.pop('common')
@@ -107,5 +173,207 @@ class EventhubClient(BaseStoreClient):
         }
 
 
+class BufferedEventhubWriter(BaseStoreClient):
+    """A buffered writer which stores events with EventhubClient.puts.
+
+    put enqueues an event and returns immediately. A background thread flushes a batch when the
+    buffer reaches max_count events or max_bytes, or the oldest event is older than max_age
+    milliseconds.
+
+    A batch which fails with a transient error is requeued at the head and retried with
+    exponential backoff (up to max_backoff seconds), its events are dropped only when they are
+    older than max_retry_age milliseconds. A batch rejected by eventhub isn't retried. A new
+    event is dropped when the queue holds max_queue events or max_queue_bytes.
+
+    """
+
+    def __init__(self, client: EventhubClient, max_count=500, max_bytes=1024 * 1024, max_age=1000,
+                 max_queue=100000, max_queue_bytes=64 * 1024 * 1024, max_retry_age=600000,
+                 backoff=0.5, max_backoff=60):
+        self.client = client
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_queue = max_queue
+        self.max_queue_bytes = max_queue_bytes
+        self.max_retry_age = max_retry_age
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._queue = deque()       # [(enqueue time, size, event)]
+        self._bytes = 0
+        self._flushing = 0
+        self._failures = 0          # the consecutive failed batches
+        self._retry_time = 0        # no batch is flushed by the thread before it
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._metrics = {
+            'enqueued': 0,
+            'dropped': 0,
+            'rejected': 0,
+            'flushed_events': 0,
+            'flushed_batches': 0,
+            'failed_batches': 0,
+            'last_flush_time': None,
+            'last_flush_duration': None,
+        }
+        atexit.register(self.flush)
+
+    def _ensure_thread(self):
+        # The flush thread doesn't survive fork, start one for each process.
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='eventhub-writer', daemon=True)
+            self._thread.start()
+
+    def put(self, event: Dict):
+        # the event of the caller is not changed
+        record = dict(event)
+        record['time'] = int(time.time() * 1000)
+        try:
+            size = len(json.dumps(record))
+        except (TypeError, ValueError) as e:
+            raise natrix_exception.ClassInsideException(message=f'Event isn\'t serializable: {e}')
+
+        with self._condition:
+            self._ensure_thread()
+            if len(self._queue) >= self.max_queue or self._bytes + size > self.max_queue_bytes:
+                self._metrics['dropped'] += 1
+                logger.error(f'Eventhub writer queue is full({len(self._queue)} events, '
+                             f'{self._bytes} bytes), drop an event')
+                return
+            self._queue.append((time.time(), size, record))
+            self._bytes += size
+            self._metrics['enqueued'] += 1
+            if self._ready():
+                self._condition.notify_all()
+
+    def puts(self, events: List):
+        for event in events:
+            self.put(event)
+
+    def _ready(self):
+        if not self._queue or time.time() < self._retry_time:
+            return False
+        if len(self._queue) >= self.max_count or self._bytes >= self.max_bytes:
+            return True
+        return (time.time() - self._queue[0][0]) * 1000 >= self.max_age
+
+    def _wait_time(self):
+        now = time.time()
+        if now < self._retry_time:
+            return self._retry_time - now
+        if self._queue:
+            return max(self.max_age / 1000.0 - (now - self._queue[0][0]), 0.001)
+        return self.max_age / 1000.0
+
+    def _take_batch(self):
+        batch = []
+        size = 0
+        while self._queue and len(batch) < self.max_count and \
+                (not batch or size + self._queue[0][1] <= self.max_bytes):
+            item = self._queue.popleft()
+            size += item[1]
+            batch.append(item)
+        self._bytes -= size
+        return batch
+
+    def _flush_batch(self, batch):
+        """Store a batch of events.
+
+        :return: False if the batch failed with a transient error and should be retried
+        """
+        start = time.time()
+        result = 'flushed'
+        try:
+            # each event keeps its enqueue time
+            self.client.puts([item[2] for item in batch], keep_time=True)
+        except natrix_exception.ParameterException as e:
+            logger.error(f'Eventhub rejects {len(batch)} events: {e.get_log()}')
+            result = 'rejected'
+        except Exception as e:
+            log = e.get_log() if isinstance(e, natrix_exception.NatrixBaseException) else e
+            logger.error(f'Flush {len(batch)} events to eventhub with error: {log}')
+            result = 'failed'
+
+        with self._condition:
+            self._metrics['last_flush_time'] = int(time.time() * 1000)
+            self._metrics['last_flush_duration'] = int((time.time() - start) * 1000)
+            if result == 'flushed':
+                self._metrics['flushed_events'] += len(batch)
+                self._metrics['flushed_batches'] += 1
+            elif result == 'rejected':
+                self._metrics['rejected'] += len(batch)
+            else:
+                self._metrics['failed_batches'] += 1
+            if result == 'failed':
+                self._failures += 1
+                backoff = min(self.backoff * (2 ** (self._failures - 1)), self.max_backoff)
+                self._retry_time = time.time() + backoff
+            else:
+                self._failures = 0
+                self._retry_time = 0
+        return result != 'failed'
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready():
+                    self._condition.wait(self._wait_time())
+                batch = self._take_batch()
+                self._flushing += 1
+
+            try:
+                if not self._flush_batch(batch):
+                    self._requeue(batch)
+            finally:
+                with self._condition:
+                    self._flushing -= 1
+                    self._condition.notify_all()
+
+    def _requeue(self, batch):
+        """Put a failed batch back at the head, except the events older than max_retry_age.
+
+        """
+        deadline = time.time() - self.max_retry_age / 1000.0
+        with self._condition:
+            dropped = 0
+            for item in reversed(batch):
+                if item[0] < deadline:
+                    dropped += 1
+                    continue
+                self._queue.appendleft(item)
+                self._bytes += item[1]
+            if dropped:
+                self._metrics['dropped'] += dropped
+                logger.error(f'Drop {dropped} events older than {self.max_retry_age}ms')
+
+    def flush(self, timeout=30):
+        """Flush all buffered events in the current thread.
+
+        :return: True if the buffer is empty
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._condition:
+                if not self._queue:
+                    if self._flushing == 0:
+                        return True
+                    self._condition.wait(deadline - time.time())
+                    continue
+                batch = self._take_batch()
+            if not self._flush_batch(batch):
+                self._requeue(batch)
+                return False
+        return False
 
+    def metrics(self):
+        """The writer metrics, include queue depth (events and bytes) and flush statistics.
 
+        """
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics['queue_depth'] = len(self._queue)
+            metrics['queue_bytes'] = self._bytes
+        return metrics
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Time-partitioned indices of the benchmark records.
+
+If benchmark_partition (ELASTICSEARCH section) is day or week, a record is indexed to the
+partition index of its task_generate_time, '<alias>-2019.06.01' (day) or '<alias>-2019.w22'
+(ISO week), with the task_id as the routing. The partition indices are created on the first
+write by an index template (init_partition_template), which has:
+
+ - the strict mapping generated from benchmark_command_mapping, keyword/numeric/date fields with
+   doc_values (the fields are queried without the '.keyword' sub field, see keyword_field), the
+   OBJECT_FIELDS are plain objects as in the dynamic mapping, so they are aggregated at the root;
+ - the alias benchmark_partition_alias, which covers all partitions.
+
+A search of a time window only targets the partitions covering the window (get_search_index),
+a search of a task is routed to one shard of each partition (get_routing).
+
+If benchmark_partition is none, the records are in benchmark_index (dynamic mapping).
+
+"""
+from __future__ import unicode_literals
+import datetime, logging, time
+from copy import deepcopy
+
+from natrix.common.config import natrix_config
+from benchmark.types.events import benchmark_command_mapping
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_INDEX = natrix_config.get_value('ELASTICSEARCH', 'benchmark_index')
+# none, day or week
+PARTITION = natrix_config.get_value('ELASTICSEARCH', 'benchmark_partition').lower()
+PARTITION_ENABLED = PARTITION in ('day', 'week')
+PARTITION_ALIAS = natrix_config.get_value('ELASTICSEARCH', 'benchmark_partition_alias')
+PARTITION_SHARDS = int(natrix_config.get_value('ELASTICSEARCH', 'benchmark_partition_shards'))
+PARTITION_TEMPLATE = '{}_template'.format(PARTITION_ALIAS)
+# a longer window searches the alias, instead of a long list of indices
+MAX_SEARCH_PARTITIONS = 64
+
+DAY = 86400000
+# the field types with doc_values
+DOC_VALUE_TYPES = ('keyword', 'date', 'long', 'integer', 'short', 'byte', 'double', 'float', 'boolean')
+# the nested fields of benchmark_command_mapping mapped as objects, with the searched sub fields,
+# e.g. the cardinality of ips.ip (the resolved IPs) by province
+OBJECT_FIELDS = {
+    'ips': {
+        'ip': {'type': 'keyword'}
+    },
+}
+
+
+def keyword_field(field):
+    """The field name of a keyword query (term, terms aggregation).
+
+    The partitions map the keyword fields strictly, the dynamic mapping has a '.keyword' sub field.
+    """
+    return field if PARTITION_ENABLED else '{}.keyword'.format(field)
+
+
+def get_partition_name(timestamp):
+    """The partition index of a timestamp (millisecond, UTC).
+
+    """
+    date = datetime.datetime.utcfromtimestamp(timestamp / 1000.0)
+    if PARTITION == 'week':
+        year, week, _ = date.isocalendar()
+        return '{}-{}.w{:02d}'.format(PARTITION_ALIAS, year, week)
+    return '{}-{}'.format(PARTITION_ALIAS, date.strftime('%Y.%m.%d'))
+
+
+def get_record_index(record):
+    """The index of a record, the partition of its task_generate_time (or the process time for
+    a record without task).
+
+    """
+    if not PARTITION_ENABLED:
+        return BENCHMARK_INDEX
+    timestamp = record.get('task_generate_time') or record.get('response_process_time') or \
+        int(time.time() * 1000)
+    return get_partition_name(timestamp)
+
+
+def get_search_index(start_time=None, end_time=None):
+    """The index (or a comma separated list) to search the records in [start_time, end_time].
+
+    :param start_time: millisecond, all partitions (the alias) if start_time or end_time is None
+    :param end_time: millisecond
+    """
+    if not PARTITION_ENABLED:
+        return BENCHMARK_INDEX
+    if start_time is None or end_time is None or end_time - start_time > MAX_SEARCH_PARTITIONS * 7 * DAY:
+        return PARTITION_ALIAS
+
+    names = []
+    for day in range(int(start_time) // DAY, int(end_time) // DAY + 1):
+        name = get_partition_name(day * DAY)
+        if not names or names[-1] != name:
+            names.append(name)
+    if len(names) > MAX_SEARCH_PARTITIONS:
+        return PARTITION_ALIAS
+    return ','.join(names)
+
+
+def get_routing(task_id):
+    """The routing of the records of a task, None if the records aren't partitioned.
+
+    """
+    if not PARTITION_ENABLED or task_id is None:
+        return None
+    return str(task_id)
+
+
+def _strict_property(info):
+    info = deepcopy(info)
+    field_type = info.get('type')
+    if field_type in DOC_VALUE_TYPES:
+        info['doc_values'] = True
+    elif field_type in ('object', 'nested'):
+        if 'properties' in info:
+            info['properties'] = dict((name, _strict_property(sub_info))
+                                      for name, sub_info in info['properties'].items())
+        # a free structure (location, ip list, ...), the other sub fields are only in the details
+        info['dynamic'] = True
+    return info
+
+
+def get_partition_mappings():
+    """The strict mappings (for each record type) of the partitions.
+
+    """
+    common = benchmark_command_mapping['common']['properties']
+    mappings = {}
+    for record_type, mapping in benchmark_command_mapping.items():
+        if record_type == 'common':
+            continue
+        properties = dict(common)
+        properties.update(mapping['properties'])
+        for name, sub_properties in OBJECT_FIELDS.items():
+            if name in properties:
+                properties[name] = {'type': 'object', 'properties': sub_properties}
+        mappings[record_type] = {
+            'dynamic': 'strict',
+            'properties': dict((name, _strict_property(info)) for name, info in properties.items())
+        }
+    return mappings
+
+
+def get_partition_template():
+    return {
+        'template': '{}-*'.format(PARTITION_ALIAS),
+        'settings': {
+            'number_of_shards': PARTITION_SHARDS
+        },
+        'mappings': get_partition_mappings(),
+        'aliases': {
+            PARTITION_ALIAS: {}
+        }
+    }
+
+
+def init_partition_template(es_conn):
+    """Install (or update) the index template of the partitions.
+
+    The template applies to the partitions created later, the existing ones are unchanged.
+    """
+    es_conn.indices.put_template(name=PARTITION_TEMPLATE, body=get_partition_template())
+    logger.info('Put the index template({}) of benchmark partitions'.format(PARTITION_TEMPLATE))
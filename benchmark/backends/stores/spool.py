@@ -0,0 +1,412 @@
+"""Durable on-disk spool for benchmark events.
+
+Events are appended to memory-mapped, preallocated segment files and a background drainer
+replays them to a store client (BaseStoreClient.puts) in large batches. The drained offset is
+committed after each successful batch, so the events survive store outages and restarts.
+
+Spool layout (each writer process owns a directory):
+
+    <spool dir>/writer-<pid>/
+        .lock                       # flock by the owner process
+        offset                      # '<segment seq> <position>', the drained offset
+        00000000000000000001.seg    # segments
+
+Record format: 4 bytes length (big-endian) + 4 bytes crc32 + json payload, a zero length marks
+the end of the written data in a segment.
+
+A directory whose owner is dead (the lock is free) is drained by a live drainer, then removed.
+
+"""
+import fcntl
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from typing import List, Dict
+
+from .base import BaseStoreClient
+from natrix.common import exception as natrix_exception
+from natrix.common.natrixlog import NatrixLogging
+
+
+logger = NatrixLogging(name=__name__)
+
+HEADER = struct.Struct('>II')
+SEGMENT_SUFFIX = '.seg'
+WRITER_PREFIX = 'writer-'
+
+# fsync policy
+FSYNC_ALWAYS = 'always'        # msync after each append
+FSYNC_INTERVAL = 'interval'    # msync by the drainer periodically
+FSYNC_NEVER = 'never'          # leave it to the OS
+
+
+def _allocate(file, size):
+    """Allocate the blocks of a new segment file.
+
+    A sparse file (truncate) gets its blocks on the first write to the mapping, which kills the
+    process by SIGBUS if the disk is full, an allocated file fails here with an OSError.
+    """
+    if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(file.fileno(), 0, size)
+        return
+    chunk = b'\0' * min(size, 1024 * 1024)
+    remaining = size
+    while remaining > 0:
+        file.write(chunk[:remaining])
+        remaining -= len(chunk)
+    file.flush()
+
+
+class Segment(object):
+    """A preallocated, memory-mapped segment file.
+
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        exists = os.path.exists(path)
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if not exists:
+            try:
+                _allocate(self.file, size)
+            except OSError as e:
+                self.file.close()
+                os.remove(path)
+                raise natrix_exception.ClassInsideException(
+                    message='Allocate spool segment({}) with error: {}'.format(path, e))
+        self.size = os.path.getsize(path)
+        self.mmap = mmap.mmap(self.file.fileno(), self.size)
+        self.position = self._scan() if exists else 0
+
+    def _scan(self):
+        position = 0
+        for position, _ in self.records(0):
+            pass
+        return position
+
+    def fits(self, length):
+        return self.position + HEADER.size + length <= self.size
+
+    def append(self, payload):
+        HEADER.pack_into(self.mmap, self.position, len(payload), zlib.crc32(payload))
+        start = self.position + HEADER.size
+        self.mmap[start: start + len(payload)] = payload
+        self.position = start + len(payload)
+
+    def records(self, position):
+        """Iterate (next position, payload) from position to the end of the written data.
+
+        """
+        while position + HEADER.size <= self.size:
+            length, crc = HEADER.unpack_from(self.mmap, position)
+            start = position + HEADER.size
+            if length == 0 or start + length > self.size:
+                return
+            payload = bytes(self.mmap[start: start + length])
+            if zlib.crc32(payload) != crc:
+                # a torn write, the rest of segment is not trusted
+                logger.error('Spool segment({}) is broken at {}'.format(self.path, position))
+                return
+            position = start + length
+            yield position, payload
+
+    def flush(self):
+        self.mmap.flush()
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class SegmentSpool(object):
+    """An append-only segment spool in a directory, with the drained offset.
+
+    """
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024, fsync=FSYNC_INTERVAL):
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync = fsync
+        os.makedirs(path, exist_ok=True)
+
+        self._segments = {}
+        seqs = self.segment_seqs()
+        self.active_seq = seqs[-1] if seqs else 1
+        self.offset = self._load_offset()
+
+    def segment_seqs(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, '{:020d}{}'.format(seq, SEGMENT_SUFFIX))
+
+    def _segment(self, seq, size=None):
+        segment = self._segments.get(seq)
+        if segment is None:
+            segment = Segment(self._segment_path(seq), size or self.segment_size)
+            self._segments[seq] = segment
+        return segment
+
+    def _load_offset(self):
+        try:
+            with open(os.path.join(self.path, 'offset')) as f:
+                seq, position = f.read().split()
+                return int(seq), int(position)
+        except (IOError, OSError, ValueError):
+            seqs = self.segment_seqs()
+            return (seqs[0] if seqs else 1), 0
+
+    def append(self, payload):
+        segment = self._segment(self.active_seq, max(self.segment_size, HEADER.size * 2 + len(payload)))
+        if not segment.fits(len(payload)):
+            segment.flush()
+            self.active_seq += 1
+            segment = self._segment(self.active_seq,
+                                    max(self.segment_size, HEADER.size * 2 + len(payload)))
+        segment.append(payload)
+        if self.fsync == FSYNC_ALWAYS:
+            segment.flush()
+
+    def read(self, max_records, max_bytes):
+        """Read records from the drained offset.
+
+        :return: (payloads, offset), offset is the position after the last payload
+        """
+        seq, position = self.offset
+        payloads = []
+        size = 0
+        while seq <= self.active_seq and len(payloads) < max_records and size < max_bytes:
+            if not os.path.exists(self._segment_path(seq)):
+                seq, position = seq + 1, 0
+                continue
+            for position, payload in self._segment(seq).records(position):
+                payloads.append(payload)
+                size += len(payload)
+                if len(payloads) >= max_records or size >= max_bytes:
+                    break
+            else:
+                if seq < self.active_seq:
+                    seq, position = seq + 1, 0
+                    continue
+            break
+
+        return payloads, (seq, position)
+
+    def commit(self, offset):
+        """Commit the drained offset, and remove the drained segments.
+
+        """
+        tmp_path = os.path.join(self.path, 'offset.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write('{} {}'.format(*offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, 'offset'))
+        self.offset = offset
+
+        for seq in self.segment_seqs():
+            if seq >= offset[0]:
+                break
+            segment = self._segments.pop(seq, None)
+            if segment is not None:
+                segment.close()
+            os.remove(self._segment_path(seq))
+
+    def flush(self):
+        if self.fsync != FSYNC_NEVER and self.active_seq in self._segments:
+            self._segments[self.active_seq].flush()
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.flush()
+            segment.close()
+        self._segments = {}
+
+
+class SpoolWriter(BaseStoreClient):
+    """Store client which appends events to the local spool, then drains them to a store client.
+
+    put/puts return after the event is appended (memory-mapped), the drainer thread replays the
+    spool to client.puts in batches of batch_count events, and retries with backoff until the
+    store accepts them. A batch the store rejects (ParameterException) is dropped.
+
+    """
+
+    def __init__(self, client: BaseStoreClient, directory, segment_size=64 * 1024 * 1024,
+                 fsync=FSYNC_INTERVAL, batch_count=1000, batch_bytes=4 * 1024 * 1024,
+                 interval=1000, max_backoff=60):
+        self.client = client
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.batch_count = batch_count
+        self.batch_bytes = batch_bytes
+        self.interval = interval
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()     # only one drain at a time
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._spool = None
+        self._lock_file = None
+        self._thread = None
+        self._metrics = {
+            'appended': 0,
+            'drained': 0,
+            'rejected': 0,
+            'failed_batches': 0,
+        }
+
+    def _ensure_spool(self):
+        # Spool and drainer are owned by each (forked) process.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        path = os.path.join(self.directory, '{}{}'.format(WRITER_PREFIX, self._pid))
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, '.lock'), 'w')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self._spool = SegmentSpool(path, segment_size=self.segment_size, fsync=self.fsync)
+        self._thread = threading.Thread(target=self._run, name='spool-drainer', daemon=True)
+        self._thread.start()
+
+    def put(self, event: Dict):
+        self.puts([event])
+
+    def puts(self, events: List):
+        with self._lock:
+            self._ensure_spool()
+            for event in events:
+                # the events of the caller are not changed
+                record = dict(event)
+                record['time'] = int(time.time() * 1000)
+                try:
+                    payload = json.dumps(record).encode('utf-8')
+                except (TypeError, ValueError) as e:
+                    raise natrix_exception.ClassInsideException(
+                        message='Event isn\'t serializable: {}'.format(e))
+                self._spool.append(payload)
+            self._metrics['appended'] += len(events)
+        if len(events) >= self.batch_count:
+            self._wakeup.set()
+
+    def _drain(self, spool, lock=None):
+        """Drain a spool until it is empty or the store fails.
+
+        :return: True if the spool is empty
+        """
+        with self._drain_lock:
+            return self._drain_batches(spool, lock)
+
+    def _drain_batches(self, spool, lock):
+        while True:
+            if lock is not None:
+                with lock:
+                    payloads, offset = spool.read(self.batch_count, self.batch_bytes)
+            else:
+                payloads, offset = spool.read(self.batch_count, self.batch_bytes)
+            if not payloads:
+                return True
+
+            try:
+                self.client.puts([json.loads(payload.decode('utf-8')) for payload in payloads],
+                                 keep_time=True)
+            except natrix_exception.ParameterException as e:
+                # the store rejects the batch, retrying it would block the spool
+                logger.error('Store rejects {} spooled events: {}'.format(len(payloads), e.get_log()))
+                self._metrics['rejected'] += len(payloads)
+            except natrix_exception.NatrixBaseException as e:
+                logger.error('Drain {} spooled events with error: {}'.format(len(payloads), e))
+                self._metrics['failed_batches'] += 1
+                return False
+
+            if lock is not None:
+                with lock:
+                    spool.commit(offset)
+            else:
+                spool.commit(offset)
+            self._metrics['drained'] += len(payloads)
+
+    def _drain_orphans(self):
+        """Drain the spool directories of dead writers.
+
+        """
+        for name in os.listdir(self.directory):
+            if not name.startswith(WRITER_PREFIX) or name == '{}{}'.format(WRITER_PREFIX, self._pid):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                self._drain_orphan(name, path)
+            except Exception as e:
+                natrix_exception.natrix_traceback()
+                logger.error('Drain the spool of dead writer({}) with error: {}'.format(name, e))
+
+    def _drain_orphan(self, name, path):
+        try:
+            # the lock file isn't created, the directory may be removed by another drainer
+            lock_fd = os.open(os.path.join(path, '.lock'), os.O_RDWR)
+        except FileNotFoundError:
+            return
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                return
+            if not os.path.exists(os.path.join(path, '.lock')):
+                # removed by another drainer after it's drained
+                return
+            spool = SegmentSpool(path, segment_size=self.segment_size, fsync=self.fsync)
+            drained = self._drain(spool)
+            spool.close()
+            if drained:
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info('Drained the spool of dead writer: {}'.format(name))
+        finally:
+            os.close(lock_fd)
+
+    def _run(self):
+        backoff = self.interval / 1000.0
+        while True:
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+            with self._lock:
+                self._spool.flush()
+            try:
+                drained = self._drain(self._spool, lock=self._lock)
+                if drained:
+                    self._drain_orphans()
+            except Exception as e:
+                natrix_exception.natrix_traceback()
+                logger.error('Spool drainer with error: {}'.format(e))
+                drained = False
+
+            if drained:
+                backoff = self.interval / 1000.0
+            else:
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def flush(self):
+        """Drain the spool of the current process in the current thread.
+
+        :return: True if the spool is empty
+        """
+        with self._lock:
+            self._ensure_spool()
+            self._spool.flush()
+        return self._drain(self._spool, lock=self._lock)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            if self._spool is not None:
+                metrics['offset'] = self._spool.offset
+                metrics['active_segment'] = self._spool.active_seq
+        metrics['queue_depth'] = metrics['appended'] - metrics['drained']
+        return metrics
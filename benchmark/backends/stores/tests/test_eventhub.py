@@ -0,0 +1,167 @@
+import os
+import time
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from natrix.common import exception as natrix_exception
+from benchmark.backends.stores import eventhub
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.error = None
+        self.batches = []
+
+    def puts(self, events, keep_time=False):
+        if self.error is not None:
+            raise self.error
+        self.batches.append(events)
+
+
+@mock.patch.object(eventhub.time, 'sleep')
+class EventhubClientTestCase(SimpleTestCase):
+
+    def eventhub_client(self, *responses):
+        client = eventhub.EventhubClient(service_url='http://eventhub', retries=2)
+        client._session = mock.Mock()
+        client._session.post.side_effect = responses
+        client._session_pid = os.getpid()
+        return client
+
+    def test_transient(self, sleep):
+        client = self.eventhub_client(requests.ConnectionError('reset'), FakeResponse(503, 'Unavailable'),
+                             FakeResponse(200, '{"ret": 0}'))
+        events = [{'n': 1}]
+        client.puts(events)
+        self.assertEqual(client._session.post.call_count, 3)
+        self.assertEqual([call[0][0] for call in sleep.call_args_list], [0.5, 1.0])
+        self.assertIn('time', client._session.post.call_args[1]['json'][0])
+        # the events of the caller are not changed
+        self.assertEqual(events, [{'n': 1}])
+
+        client = self.eventhub_client(*[FakeResponse(429, '')] * 3)
+        with self.assertRaises(natrix_exception.NetworkException):
+            client.puts([{'n': 1}])
+
+    def test_permanent(self, sleep):
+        client = self.eventhub_client(FakeResponse(400, '<html>Bad Request</html>'))
+        with self.assertRaises(natrix_exception.ParameterInvalidException):
+            client.puts([{'n': 1}])
+        client = self.eventhub_client(FakeResponse(200, '{"ret": 1, "msg": "unknown event type"}'))
+        with self.assertRaises(natrix_exception.ParameterInvalidException):
+            client.put({'n': 1})
+        sleep.assert_not_called()
+
+
+@mock.patch.object(eventhub.BufferedEventhubWriter, '_ensure_thread')
+class BufferedEventhubWriterTestCase(SimpleTestCase):
+
+    def writer(self, **kwargs):
+        self.client = FakeClient()
+        return eventhub.BufferedEventhubWriter(self.client, **kwargs)
+
+    def test_batch_by_count_and_bytes(self, ensure_thread):
+        writer = self.writer(max_count=3, max_bytes=1024 * 1024, max_age=60000)
+        writer.puts([{'n': n} for n in range(2)])
+        self.assertFalse(writer._ready())
+        writer.put({'n': 2})
+        self.assertTrue(writer._ready())
+        self.assertEqual([item[2]['n'] for item in writer._take_batch()], [0, 1, 2])
+
+        writer = self.writer(max_count=100, max_bytes=64, max_age=60000)
+        writer.puts([{'n': n, 'data': 'x' * 10} for n in range(3)])
+        self.assertTrue(writer._ready())
+        # a batch doesn't exceed max_bytes
+        self.assertEqual(len(writer._take_batch()), 1)
+        self.assertEqual(writer.metrics()['queue_depth'], 2)
+
+    def test_batch_by_age(self, ensure_thread):
+        writer = self.writer(max_count=100, max_age=1000)
+        writer.put({'n': 1})
+        self.assertFalse(writer._ready())
+        with mock.patch.object(eventhub.time, 'time', return_value=time.time() + 1):
+            self.assertTrue(writer._ready())
+
+    def test_put(self, ensure_thread):
+        writer = self.writer()
+        event = {'n': 1}
+        writer.put(event)
+        self.assertEqual(event, {'n': 1})
+        with self.assertRaises(natrix_exception.ClassInsideException):
+            writer.put({'n': object()})
+        self.assertEqual(writer.metrics()['enqueued'], 1)
+
+    def test_queue_full(self, ensure_thread):
+        writer = self.writer(max_queue=2)
+        writer.puts([{'n': n} for n in range(3)])
+        self.assertEqual((writer.metrics()['queue_depth'], writer.metrics()['dropped']), (2, 1))
+
+        writer = self.writer(max_queue_bytes=64)
+        writer.puts([{'n': n, 'data': 'x' * 10} for n in range(3)])
+        self.assertEqual((writer.metrics()['queue_depth'], writer.metrics()['dropped']), (1, 2))
+
+    def test_flush(self, ensure_thread):
+        writer = self.writer(max_count=2)
+        writer.puts([{'n': n} for n in range(5)])
+        self.assertTrue(writer.flush())
+        self.assertEqual([len(batch) for batch in self.client.batches], [2, 2, 1])
+        metrics = writer.metrics()
+        self.assertEqual((metrics['flushed_events'], metrics['flushed_batches']), (5, 3))
+        self.assertEqual((metrics['queue_depth'], metrics['queue_bytes']), (0, 0))
+        self.assertIsNotNone(metrics['last_flush_time'])
+
+    def test_requeue(self, ensure_thread):
+        writer = self.writer(backoff=10, max_retry_age=60000)
+        writer.puts([{'n': n} for n in range(3)])
+        self.client.error = natrix_exception.NetworkException(message='unavailable')
+        self.assertFalse(writer.flush())
+        self.assertFalse(writer.flush())
+
+        metrics = writer.metrics()
+        self.assertEqual((metrics['failed_batches'], metrics['dropped'], metrics['queue_depth']), (2, 0, 3))
+        # the thread retries with backoff
+        self.assertFalse(writer._ready())
+        self.assertAlmostEqual(writer._wait_time(), 20, delta=1)
+
+        self.client.error = None
+        self.assertTrue(writer.flush())
+        self.assertEqual([event['n'] for event in self.client.batches[0]], [0, 1, 2])
+        self.assertEqual(writer._retry_time, 0)
+
+    def test_requeue_expired(self, ensure_thread):
+        writer = self.writer(max_retry_age=1000)
+        writer.puts([{'n': n} for n in range(2)])
+        writer._queue[0] = (time.time() - 2,) + writer._queue[0][1:]
+        self.client.error = natrix_exception.NetworkException(message='unavailable')
+        self.assertFalse(writer.flush())
+        self.assertEqual((writer.metrics()['dropped'], writer.metrics()['queue_depth']), (1, 1))
+
+    def test_rejected(self, ensure_thread):
+        writer = self.writer()
+        writer.puts([{'n': n} for n in range(2)])
+        self.client.error = natrix_exception.ParameterInvalidException(parameter='bad event')
+        self.assertTrue(writer.flush())
+        metrics = writer.metrics()
+        self.assertEqual((metrics['rejected'], metrics['failed_batches'], metrics['queue_depth']), (2, 0, 0))
+
+
+class BufferedEventhubWriterThreadTestCase(SimpleTestCase):
+
+    def test_flushed_by_thread(self):
+        client = FakeClient()
+        writer = eventhub.BufferedEventhubWriter(client, max_count=100, max_age=10)
+        writer.puts([{'n': n} for n in range(3)])
+        deadline = time.time() + 5
+        while writer.metrics()['flushed_events'] < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([event['n'] for event in client.batches[0]], [0, 1, 2])
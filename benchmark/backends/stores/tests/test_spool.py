@@ -0,0 +1,217 @@
+import errno
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from natrix.common import exception as natrix_exception
+from benchmark.backends.stores import spool
+
+
+class FakeClient(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.events = []
+
+    def puts(self, events, keep_time=False):
+        if self.fail:
+            raise natrix_exception.ClassInsideException(message='store is unavailable')
+        self.events.extend(events)
+
+
+def payloads(count, start=0):
+    return [json.dumps({'n': n}).encode('utf-8') for n in range(start, start + count)]
+
+
+class SpoolTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'writer-1')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SegmentSpoolTestCase(SpoolTestCase):
+
+    def test_read_commit(self):
+        segment_spool = spool.SegmentSpool(self.path, segment_size=64)
+        for payload in payloads(10):
+            segment_spool.append(payload)
+        # a segment of 64 bytes holds 4 records (16 bytes each)
+        self.assertEqual(segment_spool.segment_seqs(), [1, 2, 3])
+
+        read, offset = segment_spool.read(5, 1024)
+        self.assertEqual(read, payloads(5))
+        segment_spool.commit(offset)
+        # the drained segments are removed
+        self.assertEqual(segment_spool.segment_seqs(), [2, 3])
+
+        read, offset = segment_spool.read(100, 1024)
+        self.assertEqual(read, payloads(5, start=5))
+        segment_spool.commit(offset)
+        self.assertEqual(segment_spool.read(100, 1024)[0], [])
+        segment_spool.close()
+
+    def test_recovery(self):
+        segment_spool = spool.SegmentSpool(self.path, segment_size=1024)
+        for payload in payloads(5):
+            segment_spool.append(payload)
+        segment_spool.commit(segment_spool.read(2, 1024)[1])
+        segment_spool.flush()
+        # the process is killed: the spool isn't closed, the rest of the records aren't drained
+        recovered = spool.SegmentSpool(self.path, segment_size=1024)
+        self.assertEqual(recovered.read(100, 1024)[0], payloads(3, start=2))
+
+        # the new records are appended after the recovered ones
+        recovered.append(payloads(1, start=5)[0])
+        self.assertEqual(recovered.read(100, 1024)[0], payloads(4, start=2))
+        recovered.close()
+        segment_spool.close()
+
+    def test_torn_write(self):
+        segment_spool = spool.SegmentSpool(self.path, segment_size=1024)
+        for payload in payloads(3):
+            segment_spool.append(payload)
+        segment = segment_spool._segment(segment_spool.active_seq)
+        # the payload of the last record is partly written
+        segment.mmap[segment.position - 2: segment.position] = b'xx'
+        segment_spool.close()
+
+        recovered = spool.SegmentSpool(self.path, segment_size=1024)
+        self.assertEqual(recovered.read(100, 1024)[0], payloads(2))
+        recovered.close()
+
+    def test_fsync(self):
+        for fsync, flushes in ((spool.FSYNC_ALWAYS, 3 + 1), (spool.FSYNC_INTERVAL, 1), (spool.FSYNC_NEVER, 0)):
+            path = os.path.join(self.directory, fsync)
+            segment_spool = spool.SegmentSpool(path, segment_size=1024, fsync=fsync)
+            with mock.patch.object(spool.Segment, 'flush') as flush:
+                for payload in payloads(3):
+                    segment_spool.append(payload)
+                # the periodic flush of the drainer
+                segment_spool.flush()
+            self.assertEqual(flush.call_count, flushes, fsync)
+            segment_spool.close()
+
+    def test_preallocated(self):
+        segment_spool = spool.SegmentSpool(self.path, segment_size=4096)
+        segment_spool.append(payloads(1)[0])
+        segment_path = segment_spool._segment_path(segment_spool.active_seq)
+        # the blocks are allocated, it isn't a sparse file
+        self.assertGreaterEqual(os.stat(segment_path).st_blocks * 512, 4096)
+        segment_spool.close()
+
+    def test_disk_full(self):
+        segment_spool = spool.SegmentSpool(self.path, segment_size=4096)
+        with mock.patch.object(spool.os, 'posix_fallocate', side_effect=OSError(errno.ENOSPC, 'No space')):
+            with self.assertRaises(natrix_exception.ClassInsideException):
+                segment_spool.append(payloads(1)[0])
+        self.assertEqual(segment_spool.segment_seqs(), [])
+
+        # the segment is created when there is space again
+        segment_spool.append(payloads(1)[0])
+        self.assertEqual(segment_spool.read(100, 1024)[0], payloads(1))
+        segment_spool.close()
+
+
+class SpoolWriterTestCase(SpoolTestCase):
+
+    def writer(self, client):
+        # the drainer thread waits, the tests drain in the current thread
+        return spool.SpoolWriter(client, self.directory, segment_size=1024, batch_count=1000,
+                                 interval=3600 * 1000)
+
+    def test_puts_flush(self):
+        client = FakeClient()
+        writer = self.writer(client)
+        events = [{'n': 1}, {'n': 2}]
+        writer.puts(events)
+        # the events of the caller are not changed
+        self.assertEqual(events, [{'n': 1}, {'n': 2}])
+
+        self.assertTrue(writer.flush())
+        self.assertEqual([event['n'] for event in client.events], [1, 2])
+        self.assertIn('time', client.events[0])
+        self.assertEqual(writer.metrics()['queue_depth'], 0)
+
+    def test_store_failed(self):
+        client = FakeClient(fail=True)
+        writer = self.writer(client)
+        writer.puts([{'n': 1}])
+        self.assertFalse(writer.flush())
+        self.assertEqual(writer.metrics()['failed_batches'], 1)
+        self.assertEqual(writer.metrics()['queue_depth'], 1)
+
+        client.fail = False
+        self.assertTrue(writer.flush())
+        self.assertEqual([event['n'] for event in client.events], [1])
+
+    def test_store_rejected(self):
+        client = FakeClient()
+        writer = self.writer(client)
+        writer.puts([{'n': 1}])
+        with mock.patch.object(client, 'puts',
+                               side_effect=natrix_exception.ParameterInvalidException(parameter='n')):
+            # a rejected batch doesn't block the spool
+            self.assertTrue(writer.flush())
+        self.assertEqual(writer.metrics()['rejected'], 1)
+        self.assertEqual(writer.metrics()['queue_depth'], 0)
+
+        with self.assertRaises(natrix_exception.ClassInsideException):
+            writer.puts([{'n': object()}])
+
+    def orphan(self, name, count, lock=True):
+        path = os.path.join(self.directory, name)
+        segment_spool = spool.SegmentSpool(path, segment_size=1024)
+        for payload in payloads(count):
+            segment_spool.append(payload)
+        segment_spool.close()
+        if lock:
+            open(os.path.join(path, '.lock'), 'w').close()
+        return path
+
+    def test_drain_orphans(self):
+        dead = self.orphan('writer-100001', 3)
+        live = self.orphan('writer-100002', 2)
+        # a directory removed while it's listed, without the lock file
+        removed = self.orphan('writer-100003', 1, lock=False)
+
+        client = FakeClient()
+        writer = self.writer(client)
+        writer.flush()
+        with open(os.path.join(live, '.lock')) as lock_file:
+            # the owner of writer-100002 is alive
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            writer._drain_orphans()
+
+        self.assertEqual([event['n'] for event in client.events], [0, 1, 2])
+        self.assertFalse(os.path.exists(dead))
+        self.assertTrue(os.path.exists(live))
+        # the lock file isn't created in a directory being removed
+        self.assertFalse(os.path.exists(os.path.join(removed, '.lock')))
+
+    def test_drain_orphan_failed(self):
+        self.orphan('writer-100001', 1)
+        self.orphan('writer-100002', 1)
+        client = FakeClient()
+        writer = self.writer(client)
+        writer.flush()
+
+        drain_orphan = writer._drain_orphan
+
+        def broken(name, path):
+            if name == 'writer-100001':
+                raise FileNotFoundError(path)
+            drain_orphan(name, path)
+
+        with mock.patch.object(writer, '_drain_orphan', side_effect=broken):
+            writer._drain_orphans()
+        # an error of a directory doesn't abort the others
+        self.assertEqual(len(client.events), 1)
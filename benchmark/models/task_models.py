@@ -204,13 +204,23 @@ class Task(models.Model):
         return terminals
 
     def task_command_represent(self):
+        try:
+            condition = json.loads(self.terminal_condition)
+            terminals, fanout = terminal_policy(self.terminal_switch, conditions=condition,
+                                                group=self.group, fanout=True)
+        except Exception as e:
+            natrix_exception.natrix_traceback()
+            logger.error('Get terminals info with errro: {}'.format(e))
+            terminals, fanout = [], None
+
         command_data = {
             'command': self.command.terminal_command_representation(),
             'task_tag': {
                 'task_id': str(self.id),
                 'task_generate_time': time.time()
             },
-            'terminals': self.get_terminals()
+            'terminals': terminals,
+            'fanout': fanout
         }
 
         return command_data
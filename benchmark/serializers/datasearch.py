@@ -1,86 +1,413 @@
 # -*- coding: utf-8 -*-
-"""
+"""The ES searches of the timed task analysis.
+
+A chart function is a plan: a generator which yields its searches (a Search, or a list of
+Search sent in the same round) and receives the responses, the chart data is the return value.
+run_plan runs a plan with a search request for each Search, run_plans runs plans together and
+sends the searches of each round in one msearch request.
 
 """
 from __future__ import unicode_literals
+import logging, math
 
-from benchmark.backends.command_dispatcher.store import origin_search
+from natrix.common import exception as natrix_exception
+from benchmark.backends.command_dispatcher import rollup
+from benchmark.backends.stores import partition
+from benchmark.backends.command_dispatcher.store import origin_search, multi_search
+from benchmark.backends.analysis import timed
+from utils.sketches import DDSketch, HyperLogLog
 
 MAX_TIME_POINTS = 200
 MAX_DIST_POINTS = 50
+# the exception lines of a time chart (the top error codes)
+MAX_EXCEPTION_LINES = 10
+
+# the percentiles of the latency charts
+PERCENTS = [50, 95, 99]
+# the fields of the distinct values (rollup.ROLLUP_DISTINCTS) in the records
+DISTINCT_FIELDS = {
+    'remote_ip': partition.keyword_field('remote_ip'),
+    # ips is an object in both mappings (see partition.OBJECT_FIELDS), not nested
+    'resolved_ip': partition.keyword_field('ips.ip'),
+}
+
+EXCEPTION_AGGS = {
+    'bucket_aggs': {
+        'terms': {
+            'field': 'errorcode',
+            'size': 1000
+        }
+    }
+}
 
+# the region and organization charts are terms aggregations of the fields
+REGION_FIELD = partition.keyword_field('province')
+# a record has the organization ancestry of its terminal, so it's counted in each ancestor
+ORGANIZATION_FIELD = partition.keyword_field('organization_name')
+
+TASK_FIELD = partition.keyword_field('task_id')
+
+logger = logging.getLogger(__name__)
+
+
+class Search(object):
+    """A search of a plan, app selects the index ('benchmark' or 'benchmark_rollup') if index
+    is None.
+
+    """
+    __slots__ = ('body', 'size', 'app', 'index', 'routing')
+
+    def __init__(self, body, size=0, app='benchmark', index=None, routing=None):
+        self.body = body
+        self.size = size
+        self.app = app
+        self.index = index
+        self.routing = routing
+
+
+def task_search(body, task_id, start_time, end_time, size=0):
+    """A search of the records of a task in [start_time, end_time], only the partitions covering
+    the window are searched (see stores.partition).
+
+    """
+    return Search(body, size=size, index=partition.get_search_index(start_time, end_time),
+                  routing=partition.get_routing(task_id))
+
+
+def _origin_search(search):
+    return origin_search(body=search.body, size=search.size, app=search.app,
+                         index=search.index, routing=search.routing)
+
+
+def _search_error(res):
+    return natrix_exception.ClassInsideException(
+        message='Analyse search with error: {}'.format(res.get('error')))
+
+
+def run_plan(plan):
+    """Run a plan, each search is a search request.
+
+    :return: the chart data
+    """
+    try:
+        searches = next(plan)
+        while True:
+            if isinstance(searches, Search):
+                res = _origin_search(searches)
+            else:
+                res = [_origin_search(search) for search in searches]
+            searches = plan.send(res)
+    except StopIteration as e:
+        return e.value
+
+
+def _advance(plan, res=None, error=None):
+    """Send the responses (or the search error) to a plan.
+
+    :return: (True, the chart data) if the plan is finished, else (False, the next searches)
+    """
+    try:
+        if error is not None:
+            searches = plan.throw(error)
+        elif res is None:
+            searches = next(plan)
+        else:
+            searches = plan.send(res)
+    except StopIteration as e:
+        return True, e.value
+    return False, searches
+
+
+def run_plans(plans):
+    """Run plans together, the searches of all plans in a round are sent in one msearch request.
+
+    A plan which raises an exception (or gets a failed search) doesn't stop the other plans.
+    :return: a list of the chart data, or the exception of a failed plan
+    """
+    results = [None] * len(plans)
+    pending = {}
+
+    def advance(index, res=None, error=None):
+        try:
+            finished, value = _advance(plans[index], res, error)
+        except Exception as e:
+            natrix_exception.natrix_traceback()
+            results[index] = e
+            return
+        if finished:
+            results[index] = value
+        else:
+            pending[index] = value
+
+    for index in range(len(plans)):
+        advance(index)
+
+    while pending:
+        rounds, pending = pending, {}
+        searches = []
+        for index, plan_searches in rounds.items():
+            if isinstance(plan_searches, Search):
+                plan_searches = [plan_searches]
+            searches.extend((index, search) for search in plan_searches)
+
+        responses = multi_search([(search.app, search.body, search.size, search.index, search.routing)
+                                  for _, search in searches])
+        logger.debug('Run {} plans, a round of {} searches'.format(len(rounds), len(searches)))
+
+        plan_responses = dict((index, []) for index in rounds)
+        for (index, _), res in zip(searches, responses):
+            plan_responses[index].append(res)
+
+        for index, plan_searches in rounds.items():
+            responses = plan_responses[index]
+            failed = [res for res in responses if 'error' in res]
+            if failed:
+                advance(index, error=_search_error(failed[0]))
+            else:
+                advance(index, responses[0] if isinstance(plan_searches, Search) else responses)
+
+    return results
+
+
+def get_es_histogram_query(task_id, record_type, start_time, end_time, interval, aggs=None):
+    """The date histogram of the records in [start_time, end_time), whole buckets only.
+
+    """
+    histogram = {
+        'date_histogram': {
+            'field': 'task_generate_time',
+            'interval': interval,
+            'extended_bounds': {
+                'min': start_time,
+                'max': end_time - 1
+            }
+        }
+    }
+    if aggs:
+        histogram['aggs'] = aggs
 
-def get_es_exception_query(task_id, start_time, end_time, interval):
     es_condition = {
         'query': {
             'bool': {
                 'must': [
-                    {'term': {'_type': 'error'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
-                    {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
+                    {'term': {'_type': record_type}},
+                    {'term': {TASK_FIELD: str(task_id)}},
+                    {'range': {'task_generate_time': {'gte': start_time, 'lt': end_time}}}
                 ]
             }
         },
         'aggs': {
-            'bucket_aggs': {
-                'terms': {
-                    'field': 'errorcode'
-                },
-                'aggs': {
-                    'histogram_datas': {
-                        'date_histogram': {
-                            'field': 'task_generate_time',
-                            'interval': interval,
-                            'extended_bounds': {
-                                'min': start_time,
-                                'max': end_time
-                            }
-                        }
-                    }
-                }
-            }
+            'histogram_datas': histogram
         },
     }
     return es_condition
 
 
-def es_exception_extract(es_res):
-    analyse_datas = es_res.get('aggregations', {}).get('bucket_aggs', {}).get('buckets')
+def get_es_exception_query(task_id, start_time, end_time, interval):
+    return get_es_histogram_query(task_id, 'error', start_time, end_time, interval, EXCEPTION_AGGS)
 
-    lines = []
-    x_axis = []
-    x_axis_inited = False
-    for records in analyse_datas:
-        name = records.get('key')
-        record_count = records.get('doc_count')
-        record_value = []
-        record_list = records.get('histogram_datas', {}).get('buckets')
-        for record in record_list:
-            if not x_axis_inited:
-                x_axis.append(record.get('key'))
-            record_value.append(record.get('doc_count'))
-        x_axis_inited = True
-        lines.append({
-            'name': name,
-            'values': record_value
-        })
+
+def es_exception_bucket(record):
+    return dict((bucket.get('key'), bucket.get('doc_count'))
+                for bucket in record.get('bucket_aggs', {}).get('buckets', []))
+
+
+def es_exception_extract(buckets):
+    """The lines of the top error codes.
+
+    :param buckets: [(bucket key, {errorcode: count})]
+    """
+    totals = {}
+    for _, value in buckets:
+        for name, count in (value or {}).items():
+            totals[name] = totals.get(name, 0) + count
+    names = sorted(totals, key=lambda name: (-totals[name], name))[0: MAX_EXCEPTION_LINES]
+
+    x_axis = [key for key, _ in buckets]
+    lines = [{
+        'name': name,
+        'values': [(value or {}).get(name, 0) for _, value in buckets]
+    } for name in names]
 
     return x_axis, lines
 
 
 def get_interval(start_time, end_time, interval):
-    avg_interval = (end_time - start_time) / MAX_TIME_POINTS
-    return interval if interval > avg_interval else avg_interval
+    """The histogram interval: a multiple of the task interval, at most MAX_TIME_POINTS buckets.
+
+    A window of the same length has the same interval, so its buckets are cached.
+    """
+    interval = int(interval) or 1000
+    return interval * max(1, int(math.ceil((end_time - start_time) / float(interval * MAX_TIME_POINTS))))
+
+
+def get_analyse_interval(start_time, end_time, interval):
+    """The histogram interval and the rollup granularity (None if the records are searched).
+
+    """
+    analyse_interval = get_interval(start_time, end_time, interval)
+    if rollup.ROLLUP_ENABLED:
+        return rollup.get_rollup_interval(analyse_interval, align=analyse_interval > int(interval))
+    return analyse_interval, None
+
+
+def histogram_time(task_id, chart, record_type, start_time, end_time, interval, bucket_value, aggs=None):
+    """The buckets of a time chart (a plan), see analysis.timed.
+
+    If the rollups are enabled, the buckets are computed from the coarsest rollup which fits the
+    interval, a long range interval is rounded up to a multiple of the rollup granularity.
+
+    :param bucket_value: the function computes the (cached) value of an ES histogram bucket
+    :return: [(bucket key, bucket value)]
+    """
+    analyse_interval, granularity = get_analyse_interval(start_time, end_time, interval)
+    bucket_cache = timed.BucketCache(task_id, chart, start_time, end_time, analyse_interval)
+    missed_range = bucket_cache.missed_range()
+    if missed_range is not None:
+        bucket_start, bucket_end = missed_range
+        if granularity is None:
+            es_condition = get_es_histogram_query(task_id, record_type, bucket_start, bucket_end,
+                                                  analyse_interval, aggs)
+            res = yield task_search(es_condition, task_id, bucket_start, bucket_end)
+        else:
+            es_condition = rollup.get_rollup_histogram_query(task_id, record_type, granularity,
+                                                             bucket_start, bucket_end, analyse_interval, aggs)
+            res = yield Search(es_condition, size=0, app='benchmark_rollup')
+        analyse_data = res.get('aggregations', {}).get('histogram_datas', {}).get('buckets', [])
+        if granularity is not None:
+            analyse_data = [rollup.from_rollup_bucket(record, aggs or {}) for record in analyse_data]
+        bucket_cache.update(dict((record.get('key'), bucket_value(record)) for record in analyse_data))
+
+    return bucket_cache.result()
+
+
+def percentile_time(task_id, chart, record_type, field, start_time, end_time, interval):
+    """The percentiles (PERCENTS) of a latency metric over time (a plan).
+
+    The records are aggregated by the percentiles aggregation of ES, the rollups by merging the
+    DDSketch of the documents in a bucket (scanned, not batched).
+    :return: [(bucket key, {'p50': value, ...})]
+    """
+    analyse_interval, granularity = get_analyse_interval(start_time, end_time, interval)
+    bucket_cache = timed.BucketCache(task_id, chart, start_time, end_time, analyse_interval)
+    missed_range = bucket_cache.missed_range()
+    if missed_range is None:
+        return bucket_cache.result()
+
+    def percentile_values(quantile):
+        return dict(('p{}'.format(percent), quantile(percent)) for percent in PERCENTS)
+
+    bucket_start, bucket_end = missed_range
+    buckets = {}
+    if granularity is None:
+        es_condition = get_es_histogram_query(task_id, record_type, bucket_start, bucket_end,
+                                              analyse_interval, {
+                                                  'percentiles': {
+                                                      'percentiles': {'field': field, 'percents': PERCENTS}
+                                                  }
+                                              })
+        res = yield task_search(es_condition, task_id, bucket_start, bucket_end)
+        analyse_data = res.get('aggregations', {}).get('histogram_datas', {}).get('buckets', [])
+        for record in analyse_data:
+            values = record.get('percentiles', {}).get('values', {})
+            buckets[record.get('key')] = percentile_values(lambda percent: values.get('{:.1f}'.format(percent)))
+    else:
+        sketch_field = '{}_sketch'.format(field)
+        sketches = dict((key, DDSketch()) for key in range(bucket_start, bucket_end, analyse_interval))
+        for document in rollup.scan_rollups(task_id, record_type, granularity, bucket_start, bucket_end,
+                                            [sketch_field]):
+            key = document.get('bucket_time') // analyse_interval * analyse_interval
+            sketches[key].merge(DDSketch.from_dict(document.get(sketch_field)))
+        for key, sketch in sketches.items():
+            buckets[key] = percentile_values(lambda percent: sketch.quantile(percent / 100.0))
+
+    bucket_cache.update(buckets)
+    return bucket_cache.result()
+
+
+def distinct_region(task_id, record_type, name, start_time, end_time, interval):
+    """The distinct count of the values (DISTINCT_FIELDS) by province (a plan).
+
+    The records are aggregated by the cardinality aggregation of ES, the rollups by merging the
+    HyperLogLog of the documents, the window is extended to the whole rollup buckets.
+    """
+    _, granularity = get_analyse_interval(start_time, end_time, interval)
+
+    if granularity is None:
+        es_condition = {
+            'query': {
+                'bool': {
+                    'must': [
+                        {'term': {'_type': record_type}},
+                        {'term': {TASK_FIELD: str(task_id)}},
+                        {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
+                    ]
+                }
+            },
+            'aggs': {
+                'bucket_aggs': {
+                    'terms': {
+                        'field': REGION_FIELD,
+                        'size': 1000
+                    },
+                    'aggs': {
+                        'distinct_count': {
+                            'cardinality': {'field': DISTINCT_FIELDS[name]}
+                        }
+                    }
+                }
+            },
+        }
+        res = yield task_search(es_condition, task_id, start_time, end_time)
+        analyse_data = res.get('aggregations', {}).get('bucket_aggs', {}).get('buckets', [])
+        return [{
+            'name': record.get('key'),
+            'value': record.get('distinct_count', {}).get('value')
+        } for record in analyse_data]
+
+    length = dict(rollup.ROLLUP_GRANULARITIES)[granularity]
+    hll_field = '{}_hll'.format(name)
+    provinces = {}
+    for document in rollup.scan_rollups(task_id, record_type, granularity,
+                                        start_time // length * length, end_time // length * length + length,
+                                        ['province', hll_field]):
+        province = document.get('province')
+        if province not in provinces:
+            provinces[province] = HyperLogLog()
+        provinces[province].merge(HyperLogLog.from_dict(document.get(hll_field)))
+
+    analyse_values = [{'name': province, 'value': hll.count()} for province, hll in provinces.items()]
+    analyse_values.sort(key=lambda value: -value['value'])
+    return analyse_values
+
 
+def histogram_lines(buckets, names):
+    x_axis = [key for key, _ in buckets]
+    lines = [{
+        'name': name,
+        'values': [(value or {}).get(name) for _, value in buckets]
+    } for name in names]
+    return x_axis, lines
+
+
+def percentile_lines(buckets):
+    return histogram_lines(buckets, ['p{}'.format(percent) for percent in PERCENTS])
+
+
+def exception_time(task_id, chart, start_time, end_time, interval):
+    buckets = yield from histogram_time(task_id, chart, 'error', start_time, end_time, interval,
+                                        es_exception_bucket, EXCEPTION_AGGS)
+    return es_exception_extract(buckets)
 
-def ping_loss_region(task_id, start_time, end_time):
+
+def ping_loss_region(task_id, start_time, end_time, field=REGION_FIELD):
 
     es_condition = {
         'query': {
             'bool': {
                 'must': [
                     {'term': {'_type': 'ping'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
@@ -88,7 +415,7 @@ def ping_loss_region(task_id, start_time, end_time):
         'aggs': {
             'bucket_aggs': {
                 'terms': {
-                    'field': 'province.keyword',
+                    'field': field,
                     'size': 1000
                 },
                 'aggs': {
@@ -105,7 +432,7 @@ def ping_loss_region(task_id, start_time, end_time):
             }
         },
     }
-    res = origin_search(body=es_condition, size=0)
+    res = yield task_search(es_condition, task_id, start_time, end_time)
 
     analyse_data = res.get('aggregations', {}).get('bucket_aggs').get('buckets')
 
@@ -122,13 +449,13 @@ def ping_loss_region(task_id, start_time, end_time):
     return analyse_values
 
 
-def ping_delay_region(task_id, start_time, end_time):
+def ping_delay_region(task_id, start_time, end_time, field=REGION_FIELD):
     es_condition = {
         'query': {
             'bool': {
                 'must': [
                     {'term': {'_type': 'ping'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
@@ -136,7 +463,7 @@ def ping_delay_region(task_id, start_time, end_time):
         'aggs': {
             'bucket_aggs': {
                 'terms': {
-                    'field': 'province.keyword',
+                    'field': field,
                     'size': 1000
                 },
                 'aggs': {
@@ -147,7 +474,7 @@ def ping_delay_region(task_id, start_time, end_time):
             }
         },
     }
-    res = origin_search(body=es_condition, size=0)
+    res = yield task_search(es_condition, task_id, start_time, end_time)
 
     analyse_data = res.get('aggregations', {}).get('bucket_aggs').get('buckets')
 
@@ -163,144 +490,56 @@ def ping_delay_region(task_id, start_time, end_time):
     return analyse_values
 
 
-def ping_loss_time(task_id, start_time, end_time, interval):
-
-    analyse_interval = get_interval(start_time, end_time, interval)
-
-    es_condition = {
-        'query': {
-            'bool': {
-                'must': [
-                    {'term': {'_type': 'ping'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
-                    {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
-                ]
-            }
-        },
-        'aggs': {
-            'histogram_datas': {
-                'date_histogram': {
-                    'field': 'task_generate_time',
-                    'interval': analyse_interval,
-                    'extended_bounds': {
-                        'min': start_time,
-                        'max': end_time
-                    }
-                },
-                'aggs': {
-                    'sum_loss': {
-                        'sum': {'field': 'packet_loss'}
-                    },
-                    'sum_send': {
-                        'sum': {'field': 'packet_send'}
-                    }
-                }
-            }
-        },
-    }
-    res = origin_search(body=es_condition, size=0)
-
-    analyse_data = res.get('aggregations', {}).get('histogram_datas').get('buckets')
+def ping_loss_bucket(record):
+    sum_loss = record.get('sum_loss').get('value')
+    sum_send = record.get('sum_send').get('value')
+    return {'packet_loss': (sum_loss / sum_send if sum_send else 0.0) * 100}
 
-    loss_values = []
-    x_axis = []
-    for record in analyse_data:
-        key = record.get('key')
-        sum_loss = record.get('sum_loss').get('value')
-        sum_send = record.get('sum_send').get('value')
-        x_axis.append(key)
-        loss_values.append((sum_loss / sum_send if sum_send else 0.0) * 100)
 
-    lines = [
-        {
-            'name': 'packet_loss',
-            'values': loss_values
-        }
-    ]
-    return x_axis, lines
+def ping_loss_time(task_id, start_time, end_time, interval):
 
+    buckets = yield from histogram_time(task_id, 'ping_loss_time', 'ping', start_time, end_time, interval,
+                                        ping_loss_bucket, {
+                                            'sum_loss': {
+                                                'sum': {'field': 'packet_loss'}
+                                            },
+                                            'sum_send': {
+                                                'sum': {'field': 'packet_send'}
+                                            }
+                                        })
 
-def ping_delay_time(task_id, start_time, end_time, interval):
+    return histogram_lines(buckets, ['packet_loss'])
 
-    analyse_interval = get_interval(start_time, end_time, interval)
 
-    es_condition = {
-        'query': {
-            'bool': {
-                'must': [
-                    {'term': {'_type': 'ping'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
-                    {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
-                ]
-            }
-        },
-        'aggs': {
-            'histogram_datas': {
-                'date_histogram': {
-                    'field': 'task_generate_time',
-                    'interval': analyse_interval,
-                    'extended_bounds': {
-                        'min': start_time,
-                        'max': end_time
-                    }
-                },
-                'aggs': {
-                    'avg_avgtime': {
-                        'avg': {'field': 'avg_time'}
-                    },
-                    'avg_mintime': {
-                        'avg': {'field': 'min_time'}
-                    },
-                    'avg_maxtime': {
-                        'avg': {'field': 'max_time'}
-                    }
-                }
-            }
-        },
+def ping_delay_bucket(record):
+    return {
+        'avg_value': record.get('avg_avgtime').get('value'),
+        'min_value': record.get('avg_mintime').get('value'),
+        'max_value': record.get('avg_maxtime').get('value')
     }
-    res = origin_search(body=es_condition, size=0)
 
-    analyse_data = res.get('aggregations', {}).get('histogram_datas').get('buckets')
 
-    avg_values = []
-    min_values = []
-    max_values = []
-    x_axis = []
-    for record in analyse_data:
-        key = record.get('key')
-        avg_time = record.get('avg_avgtime').get('value')
-        min_time = record.get('avg_mintime').get('value')
-        max_time = record.get('avg_maxtime').get('value')
+def ping_delay_time(task_id, start_time, end_time, interval):
 
-        x_axis.append(key)
-        avg_values.append(avg_time)
-        min_values.append(min_time)
-        max_values.append(max_time)
+    buckets = yield from histogram_time(task_id, 'ping_delay_time', 'ping', start_time, end_time, interval,
+                                        ping_delay_bucket, {
+                                            'avg_avgtime': {
+                                                'avg': {'field': 'avg_time'}
+                                            },
+                                            'avg_mintime': {
+                                                'avg': {'field': 'min_time'}
+                                            },
+                                            'avg_maxtime': {
+                                                'avg': {'field': 'max_time'}
+                                            }
+                                        })
 
-    lines = [
-        {
-            'name': 'avg_value',
-            'values': avg_values
-        },
-        {
-            'name': 'min_value',
-            'values': min_values
-        },
-        {
-            'name': 'max_value',
-            'values': max_values
-        }
-    ]
-    return x_axis, lines
+    return histogram_lines(buckets, ['avg_value', 'min_value', 'max_value'])
 
 
 def ping_exception_time(task_id, start_time, end_time, interval):
 
-    analyse_interval = get_interval(start_time, end_time, interval)
-    es_condition = get_es_exception_query(task_id, start_time, end_time, analyse_interval)
-    res = origin_search(body=es_condition, size=0)
-    x_axis, lines = es_exception_extract(res)
-    return x_axis, lines
+    return (yield from exception_time(task_id, 'ping_exception_time', start_time, end_time, interval))
 
 
 def ping_delay_dist(task_id, start_time, end_time, interval=20):
@@ -309,7 +548,7 @@ def ping_delay_dist(task_id, start_time, end_time, interval=20):
             'bool': {
                 'must': [
                     {'term': {'_type': 'ping'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}},
                     {'range': {'avg_time': {'gte': 0}}}
                 ]
@@ -336,7 +575,7 @@ def ping_delay_dist(task_id, start_time, end_time, interval=20):
             }
         },
     }
-    res = origin_search(body=es_condition, size=0)
+    res = yield task_search(es_condition, task_id, start_time, end_time)
 
     analyse_data = {}
 
@@ -411,14 +650,14 @@ def ping_delay_dist(task_id, start_time, end_time, interval=20):
     return x_axis, lines
 
 
-def http_request_region(task_id, start_time, end_time):
+def http_request_region(task_id, start_time, end_time, field=REGION_FIELD):
 
     es_condition = {
         'query': {
             'bool': {
                 'must': [
                     {'term': {'_type': 'http'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
@@ -426,7 +665,7 @@ def http_request_region(task_id, start_time, end_time):
         'aggs': {
             'bucket_aggs': {
                 'terms': {
-                    'field': 'province.keyword',
+                    'field': field,
                     'size': 1000
                 },
                 'aggs': {
@@ -437,7 +676,7 @@ def http_request_region(task_id, start_time, end_time):
             }
         },
     }
-    res = origin_search(body=es_condition, size=0)
+    res = yield task_search(es_condition, task_id, start_time, end_time)
 
     analyse_data = res.get('aggregations', {}).get('bucket_aggs').get('buckets')
 
@@ -454,14 +693,14 @@ def http_request_region(task_id, start_time, end_time):
     return analyse_values
 
 
-def http_parsetime_region(task_id, start_time, end_time):
+def http_parsetime_region(task_id, start_time, end_time, field=REGION_FIELD):
 
     es_condition = {
         'query': {
             'bool': {
                 'must': [
                     {'term': {'_type': 'http'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
@@ -469,7 +708,7 @@ def http_parsetime_region(task_id, start_time, end_time):
         'aggs': {
             'bucket_aggs': {
                 'terms': {
-                    'field': 'province.keyword',
+                    'field': field,
                     'size': 1000
                 },
                 'aggs': {
@@ -480,7 +719,7 @@ def http_parsetime_region(task_id, start_time, end_time):
             }
         },
     }
-    res = origin_search(body=es_condition, size=0)
+    res = yield task_search(es_condition, task_id, start_time, end_time)
 
     analyse_data = res.get('aggregations', {}).get('bucket_aggs').get('buckets')
 
@@ -497,88 +736,37 @@ def http_parsetime_region(task_id, start_time, end_time):
     return analyse_values
 
 
-def http_request_time(task_id, start_time, end_time, interval):
-
-    analyse_interval = get_interval(start_time, end_time, interval)
-
-    es_condition = {
-        'query': {
-            'bool': {
-                'must': [
-                    {'term': {'_type': 'http'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
-                    {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
-                ]
-            }
-        },
-        'aggs': {
-            'histogram_datas': {
-                'date_histogram': {
-                    'field': 'task_generate_time',
-                    'interval': analyse_interval,
-                    'extended_bounds': {
-                        'min': start_time,
-                        'max': end_time
-                    }
-                },
-                'aggs': {
-                    'avg_total': {
-                        'avg': {'field': 'total_time'}
-                    },
-                    'avg_nslookup': {
-                        'avg': {'field': 'period_nslookup'}
-                    },
-                    'avg_tcp': {
-                        'avg': {'field': 'period_tcp_connect'}
-                    },
-                }
-            }
-        },
+def http_request_bucket(record):
+    return {
+        'namelookup_time': record.get('avg_nslookup').get('value'),
+        'period_tcp_connect': record.get('avg_tcp').get('value'),
+        'total_time': record.get('avg_total').get('value')
     }
-    res = origin_search(body=es_condition, size=0)
-
-    analyse_data = res.get('aggregations', {}).get('histogram_datas').get('buckets')
 
-    total_values = []
-    nslookup_values = []
-    tcp_values = []
-    x_axis = []
-    for record in analyse_data:
-        key = record.get('key')
-        x_axis.append(key)
-        total_values.append(record.get('avg_total').get('value'))
-        nslookup_values.append(record.get('avg_nslookup').get('value'))
-        tcp_values.append(record.get('avg_tcp').get('value'))
 
+def http_request_time(task_id, start_time, end_time, interval):
 
-    lines = [
-        {
-            'name': 'namelookup_time',
-            'values': nslookup_values
-        },
-        {
-            'name': 'period_tcp_connect',
-            'values': tcp_values
-        },
-        {
-            'name': 'total_time',
-            'values': total_values
-        }
-    ]
+    buckets = yield from histogram_time(task_id, 'http_request_time', 'http', start_time, end_time, interval,
+                                        http_request_bucket, {
+                                            'avg_total': {
+                                                'avg': {'field': 'total_time'}
+                                            },
+                                            'avg_nslookup': {
+                                                'avg': {'field': 'period_nslookup'}
+                                            },
+                                            'avg_tcp': {
+                                                'avg': {'field': 'period_tcp_connect'}
+                                            },
+                                        })
 
-    return x_axis, lines
+    return histogram_lines(buckets, ['namelookup_time', 'period_tcp_connect', 'total_time'])
 
 
 # STATISTIC http status code
-def http_exception_time(task_id, start_time, end_time, interval):
 
-    analyse_interval = get_interval(start_time, end_time, interval)
+def http_exception_time(task_id, start_time, end_time, interval):
 
-    es_condition = get_es_exception_query(task_id, start_time, end_time, analyse_interval)
-    res = origin_search(body=es_condition, size=0)
-
-    x_axis, lines = es_exception_extract(res)
-    return x_axis, lines
+    return (yield from exception_time(task_id, 'http_exception_time', start_time, end_time, interval))
 
 
 def http_result_dist(task_id, start_time, end_time):
@@ -588,7 +776,7 @@ def http_result_dist(task_id, start_time, end_time):
             'bool': {
                 'must': [
                     {'term': {'_type': 'http'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
@@ -602,15 +790,12 @@ def http_result_dist(task_id, start_time, end_time):
             }
         },
     }
-    res = origin_search(body=httperror_condition, size=0)
-    http_analyse_data = res.get('aggregations', {}).get('bucket_aggs', {}).get('buckets', [])
-
     error_condition = {
         'query': {
             'bool': {
                 'must': [
                     {'term': {'_type': 'error'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
@@ -624,8 +809,11 @@ def http_result_dist(task_id, start_time, end_time):
             }
         },
     }
-    res = origin_search(body=error_condition, size=0)
-    error_analyse_data = res.get('aggregations', {}).get('bucket_aggs', {}).get('buckets', [])
+    # both searches in one round
+    http_res, error_res = yield [task_search(httperror_condition, task_id, start_time, end_time),
+                                 task_search(error_condition, task_id, start_time, end_time)]
+    http_analyse_data = http_res.get('aggregations', {}).get('bucket_aggs', {}).get('buckets', [])
+    error_analyse_data = error_res.get('aggregations', {}).get('bucket_aggs', {}).get('buckets', [])
 
     analyse_values = []
     for record in http_analyse_data:
@@ -653,7 +841,7 @@ def http_stage_dist(task_id, start_time, end_time):
             'bool': {
                 'must': [
                     {'term': {'_type': 'http'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
@@ -679,7 +867,7 @@ def http_stage_dist(task_id, start_time, end_time):
             },
         },
     }
-    res = origin_search(body=es_condition, size=0)
+    res = yield task_search(es_condition, task_id, start_time, end_time)
 
     analyse_data = res.get('aggregations', {})
 
@@ -696,14 +884,14 @@ def http_stage_dist(task_id, start_time, end_time):
     return analyse_values
 
 
-def dns_parsetime_region(task_id, start_time, end_time):
+def dns_parsetime_region(task_id, start_time, end_time, field=REGION_FIELD):
 
     es_condition = {
         'query': {
             'bool': {
                 'must': [
                     {'term': {'_type': 'dns'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
@@ -711,7 +899,7 @@ def dns_parsetime_region(task_id, start_time, end_time):
         'aggs': {
             'bucket_aggs': {
                 'terms': {
-                    'field': 'province.keyword',
+                    'field': field,
                     'size': 1000
                 },
                 'aggs': {
@@ -722,7 +910,7 @@ def dns_parsetime_region(task_id, start_time, end_time):
             }
         },
     }
-    res = origin_search(body=es_condition, size=0)
+    res = yield task_search(es_condition, task_id, start_time, end_time)
 
     analyse_data = res.get('aggregations', {}).get('bucket_aggs').get('buckets')
 
@@ -746,13 +934,13 @@ def dns_parseresult_region(task_id, start_time, end_time):
             'bool': {
                 'must': [
                     {'term': {'_type': 'dns'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
+                    {'term': {TASK_FIELD: str(task_id)}},
                     {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
                 ]
             }
         }
     }
-    res = origin_search(body=es_condition, size=1000)
+    res = yield task_search(es_condition, task_id, start_time, end_time, size=1000)
 
     analyse_data = res.get('hits', {}).get('hits', [])
 
@@ -769,67 +957,78 @@ def dns_parseresult_region(task_id, start_time, end_time):
     return [{'name': city, 'value': value} for city, value in analyse_st.items()]
 
 
+def dns_parsetime_bucket(record):
+    return {'parse_time': record.get('avg_parsetime').get('value')}
+
+
 def dns_parsetime_time(task_id, start_time, end_time, interval):
 
-    analyse_interval = get_interval(start_time, end_time, interval)
+    buckets = yield from histogram_time(task_id, 'dns_parsetime_time', 'dns', start_time, end_time, interval,
+                                        dns_parsetime_bucket, {
+                                            'avg_parsetime': {
+                                                'avg': {'field': 'ptime'}
+                                            }
+                                        })
 
-    es_condition = {
-        'query': {
-            'bool': {
-                'must': [
-                    {'term': {'_type': 'dns'}},
-                    {'term': {'task_id.keyword': str(task_id)}},
-                    {'range': {'task_generate_time': {'gte': start_time, 'lte': end_time}}}
-                ]
-            }
-        },
-        'aggs': {
-            'histogram_datas': {
-                'date_histogram': {
-                    'field': 'task_generate_time',
-                    'interval': analyse_interval,
-                    'extended_bounds': {
-                        'min': start_time,
-                        'max': end_time
-                    }
-                },
-                'aggs': {
-                    'avg_parsetime': {
-                        'avg': {'field': 'ptime'}
-                    }
+    return histogram_lines(buckets, ['parse_time'])
 
-                }
-            }
-        },
-    }
-    res = origin_search(body=es_condition, size=0)
 
-    analyse_data = res.get('aggregations', {}).get('histogram_datas').get('buckets')
+def dns_exception_time(task_id, start_time, end_time, interval):
 
-    avg_values = []
-    x_axis = []
-    for record in analyse_data:
-        key = record.get('key')
-        avg_time = record.get('avg_parsetime').get('value')
+    return (yield from exception_time(task_id, 'dns_exception_time', start_time, end_time, interval))
 
-        x_axis.append(key)
-        avg_values.append(avg_time)
 
-    lines = [
-        {
-            'name': 'parse_time',
-            'values': avg_values
-        },
-    ]
+def ping_delay_percentile_time(task_id, start_time, end_time, interval):
 
-    return x_axis, lines
+    buckets = yield from percentile_time(task_id, 'ping_delay_percentile_time', 'ping', 'avg_time',
+                                         start_time, end_time, interval)
+    return percentile_lines(buckets)
 
 
-def dns_exception_time(task_id, start_time, end_time, interval):
+def http_request_percentile_time(task_id, start_time, end_time, interval):
 
-    analyse_interval = get_interval(start_time, end_time, interval)
+    buckets = yield from percentile_time(task_id, 'http_request_percentile_time', 'http', 'total_time',
+                                         start_time, end_time, interval)
+    return percentile_lines(buckets)
 
-    es_condition = get_es_exception_query(task_id, start_time, end_time, analyse_interval)
-    res = origin_search(body=es_condition, size=0)
-    x_axis, lines = es_exception_extract(res)
-    return x_axis, lines
+
+def dns_parsetime_percentile_time(task_id, start_time, end_time, interval):
+
+    buckets = yield from percentile_time(task_id, 'dns_parsetime_percentile_time', 'dns', 'ptime',
+                                         start_time, end_time, interval)
+    return percentile_lines(buckets)
+
+
+def http_remoteip_region(task_id, start_time, end_time, interval):
+
+    return (yield from distinct_region(task_id, 'http', 'remote_ip', start_time, end_time, interval))
+
+
+def dns_resolvedip_region(task_id, start_time, end_time, interval):
+
+    return (yield from distinct_region(task_id, 'dns', 'resolved_ip', start_time, end_time, interval))
+
+
+def ping_loss_organization(task_id, start_time, end_time):
+
+    return (yield from ping_loss_region(task_id, start_time, end_time, field=ORGANIZATION_FIELD))
+
+
+def ping_delay_organization(task_id, start_time, end_time):
+
+    return (yield from ping_delay_region(task_id, start_time, end_time, field=ORGANIZATION_FIELD))
+
+
+def http_request_organization(task_id, start_time, end_time):
+
+    return (yield from http_request_region(task_id, start_time, end_time, field=ORGANIZATION_FIELD))
+
+
+def http_parsetime_organization(task_id, start_time, end_time):
+
+    return (yield from http_parsetime_region(task_id, start_time, end_time, field=ORGANIZATION_FIELD))
+
+
+def dns_parsetime_organization(task_id, start_time, end_time):
+
+    return (yield from dns_parsetime_region(task_id, start_time, end_time, field=ORGANIZATION_FIELD))
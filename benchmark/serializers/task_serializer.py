@@ -19,7 +19,7 @@ from natrix.common.natrix_views.fields import SchemeURLField
 from natrix.common import exception as natrix_exception
 from benchmark.models.task_models import Task, Command, Schedule, FollowedTask
 from benchmark.models.task_models import (PROTOCOL_CHOICES, SCOPE_CHOICES)
-from benchmark.backends.command_dispatcher import dispatch_command
+from benchmark.backends.command_dispatcher import dispatch_internal_command
 from benchmark.backends import celery_api
 from benchmark.terminalutil import terminal_policy
 from benchmark.tasks import timed_task_process
@@ -406,7 +406,7 @@ class InstantTaskSerializer(NatrixSerializer):
             distribute_data = task.task_command_represent()
 
             try:
-                res = dispatch_command(distribute_data)
+                res = dispatch_internal_command(distribute_data)
             except Exception as e:
                 logger.error(e)
                 natrix_exception.natrix_traceback()
@@ -71,7 +71,8 @@ def command_clean_processor(self):
     """
     logger.info('Start to clean unresponse command')
     try:
-        response_expired_process(freshness=command_timeout)
+        stats = response_expired_process(freshness=command_timeout)
+        logger.info('Clean unresponse command: scanned {scanned}, expired {expired}'.format(**stats))
     except Exception as e:
         # TODO:
         logger.error(u'{}'.format(e))
@@ -6,13 +6,20 @@ from celery import task
 from celery.utils import log
 
 from natrix.common import exception as natrix_exception
+from natrix.common.config import natrix_config as config
 from benchmark.backends.command_dispatcher import processor
 from benchmark.backends.command_dispatcher.channels.mqtt import MQTTDispachClient
 
 logger = log.get_task_logger(__name__)
 
 
-__all__ = ['command_response_task', 'command_response_processor']
+__all__ = ['command_response_task', 'command_response_batch_task', 'command_response_processor']
+
+CONFIG_TOPIC = 'BENCHMARK'
+
+# Batch ingestion: collect responses for up to batch_size messages or batch_interval ms.
+response_batch_size = int(config.get_value(CONFIG_TOPIC, 'response_batch_size'))
+response_batch_interval = int(config.get_value(CONFIG_TOPIC, 'response_batch_interval'))
 
 
 @task(bind=True)
@@ -28,6 +35,19 @@ def command_response_task(self, data):
         logger.error('Get an expected Exception: {}'.format(e))
 
 
+@task(bind=True)
+def command_response_batch_task(self, data_list):
+    try:
+        command_processor = processor.ResponseBatchProcessor(data_list)
+        command_processor.process()
+    except natrix_exception.NatrixBaseException as e:
+        natrix_exception.natrix_traceback()
+        logger.error('Consume reponse batch error: {}'.format(e.get_log()))
+    except Exception as e:
+        natrix_exception.natrix_traceback()
+        logger.error('Get an expected Exception: {}'.format(e))
+
+
 @task(bind=True)
 def command_response_processor(self):
     """Process Terminal Response
@@ -36,5 +56,10 @@ def command_response_processor(self):
     """
     with MQTTDispachClient() as client:
         print('start process response: {}'.format(client))
-        client.response_subscribe(celery_task=command_response_task)
+        if response_batch_size > 1:
+            client.response_subscribe(celery_task=command_response_batch_task,
+                                      batch_size=response_batch_size,
+                                      batch_interval=response_batch_interval)
+        else:
+            client.response_subscribe(celery_task=command_response_task)
 
@@ -6,9 +6,10 @@ from celery import shared_task
 from celery.utils import log
 
 from natrix.common import natrix_celery, exception as natrix_exception
+from natrix.common.config import natrix_config
 
 from benchmark.models import Task
-from benchmark.backends.command_dispatcher import dispatch_command
+from benchmark.backends.command_dispatcher import dispatch_internal_command
 
 from benchmark.services import *
 
@@ -16,7 +17,26 @@ from benchmark.services import *
 logger = log.get_task_logger(__name__)
 
 DEAD_PROCESSOR_COUNT = 1
-RESPONSE_PROCESSOR_COUNT = 1
+RESPONSE_PROCESSOR_COUNT = int(natrix_config.get_value('MQTT', 'response_consumers'))
+
+
+def _keep_processors(app, name, processors, total):
+    """Revoke the exceeded processors, and count the missing processors.
+
+    :param processors: a list of task id, the active or reserved processors across nodes
+    :return: the number of processors to start
+    """
+    logger.info('There are {alive}/{total} [{name}] alive.'.format(
+        alive=len(processors), total=total, name=name))
+
+    if len(processors) > total:
+        logger.error(u'The [{}]({}) exceed, revoke {}.'.format(
+            name, len(processors), len(processors) - total))
+        for task_id in processors[total:]:
+            app.control.revoke(task_id, terminate=True)
+        return 0
+
+    return total - len(processors)
 
 
 @shared_task(bind=True)
@@ -24,37 +44,35 @@ def command_adapter_guardian(self):
     """Command Adapter Guardian
 
     This task must ensure that DEAD_PROCESOR_COUNT command_dead_processor tasks and
-    RESPONSE_PROCESSOR_COUNT command_response_processor tasks are alive(active).
+    RESPONSE_PROCESSOR_COUNT command_response_processor tasks are alive(active) across all
+    celery nodes. The response processors split responses with MQTT shared subscription.
 
     :return:
     """
-    dead_processor_num = DEAD_PROCESSOR_COUNT
-    response_processor_num = RESPONSE_PROCESSOR_COUNT
-
-    info = self.app.control.inspect().active()
-
-    if info:
+    processors = {
+        command_dead_processor.name: [],
+        command_response_processor.name: []
+    }
+
+    inspect = self.app.control.inspect()
+    # reserved processors are received by workers but not started yet
+    for info in (inspect.active(), inspect.reserved()):
+        if not info:
+            continue
         for node, worker_list in info.items():
             for task_info in worker_list:
-                if task_info['name'] == command_dead_processor.name:
-                    dead_processor_num -= 1
-                elif task_info['name'] == command_response_processor.name:
-                    response_processor_num -= 1
-
-    if dead_processor_num < 0 or response_processor_num < 0:
-        logger.error(u'The [command_dead_processor]({}) or [command_response_processor]({}) exceed.'.format(
-            dead_processor_num, response_processor_num
-        ))
-
-    #
-    logger.info('There are {alive}/{total} [command_dead_processor] alive.'.format(
-        alive=DEAD_PROCESSOR_COUNT-dead_processor_num, total=DEAD_PROCESSOR_COUNT))
+                if task_info['name'] in processors:
+                    processors[task_info['name']].append(task_info['id'])
+
+    dead_processor_num = _keep_processors(self.app, command_dead_processor.name,
+                                          processors[command_dead_processor.name],
+                                          DEAD_PROCESSOR_COUNT)
     for _ in range(dead_processor_num):
         command_dead_processor.apply_async()
 
-    #
-    logger.info('There are {alive}/{total} [command_response_processor] alive.'.format(
-        alive=RESPONSE_PROCESSOR_COUNT - response_processor_num, total=RESPONSE_PROCESSOR_COUNT))
+    response_processor_num = _keep_processors(self.app, command_response_processor.name,
+                                              processors[command_response_processor.name],
+                                              RESPONSE_PROCESSOR_COUNT)
     for _ in range(response_processor_num):
         command_response_processor.apply_async()
 
@@ -83,7 +101,7 @@ def timed_task_process(self, frequency=0):
     for task in tasks:
         if task.schedule.is_alive():
             logger.debug('Process {} task'.format(task.id))
-            res = dispatch_command(task.task_command_represent())
+            res = dispatch_internal_command(task.task_command_represent())
             logger.debug('Dispatch timed-task result: {}'.format(res))
         else:
             logger.debug('Timed task{} is expired or turn-off'.format(str(task.id)))
@@ -5,17 +5,65 @@
 from __future__ import unicode_literals
 import logging
 
+from natrix.common.config import natrix_config
 from terminal.api.exports import terminalapi
 
 logger = logging.getLogger(__name__)
 
+CONFIG_TOPIC = 'BENCHMARK'
+# Publish a command once to a group topic (natrix/benchmark/region/{province} or
+# natrix/benchmark/org/{id}) if the selected terminals are a whole group.
+DISPATCH_FANOUT = natrix_config.get_value(CONFIG_TOPIC, 'dispatch_fanout').upper() == 'TRUE'
+DISPATCH_FANOUT_THRESHOLD = int(natrix_config.get_value(CONFIG_TOPIC, 'dispatch_fanout_threshold'))
+
+
+def fanout_policy(switch, conditions, terminals):
+    """Choose the fan-out group of the selected terminals.
+
+    Only a region (province) or organization filter can be a group, and the selected terminals
+    must be exactly all available terminals of the group.
+
+    :return: {'type': 'region', 'value': 'province'} or None (dispatch to each terminal)
+    """
+    if not (DISPATCH_FANOUT and switch) or len(terminals) < DISPATCH_FANOUT_THRESHOLD:
+        return None
+    if conditions.get('terminal_select'):
+        return None
+
+    filter_type = conditions.get('filter_type')
+    filter_condition = conditions.get('filter_condition') or []
+    if filter_type == 'region':
+        if len(filter_condition) == 0 or filter_condition[0] == 'all':
+            return None
+        if len(filter_condition) > 1 and filter_condition[1] != 'all':
+            return None
+        group_type, value = 'region', filter_condition[0]
+    elif filter_type == 'organization':
+        # The same root as terminal organization filter
+        group_type = 'organization'
+        value = filter_condition[-2] if len(filter_condition) >= 2 else 1
+    else:
+        return None
+
+    try:
+        group_terminals = terminalapi.TerminalAPI.get_group_terminals(group_type, value)
+    except Exception as e:
+        logger.error('Get terminals of group ({}-{}) with error: {}'.format(group_type, value, e))
+        return None
+
+    if group_terminals != set(t['mac'] for t in terminals):
+        return None
+
+    return {'type': group_type, 'value': str(value)}
+
 
 # TODO: test
-def terminal_policy(switch, conditions=None, group=None):
+def terminal_policy(switch, conditions=None, group=None, fanout=False):
     """
 
     :param switch:
     :param conditions:
+    :param fanout: return the fan-out group with terminals, (terminals, fanout_group)
     :return:
     """
     terminals = []
@@ -42,4 +90,7 @@ def terminal_policy(switch, conditions=None, group=None):
             for item in filter_terminals:
                 terminals.append(item.address_info())
 
+    if fanout:
+        return terminals, fanout_policy(switch, conditions, terminals)
+
     return terminals
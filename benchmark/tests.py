@@ -1,6 +1,24 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from benchmark import tasks
+
+
+class KeepProcessorsTestCase(SimpleTestCase):
+
+    def test_missing(self):
+        app = mock.Mock()
+        self.assertEqual(tasks._keep_processors(app, 'processor', ['a'], 3), 2)
+        self.assertEqual(tasks._keep_processors(app, 'processor', ['a', 'b', 'c'], 3), 0)
+        app.control.revoke.assert_not_called()
+
+    def test_exceeded(self):
+        app = mock.Mock()
+        self.assertEqual(tasks._keep_processors(app, 'processor', ['a', 'b', 'c', 'd'], 2), 0)
+        # the processors beyond the configured count are revoked
+        self.assertEqual(app.control.revoke.call_args_list,
+                         [mock.call('c', terminate=True), mock.call('d', terminate=True)])
@@ -1,32 +1,125 @@
+"""Benchmark events.
 
+An event is a slotted object of a protocol type, the fields are the same as the properties of
+benchmark_command_mapping (common part and the protocol part). The response pipeline builds an
+event once from the validated response, and it's serialized to a dict only at the store
+boundary (to_record). An unset field isn't included in the record.
 
-class BaseEvent:
-    def __init__(self, command_uuid: str, command_generate_time: float, task_id, task_generate_time,
-                 terminal, organization_id, organization_name, organization_isp, province, city,
-                 terminal_request_receive_time, terminal_request_send_time,
-                 terminal_response_receive_time, terminal_response_return_time, response_process_time):
-        self.command_uuid = command_uuid
-        self.command_generate_time = command_generate_time
-        self.task_id = task_id
-        self.task_generate_time = task_generate_time
-        self.terminal = terminal
-        self.organization_id = organization_id
-        self.organization_name = organization_name
-        self.organization_isp = organization_isp
-        self.province = province
-        self.city = city
-        self.terminal_request_receive_time = terminal_request_receive_time
-        self.terminal_request_send_time = terminal_request_send_time
-        self.terminal_response_receive_time = terminal_response_receive_time
-        self.terminal_response_return_time = terminal_response_return_time
-        self.response_process_time = response_process_time
+"""
+from operator import attrgetter
+
+
+class BaseEvent(object):
+    """The common part of benchmark events.
+
+    """
+    __slots__ = (
+        # command info
+        'command_uuid', 'command_generate_time', 'task_id', 'task_generate_time',
+        # terminal info, organization_id/organization_name are the terminal organization ancestry
+        'terminal', 'province', 'city', 'organization_id', 'organization_name',
+        # timestamp info (millisecond)
+        'terminal_request_receive_time', 'terminal_request_send_time',
+        'terminal_response_receive_time', 'terminal_response_return_time', 'response_process_time',
+    )
+    event_type = None
+    fields = __slots__
+    _get_fields = attrgetter(*__slots__)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.fields = cls.fields + cls.__dict__.get('__slots__', ())
+        cls._get_fields = attrgetter(*cls.fields)
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def update(self, data):
+        for name, value in data.items():
+            setattr(self, name, value)
+
+    def set_task(self, task_info):
+        self.task_id = task_info.get('task_id', None)
+        self.task_generate_time = int(task_info.get('task_generate_time', 0) * 1000)
+
+    def copy(self):
+        event = self.__class__.__new__(self.__class__)
+        for name in self.fields:
+            try:
+                setattr(event, name, getattr(self, name))
+            except AttributeError:
+                pass
+        return event
+
+    def to_dict(self):
+        return self._dump({})
+
+    def to_record(self):
+        """The store record, a dict with '_type'.
+
+        """
+        return self._dump({'_type': self.event_type})
+
+    def _dump(self, record):
+        try:
+            # all fields are set, the common case
+            record.update(zip(self.fields, self._get_fields(self)))
+        except AttributeError:
+            for name in self.fields:
+                try:
+                    record[name] = getattr(self, name)
+                except AttributeError:
+                    pass
+        return record
 
 
 class PingEvent(BaseEvent):
+    __slots__ = ('destination', 'destination_ip', 'destination_location',
+                 'packet_send', 'packet_receive', 'packet_loss', 'packet_size',
+                 'avg_time', 'max_time', 'min_time')
+    event_type = 'ping'
+
+
+class HttpEvent(BaseEvent):
+    __slots__ = ('url', 'last_url', 'status_code', 'redirect_count', 'redirect_time',
+                 'remote_ip', 'remote_location', 'remote_port',
+                 'local_ip', 'local_location', 'local_port',
+                 'total_time', 'period_nslookup', 'period_tcp_connect', 'period_ssl_connect',
+                 'period_request', 'period_response', 'period_transfer',
+                 'size_upload', 'size_download', 'speed_upload', 'speed_download',
+                 'response_header', 'response_body')
+    event_type = 'http'
+
 
-    def __init__(self, destination, destination_ip, destination_location,
-                 packet_send, packet_receive, packet_loss, packet_size):
-        ...
+class DnsEvent(BaseEvent):
+    __slots__ = ('destination', 'ptime', 'dns_server', 'ips')
+    event_type = 'dns'
+
+
+class TracerouteEvent(BaseEvent):
+    __slots__ = ('hop', 'paths')
+    event_type = 'traceroute'
+
+
+class ErrorEvent(BaseEvent):
+    __slots__ = ('errorcode', 'errorinfo')
+    event_type = 'error'
+
+
+class ResponseDiscardEvent(BaseEvent):
+    """A response without task info (the command is expired).
+
+    """
+    __slots__ = ('expired_time', 'dial_data')
+    event_type = 'responseDiscard'
+
+
+EVENT_TYPES = {
+    event_class.event_type: event_class
+    for event_class in (PingEvent, HttpEvent, DnsEvent, TracerouteEvent, ErrorEvent,
+                        ResponseDiscardEvent)
+}
 
 
 # ES mapping
@@ -53,15 +146,13 @@ benchmark_command_mapping = {
             'terminal': {
                 'type': 'keyword'
             },
-            # 'organization_id':{
-            #     'type': 'string',
-            # },
-            # 'organization_name': {
-            #     'type': 'string',
-            # },
-            # 'organization_isp': {
-            #     'type': 'keyword'
-            # },
+            # the organization ancestry of the terminal (arrays)
+            'organization_id': {
+                'type': 'keyword'
+            },
+            'organization_name': {
+                'type': 'keyword'
+            },
             'province': {
                 'type': 'keyword'
             },
@@ -17,5 +17,6 @@ urlpatterns = [
 
     url(r'^timed/task/select/v1$', timed_views.TimedTaskSelect.as_view(), name='timedTaskSelect'),
     url(r'^timed/analyse/v1$', timed_views.TimedTaskAnalyse.as_view(), name='timedTaskAnalyse'),
+    url(r'^timed/analyse/batch/v1$', timed_views.TimedTaskBatchAnalyse.as_view(), name='timedTaskBatchAnalyse'),
 
 ]
\ No newline at end of file
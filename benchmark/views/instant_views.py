@@ -14,7 +14,7 @@ from natrix.common.errorcode import ErrorCode
 
 from benchmark.models import Task
 from benchmark.serializers import task_serializer, analyse_serializer
-from benchmark.backends import command_dispatcher
+from benchmark.backends import command_dispatcher, analysis
 
 logger = logging.getLogger(__name__)
 
@@ -144,16 +144,24 @@ class InstantStatus(NatrixAPIView):
             try:
                 task = Task.objects.get(id=task_id, time_type='instant')
                 # response_count = success + wrong
-                res = command_dispatcher.get_task_data(task.id)
-                success = len(res.get('success'))
-                wrong = len(res.get('error'))
+                if task.status:
+                    counts = command_dispatcher.count_task_data(task.id)
+                    success = counts.get('success')
+                    wrong = counts.get('error')
+                else:
+                    res = json.loads(task.result_snapshot)
+                    success = len(res.get('success'))
+                    wrong = len(res.get('error'))
                 response_count = success + wrong
 
                 time_delta = timezone.now() - task.create_time
 
                 if task.status and ( response_count == task.terminal_count or time_delta.seconds > 120):
+                    counts = analysis.finish_instant_task(task)
+                    success = counts.get('success')
+                    wrong = counts.get('error')
+                    response_count = success + wrong
                     task.status = False
-                    task.result_snapshot = json.dumps(res)
                     task.save()
 
                 feedback['data'] = {
@@ -208,17 +216,18 @@ class InstantStatus(NatrixAPIView):
                 task = Task.objects.get(id=task_id, time_type='instant')
 
                 if task.status:
-                    res = command_dispatcher.get_task_data(task.id)
+                    counts = analysis.finish_instant_task(task)
+                    success = counts.get('success')
+                    wrong = counts.get('error')
                     task.status = False
-                    task.result_snapshot = json.dumps(res)
                     task.save()
                     message = u'Turn off task successfully!'
                 else:
                     message = u'The task is already turned off!'
                     res = json.loads(task.result_snapshot)
+                    success = len(res.get('success'))
+                    wrong = len(res.get('error'))
 
-                success = len(res.get('success'))
-                wrong = len(res.get('error'))
                 response_count = success + wrong
 
                 feedback['data'] = {
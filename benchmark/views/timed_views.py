@@ -381,4 +381,40 @@ class TimedTaskAnalyse(natrix_views.LoginAPIView):
         return JsonResponse(data=feedback)
 
 
+class TimedTaskBatchAnalyse(natrix_views.LoginAPIView):
+    """Analyse several charts of a timed task with one request.
+
+    """
+
+    def post(self, request, format=None):
+        feedback = {
+            'permission': True
+        }
+        try:
+            request_data = request.data
+            serializer = analyse_serializer.TimedTaskBatchAnalyseSerializer(data=request_data,
+                                                                            user=self.get_user(),
+                                                                            group=self.get_group())
+            if serializer.is_valid():
+                analyse_data = serializer.analyse()
+                feedback['data'] = {
+                    'code': 200,
+                    'message': u'Timed task batch analyse data!',
+                    'info': analyse_data
+                }
+            else:
+                logger.info('Timed task batch analyse with error: {}'.format(serializer.format_errors()))
+                feedback['data'] = ErrorCode.parameter_invalid('timed task batch analyse',
+                                                               serializer.format_errors())
+
+        except natrix_exception.ClassInsideException as e:
+            logger.error(e.get_log())
+            feedback['data'] = ErrorCode.sp_code_bug('Timed task batch analyse: {}'.format(e.get_log()))
+        except Exception as e:
+            natrix_exception.natrix_traceback()
+            feedback['data'] = ErrorCode.sp_code_bug(e)
+
+        return JsonResponse(data=feedback)
+
+
 
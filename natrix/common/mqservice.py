@@ -11,6 +11,7 @@ except ImportError:
     import configparser
 import logging
 import os
+import threading
 import pika
 
 from natrix import settings
@@ -27,6 +28,122 @@ BROKER_PORT = config.get("RABBITMQ", "port")
 BROKER_USER = config.get("RABBITMQ", "username")
 BROKER_PASSWORD = config.get("RABBITMQ", "password")
 VIRTUAL_HOST = config.get("RABBITMQ", "vhost")
+CHANNEL_POOL_SIZE = int(config.get("RABBITMQ", "channel_pool_size"))
+
+
+def get_connection_parameters():
+    kwargs = dict()
+    if BROKER_SERVER:
+        kwargs['host'] = BROKER_SERVER
+    if BROKER_PORT:
+        kwargs['port'] = int(BROKER_PORT)
+    if BROKER_USER and BROKER_PASSWORD:
+        credential = pika.PlainCredentials(BROKER_USER, BROKER_PASSWORD)
+        kwargs['credentials'] = credential
+    if VIRTUAL_HOST:
+        kwargs['virtual_host'] = VIRTUAL_HOST
+
+    return pika.ConnectionParameters(**kwargs)
+
+
+class PooledChannel(object):
+    """A channel (with its own connection) in ChannelPool.
+
+    The channel is in publisher confirms mode, so basic_publish returns whether the broker
+    accepts the message (and routes it, if the message is mandatory).
+
+    """
+
+    def __init__(self, parameters):
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
+        self.channel.confirm_delivery()
+
+    def is_open(self):
+        return self.connection.is_open and self.channel.is_open
+
+    def close(self):
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception as e:
+            logger.error('Close pooled channel with error: {}'.format(e))
+
+
+class ChannelPool(object):
+    """A per-process pool of publishing channels.
+
+    BlockingConnection is not thread-safe, so each pooled channel owns a connection and is used
+    by one thread at a time. The pool also caches the declared exchanges, queues and bindings,
+    then a warm publish is a single basic_publish.
+
+    """
+
+    def __init__(self, size=CHANNEL_POOL_SIZE):
+        self.size = size
+        self._idle = []
+        self._declared = set()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_process(self):
+        # Connections can't be shared with a forked process
+        if self._pid != os.getpid():
+            self._idle = []
+            self._declared = set()
+            self._pid = os.getpid()
+
+    def _get(self):
+        with self._lock:
+            self._check_process()
+            while self._idle:
+                pooled = self._idle.pop()
+                if pooled.is_open():
+                    return pooled
+                pooled.close()
+
+        return PooledChannel(get_connection_parameters())
+
+    def _put(self, pooled):
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size and pooled.is_open():
+                self._idle.append(pooled)
+                return
+        pooled.close()
+
+    @contextlib.contextmanager
+    def channel(self):
+        """Borrow a channel, a channel with error is closed instead of returning to pool.
+
+        """
+        pooled = self._get()
+        try:
+            yield pooled.channel
+        except Exception:
+            pooled.close()
+            self.clear_declarations()
+            raise
+        else:
+            self._put(pooled)
+
+    def is_declared(self, key):
+        return key in self._declared
+
+    def mark_declared(self, key):
+        self._declared.add(key)
+
+    def clear_declarations(self):
+        self._declared = set()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._declared = set()
+        for pooled in idle:
+            pooled.close()
+
+
+channel_pool = ChannelPool()
 
 
 class MQService(object):
@@ -81,6 +198,15 @@ class MQService(object):
                               properties=pika.BasicProperties(delivery_mode=2))
         connection.close()
 
+    @staticmethod
+    def get_pooled_channel():
+        """Borrow a warm publishing channel (publisher confirms) from the process pool.
+
+        Don't consume with a pooled channel, use get_purge_channel instead.
+
+        """
+        return channel_pool.channel()
+
     @staticmethod
     @contextlib.contextmanager
     def get_purge_channel():
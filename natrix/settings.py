@@ -205,8 +205,23 @@ DEEPMONITOR_URL = 'http://127.0.0.1:8005'
 
 
 # ------------ benchmark setting ---------
+# eventhub or elasticsearch (indexed by natrix, required by the partitions of benchmark records)
 BENCHMARK_STORE_TYPE = 'eventhub'
 BENCHMARK_STORE_URL = 'http://127.0.0.1:8090'
+# buffered store writer: flush a batch by count, bytes or age (millisecond)
+BENCHMARK_STORE_BATCH_COUNT = 500
+BENCHMARK_STORE_BATCH_BYTES = 1024 * 1024
+BENCHMARK_STORE_BATCH_AGE = 1000
+BENCHMARK_STORE_QUEUE_SIZE = 100000
+BENCHMARK_STORE_QUEUE_BYTES = 64 * 1024 * 1024
+# a failed batch is retried with backoff, its events are dropped after (millisecond)
+BENCHMARK_STORE_RETRY_AGE = 600000
+BENCHMARK_STORE_RETRIES = 3
+# durable spool: store events into local segments first, None to disable
+# fsync policy: always, interval or never
+BENCHMARK_STORE_SPOOL_DIR = None
+BENCHMARK_STORE_SPOOL_SEGMENT_SIZE = 64 * 1024 * 1024
+BENCHMARK_STORE_SPOOL_FSYNC = 'interval'
 
 
 # ------------- ElasticSearch setting-----------
@@ -9,7 +9,8 @@ from django.db.models import Q
 from natrix.common import exception as natrix_exceptions
 
 from terminal.serializers import common_serializer
-from terminal.models import Terminal
+from terminal.models import Terminal, Organization
+from terminal.backends import register_cache
 
 # 有效的端版本
 TERMINAL_VALID_VERSION = 0.35
@@ -102,38 +103,20 @@ class TerminalAPI(object):
         """
         try:
             terminal = Terminal.objects.get(mac=mac)
-            register = terminal.dev.register if terminal.dev else None
-
-            if register is None:
-                return None
-
-            address = register.address
-            organizations = register.organizations.all()
-            register_info = {
-                'organizations': [],
-                'region': None,
-                'isp': terminal.isp
-            }
-
-            region = address.region if address.region else None
-            if region is None:
-                register_info['region'] = None
-            else:
-                register_info['region'] = {
-                    'province': region.province,
-                    'city': region.city
-                }
-
-            for org in organizations:
-                register_info['organizations'].append({
-                    'id': org.id,
-                    'name': org.get_full_name()
-                })
-            return register_info
+            return register_cache.register_info(terminal)
 
         except Terminal.DoesNotExist:
             return None
 
+    @staticmethod
+    def get_cached_terminal_register_info(mac):
+        """Get terminal register info from the register cache
+
+        :param mac:
+        :return:
+        """
+        return register_cache.register_cache.get(mac)
+
     @staticmethod
     def filter_available_terminals(group_own, type, filter_condition, group=None):
         filter_data = {
@@ -153,6 +136,34 @@ class TerminalAPI(object):
                 message='Filter available terminals: {}'.format(serializer.format_errors()))
 
 
+    @staticmethod
+    def get_group_terminals(group_type, value):
+        """Get all available terminals of a dispatch group.
+
+        The dispatch groups are the fan-out topics subscribed by terminals:
+         - region, all terminals registered in the province (value)
+         - organization, all terminals registered in the organization (value) or its descendants
+
+        :return: a set of terminal mac
+        """
+        terminals = Terminal.objects.filter(Q(is_active=True) &
+                                            Q(status='active') &
+                                            Q(dev__is_active=True) &
+                                            Q(dev__status='active'))
+        if group_type == 'region':
+            terminals = terminals.filter(dev__register__address__region__province=value)
+        elif group_type == 'organization':
+            try:
+                orgs = Organization.objects.get(pk=value).get_all_tree_nodes()
+            except Organization.DoesNotExist:
+                return set()
+            terminals = terminals.filter(dev__register__organizations__in=orgs)
+        else:
+            raise natrix_exceptions.ParameterInvalidException(parameter='group_type')
+
+        return set(terminals.values_list('mac', flat=True))
+
+
 def get_terminalinfo(pk):
     """Get a terminal info instant
 
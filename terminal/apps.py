@@ -21,6 +21,9 @@ class TerminalConfig(AppConfig):
         """Terminal application initial process.
         :return:
         """
+        # register cache invalidation and warm-up
+        from terminal import signals
+
         if 'runserver' not in sys.argv:
             return
 
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Terminal register info cache, which is used to enrich benchmark responses.
+
+There are two levels:
+  - a process-local LRU, the entries expire after LOCAL_CACHE_TTL seconds, so the changes in
+    other processes are visible soon.
+  - shared redis keys, mac -> register info (json), which expire after CACHE_TTL seconds. A
+    terminal without register info is cached as 'null'.
+
+The redis keys are versioned, all of them share the hash tag '{terminal_register_info}':
+    '{terminal_register_info}:generation': INT      // bumped to invalidate all terminals
+    '{terminal_register_info}:generation:[mac]': INT    // bumped to invalidate a terminal
+    '{terminal_register_info}:[generation]:[mac generation]:[mac]': STRING, register info
+
+An invalidation bumps the generation instead of deleting the entry, and the register info is
+stored by a script only if the generations are the ones read before the database, so a reader
+which loaded the register info before a change can't write it back after the invalidation.
+
+The redis keys are warmed up once a WARM_UP_INTERVAL by the first celery worker which starts, and
+the entries are invalidated by the signals of Terminal, TerminalDevice, RegisterOrganization,
+Address, Region and Organization (terminal.signals).
+
+The register info structure:
+{
+    'organizations': [{'id': 1, 'name': 'org | sub org'}],
+    'ancestry': [{'id': 2, 'name': 'org'}, {'id': 1, 'name': 'org | sub org'}],   // the register
+                                                        // organizations and all their ancestors
+    'region': {'province': 'xx', 'city': 'xx'},    // or None
+    'isp': 'xx'
+}
+
+"""
+from __future__ import unicode_literals, absolute_import
+import json, logging, os, threading, time
+from collections import OrderedDict
+
+from django_redis import get_redis_connection
+
+from terminal.models import Terminal
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = '{terminal_register_info}:generation'
+MAC_GENERATION_KEY = '{{terminal_register_info}}:generation:{mac}'
+INFO_KEY = '{{terminal_register_info}}:{generation}:{mac_generation}:{mac}'
+WARM_UP_LOCK_KEY = '{terminal_register_info}:warm_up'
+
+CACHE_TTL = 86400   # second
+LOCAL_CACHE_SIZE = 10000
+LOCAL_CACHE_TTL = 60    # second
+WARM_UP_BATCH = 1000
+WARM_UP_INTERVAL = 3600     # second
+
+# KEYS: generation, mac generation, register info
+# ARGV: generation, mac generation, register info(json), ttl
+STORE_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then
+    return 0
+end
+redis.call('SET', KEYS[3], ARGV[3], 'EX', ARGV[4])
+if ARGV[2] ~= '0' then
+    -- the mac generation outlives the register info stored with it
+    redis.call('EXPIRE', KEYS[2], 2 * tonumber(ARGV[4]))
+end
+return 1
+"""
+
+
+def register_info(terminal):
+    """Construct the register info of a terminal instance.
+
+    :param terminal: Terminal instance
+    :return: dict or None
+    """
+    register = terminal.dev.register if terminal.dev else None
+
+    if register is None:
+        return None
+
+    address = register.address
+    organizations = register.organizations.all()
+    info = {
+        'organizations': [],
+        'ancestry': [],
+        'region': None,
+        'isp': terminal.isp
+    }
+
+    region = address.region if address and address.region else None
+    if region is not None:
+        info['region'] = {
+            'province': region.province,
+            'city': region.city
+        }
+
+    ancestry_ids = set()
+    for org in organizations:
+        info['organizations'].append({
+            'id': org.id,
+            'name': org.get_full_name()
+        })
+
+        # from the top level organization to org, the root (level 0) isn't included
+        names = []
+        for ancestor in org.get_org_relation():
+            if ancestor.level <= 0:
+                continue
+            names.append(ancestor.name)
+            if ancestor.id in ancestry_ids:
+                continue
+            ancestry_ids.add(ancestor.id)
+            info['ancestry'].append({
+                'id': ancestor.id,
+                'name': ' | '.join(names)
+            })
+    return info
+
+
+class RegisterInfoCache(object):
+
+    def __init__(self, size=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL, cache_ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self._local = OrderedDict()     # mac -> (expire time, info)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._store_script = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = get_redis_connection('default')
+        return self._conn
+
+    def _local_get(self, mac):
+        with self._lock:
+            item = self._local.get(mac)
+            if item is None:
+                return False, None
+            if item[0] < time.time():
+                del self._local[mac]
+                return False, None
+            self._local.move_to_end(mac)
+            return True, item[1]
+
+    def _local_set(self, mac, info):
+        with self._lock:
+            self._local[mac] = (time.time() + self.ttl, info)
+            self._local.move_to_end(mac)
+            while len(self._local) > self.size:
+                self._local.popitem(last=False)
+
+    def _generations(self, macs):
+        """Read the current generations of terminals.
+
+        :return: a dict, mac -> (generation, mac generation)
+        """
+        keys = [GENERATION_KEY] + [MAC_GENERATION_KEY.format(mac=mac) for mac in macs]
+        values = [int(value) if value is not None else 0 for value in self.conn.mget(keys)]
+        return {mac: (values[0], mac_generation) for mac, mac_generation in zip(macs, values[1:])}
+
+    def get(self, mac):
+        """Get the register info of a terminal.
+
+        :return: register info or None (the terminal is not exist or without register info)
+        """
+        hit, info = self._local_get(mac)
+        if hit:
+            return info
+
+        generations = None
+        value = None
+        try:
+            generations = self._generations([mac])
+            value = self.conn.get(INFO_KEY.format(generation=generations[mac][0],
+                                                  mac_generation=generations[mac][1], mac=mac))
+        except Exception as e:
+            logger.error('Get terminal register info from redis with error: {}'.format(e))
+
+        if value is not None:
+            info = json.loads(value)
+        else:
+            try:
+                info = register_info(Terminal.objects.get(mac=mac))
+            except Terminal.DoesNotExist:
+                # don't cache an unknown terminal, it may be registered later
+                return None
+            if generations is not None:
+                self._store({mac: info}, generations)
+
+        self._local_set(mac, info)
+        return info
+
+    def _store(self, infos, generations):
+        """Store the register info of terminals, unless they are invalidated.
+
+        :param infos: a dict, mac -> register info
+        :param generations: a dict, mac -> (generation, mac generation), read before infos
+        :return: the count of stored terminals
+        """
+        try:
+            if self._store_script is None:
+                self._store_script = self.conn.register_script(STORE_SCRIPT)
+
+            pipe = self.conn.pipeline(transaction=False)
+            for mac, info in infos.items():
+                generation, mac_generation = generations[mac]
+                keys = [GENERATION_KEY,
+                        MAC_GENERATION_KEY.format(mac=mac),
+                        INFO_KEY.format(generation=generation, mac_generation=mac_generation, mac=mac)]
+                self._store_script(keys=keys, args=[generation, mac_generation, json.dumps(info),
+                                                    self.cache_ttl],
+                                   client=pipe)
+            return sum(1 for res in pipe.execute(raise_on_error=False)
+                       if not isinstance(res, Exception) and res)
+        except Exception as e:
+            logger.error('Store terminal register info to redis with error: {}'.format(e))
+            return 0
+
+    def invalidate(self, macs=None):
+        """Invalidate the register info of terminals, all terminals if macs is None.
+
+        """
+        with self._lock:
+            if macs is None:
+                self._local.clear()
+            else:
+                for mac in macs:
+                    self._local.pop(mac, None)
+
+        try:
+            if macs is None:
+                self.conn.incr(GENERATION_KEY)
+            elif macs:
+                pipe = self.conn.pipeline(transaction=False)
+                for mac in macs:
+                    pipe.incr(MAC_GENERATION_KEY.format(mac=mac))
+                    pipe.expire(MAC_GENERATION_KEY.format(mac=mac), 2 * self.cache_ttl)
+                pipe.execute()
+        except Exception as e:
+            logger.error('Invalidate terminal register info with error: {}'.format(e))
+
+    def warm_up(self, force=False):
+        """Load the register info of all terminals into redis.
+
+        Only one process warms up in a WARM_UP_INTERVAL, the lock isn't released but expires.
+
+        :param force: warm up even if another process has warmed up in the interval
+        :return: the count of stored terminals, or None if another process has warmed up
+        """
+        if not force and not self.conn.set(WARM_UP_LOCK_KEY, os.getpid(), nx=True, ex=WARM_UP_INTERVAL):
+            logger.info('Terminal register info was warmed up by another process')
+            return None
+
+        macs = list(Terminal.objects.values_list('mac', flat=True))
+        count = 0
+        for index in range(0, len(macs), WARM_UP_BATCH):
+            batch = macs[index: index + WARM_UP_BATCH]
+            # the generations are read before the database, as get() does
+            generations = self._generations(batch)
+            terminals = Terminal.objects.filter(mac__in=batch).select_related(
+                'dev__register__address__region').prefetch_related('dev__register__organizations')
+            count += self._store({terminal.mac: register_info(terminal) for terminal in terminals},
+                                 generations)
+
+        logger.info('Warm up terminal register info: {} terminals'.format(count))
+        return count
+
+
+register_cache = RegisterInfoCache()
@@ -0,0 +1,160 @@
+from unittest import mock
+
+import fakeredis
+from django.db.models.signals import post_save, pre_delete
+from django.test import SimpleTestCase
+
+from terminal import signals
+from terminal.backends import register_cache
+from terminal.models import Terminal, Region
+
+INFO = {'organizations': [], 'ancestry': [], 'region': {'province': 'bj', 'city': 'bj'}, 'isp': 'x'}
+
+
+class FakeTerminal(object):
+
+    def __init__(self, mac):
+        self.mac = mac
+
+
+class FakeTerminals(object):
+    """Terminal.objects, the register info of a terminal is INFO with its mac as isp."""
+
+    def __init__(self, macs):
+        self.macs = macs
+        self.loaded = []
+
+    def get(self, mac):
+        if mac not in self.macs:
+            raise Terminal.DoesNotExist()
+        self.loaded.append(mac)
+        return FakeTerminal(mac)
+
+    def values_list(self, *args, **kwargs):
+        return list(self.macs)
+
+    def filter(self, mac__in):
+        self.loaded.extend(mac__in)
+        return self
+
+    def select_related(self, *args):
+        return self
+
+    def prefetch_related(self, *args):
+        return [FakeTerminal(mac) for mac in self.loaded[-len(self.macs):]]
+
+
+def register_info(terminal):
+    return dict(INFO, isp=terminal.mac)
+
+
+class RegisterInfoCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        self.terminals = FakeTerminals(['m1', 'm2', 'm3'])
+        patchers = [mock.patch.object(register_cache, 'register_info', side_effect=register_info),
+                    mock.patch.object(register_cache.Terminal, 'objects', self.terminals)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def cache(self):
+        # a cache of another process, without the local entries
+        cache = register_cache.RegisterInfoCache()
+        cache._conn = self.redis
+        return cache
+
+    def info_keys(self):
+        return sorted(key.decode() for key in self.redis.keys('{terminal_register_info}:*:*:*'))
+
+    def test_get(self):
+        self.assertEqual(self.cache().get('m1'), register_info(FakeTerminal('m1')))
+        self.assertEqual(self.cache().get('m1'), register_info(FakeTerminal('m1')))
+        self.assertIsNone(self.cache().get('unknown'))
+        # the second process reads the register info from redis
+        self.assertEqual(self.terminals.loaded, ['m1'])
+
+        key = self.info_keys()[0]
+        self.assertEqual(key, '{terminal_register_info}:0:0:m1')
+        self.assertTrue(0 < self.redis.ttl(key) <= register_cache.CACHE_TTL)
+
+    def test_invalidate(self):
+        cache = self.cache()
+        cache.get('m1')
+        cache.get('m2')
+        cache.invalidate(['m1'])
+        self.assertEqual(cache.get('m1'), register_info(FakeTerminal('m1')))
+        self.assertEqual(self.terminals.loaded, ['m1', 'm2', 'm1'])
+        self.assertIn('{terminal_register_info}:0:1:m1', self.info_keys())
+        self.assertGreater(self.redis.ttl('{terminal_register_info}:generation:m1'), register_cache.CACHE_TTL)
+
+        cache.invalidate()
+        cache.get('m2')
+        self.assertEqual(self.terminals.loaded, ['m1', 'm2', 'm1', 'm2'])
+        self.assertIn('{terminal_register_info}:1:0:m2', self.info_keys())
+
+    def test_stale_write_back(self):
+        cache = self.cache()
+
+        def changed(terminal):
+            # the terminal is changed and invalidated after the register info is loaded
+            self.cache().invalidate([terminal.mac])
+            return {'stale': True}
+
+        with mock.patch.object(register_cache, 'register_info', side_effect=changed):
+            self.assertEqual(cache.get('m1'), {'stale': True})
+        self.assertEqual(self.info_keys(), [])
+        self.assertEqual(self.cache().get('m1'), register_info(FakeTerminal('m1')))
+
+    def test_redis_unavailable(self):
+        cache = self.cache()
+        cache._conn = mock.Mock()
+        cache._conn.mget.side_effect = ConnectionError('redis is unavailable')
+        self.assertEqual(cache.get('m1'), register_info(FakeTerminal('m1')))
+        cache._conn.register_script.assert_not_called()
+
+    def test_warm_up(self):
+        self.assertEqual(self.cache().warm_up(), 3)
+        self.assertEqual(len(self.info_keys()), 3)
+        # the other workers don't warm up again
+        self.assertIsNone(self.cache().warm_up())
+        self.assertEqual(self.cache().warm_up(force=True), 3)
+
+    def test_warm_up_invalidated(self):
+        cache = self.cache()
+        prefetch_related = self.terminals.prefetch_related
+
+        def scan(*args):
+            # m2 is changed and invalidated during the scan
+            self.cache().invalidate(['m2'])
+            return prefetch_related(*args)
+
+        with mock.patch.object(self.terminals, 'prefetch_related', side_effect=scan):
+            self.assertEqual(cache.warm_up(), 2)
+        self.assertEqual(self.info_keys(), ['{terminal_register_info}:0:0:m1',
+                                            '{terminal_register_info}:0:0:m3'])
+
+
+@mock.patch.object(signals.transaction, 'on_commit')
+@mock.patch.object(signals, 'register_cache')
+class SignalsTestCase(SimpleTestCase):
+
+    def test_invalidated_on_commit(self, cache, on_commit):
+        with mock.patch.object(signals, '_terminal_macs', return_value=['m1', 'm2']) as terminal_macs:
+            region = Region(citycode='110000', province='bj', city='bj')
+            post_save.send(sender=Region, instance=region, created=False)
+            terminal_macs.assert_called_once_with(dev__register__address__region=region)
+
+        # nothing is invalidated before the commit
+        cache.invalidate.assert_not_called()
+        on_commit.call_args[0][0]()
+        cache.invalidate.assert_called_once_with(['m1', 'm2'])
+
+    def test_receivers(self, cache, on_commit):
+        for receiver, model in ((signals.terminal_changed, Terminal),
+                                (signals.region_changed, Region),
+                                (signals.address_changed, signals.Address),
+                                (signals.organization_changed, signals.Organization)):
+            for signal in (post_save, pre_delete):
+                self.assertIn(receiver, signal._live_receivers(model), model.__name__)
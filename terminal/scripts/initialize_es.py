@@ -11,6 +11,8 @@ from elasticsearch.client import IndicesClient
 
 from terminal.configurations.terminal_conf import ES_SERVICE_URL, ES_SERVICE_PORT
 from terminal.configurations.terminal_conf import TERMINAL_INDEX, TERMINAL_ADVANCE, TERMINAL_BASIC
+from benchmark.backends.command_dispatcher.rollup import init_rollup_index
+from benchmark.backends.stores.partition import init_partition_template
 
 es = Elasticsearch(host=ES_SERVICE_URL, port=ES_SERVICE_PORT)
 
@@ -182,6 +184,12 @@ def initializer():
                            doc_type=TERMINAL_ADVANCE,
                            body=terminal_advance_mapping)
 
+    # benchmark rollups
+    init_rollup_index()
+
+    # benchmark partitions (the template is used only if benchmark_partition is day or week)
+    init_partition_template(es)
+
 
 if __name__ == '__main__':
     initializer()
@@ -232,7 +232,7 @@ def store_basic_info(info):
     store_data['networks'] = list(info.get('networks').values())
 
     natrix_es_client = NatrixESClient(app='terminal')
-    natrix_es_client.push(TERMINAL_BASIC,store_data)
+    natrix_es_client.bulk_push(TERMINAL_BASIC, store_data)
 
 
 def store_advance_info(info):
@@ -265,7 +265,7 @@ def store_advance_info(info):
     store_data['networks'] = list(info.get('networks').values())
 
     natrix_es_client = NatrixESClient(app='terminal')
-    natrix_es_client.push(TERMINAL_ADVANCE, store_data)
+    natrix_es_client.bulk_push(TERMINAL_ADVANCE, store_data)
 
 
 @task(bind=True)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Signals which keep the terminal register info cache consistent.
+
+The cache is invalidated when the transaction is committed: an invalidation before the commit
+lets a reader cache the old register info again.
+
+"""
+from __future__ import unicode_literals, absolute_import
+import logging
+
+from celery.signals import worker_ready
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from terminal.models import Terminal, TerminalDevice, RegisterOrganization, Organization, Address, Region
+from terminal.backends.register_cache import register_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _terminal_macs(**conditions):
+    return list(Terminal.objects.filter(**conditions).values_list('mac', flat=True))
+
+
+def _invalidate(macs=None):
+    # the macs are queried before a delete cascades, the cache is invalidated after the commit
+    transaction.on_commit(lambda: register_cache.invalidate(macs))
+
+
+@receiver([post_save, pre_delete], sender=Terminal)
+def terminal_changed(sender, instance, **kwargs):
+    _invalidate([instance.mac])
+
+
+@receiver([post_save, pre_delete], sender=TerminalDevice)
+def terminal_device_changed(sender, instance, **kwargs):
+    _invalidate(_terminal_macs(dev=instance))
+
+
+@receiver([post_save, pre_delete], sender=RegisterOrganization)
+def register_changed(sender, instance, **kwargs):
+    _invalidate(_terminal_macs(dev__register=instance))
+
+
+@receiver(m2m_changed, sender=RegisterOrganization.organizations.through)
+def register_organizations_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance is an organization
+        _invalidate()
+    else:
+        _invalidate(_terminal_macs(dev__register=instance))
+
+
+@receiver([post_save, pre_delete], sender=Address)
+def address_changed(sender, instance, **kwargs):
+    _invalidate(_terminal_macs(dev__register__address=instance))
+
+
+@receiver([post_save, pre_delete], sender=Region)
+def region_changed(sender, instance, **kwargs):
+    _invalidate(_terminal_macs(dev__register__address__region=instance))
+
+
+@receiver([post_save, pre_delete], sender=Organization)
+def organization_changed(sender, instance, **kwargs):
+    # The full names of all descendant organizations may change
+    _invalidate()
+
+
+@worker_ready.connect
+def warm_up_register_cache(sender=None, **kwargs):
+    # every worker sends worker_ready, the cache is warmed up by one of them (a redis lock)
+    try:
+        register_cache.warm_up()
+    except Exception as e:
+        logger.error('Warm up terminal register info with error: {}'.format(e))
@@ -1,7 +1,26 @@
 # -*- coding: utf-8 -*-
+"""Elasticsearch client.
+
+The Elasticsearch connection (with a keep-alive connection pool) is shared in a process, see
+get_es_connection. The documents pushed by bulk_push are buffered for each index and indexed
+with the bulk API, a buffer is flushed when it has bulk_size documents or the oldest one is
+older than bulk_interval milliseconds. A buffer holds at most bulk_queue_size documents, the
+documents which fail with a transient error (connection, 429, 5xx) are retried with backoff until
+they are older than bulk_retry_age milliseconds.
+
+NatrixESClient.scan iterates all matched documents page by page (scroll), without the size
+limit of a search request.
+
+"""
+import atexit
+from collections import deque
 import logging
+import os
+import threading
+import time
 
 from elasticsearch import Elasticsearch
+from elasticsearch import helpers
 
 from natrix.common.config import natrix_config
 
@@ -10,14 +29,240 @@ logger = logging.getLogger(__name__)
 
 ES_SERVICE_URL = natrix_config.get_value('ELASTICSEARCH', 'host')
 ES_SERVICE_PORT = natrix_config.get_value('ELASTICSEARCH', 'port')
+ES_TIMEOUT = int(natrix_config.get_value('ELASTICSEARCH', 'timeout'))    # second
+ES_MAX_RETRIES = int(natrix_config.get_value('ELASTICSEARCH', 'max_retries'))
+ES_POOL_SIZE = int(natrix_config.get_value('ELASTICSEARCH', 'pool_size'))
+ES_BULK_SIZE = int(natrix_config.get_value('ELASTICSEARCH', 'bulk_size'))
+ES_BULK_INTERVAL = int(natrix_config.get_value('ELASTICSEARCH', 'bulk_interval'))  # millisecond
+ES_BULK_QUEUE_SIZE = int(natrix_config.get_value('ELASTICSEARCH', 'bulk_queue_size'))
+ES_BULK_RETRY_AGE = int(natrix_config.get_value('ELASTICSEARCH', 'bulk_retry_age'))  # millisecond
+ES_SCAN_SIZE = int(natrix_config.get_value('ELASTICSEARCH', 'scan_size'))
+ES_SCROLL = natrix_config.get_value('ELASTICSEARCH', 'scroll')
+ES_RETRY_ON_CONFLICT = 5
+ES_BULK_MAX_BACKOFF = 60     # second
+# the status of a failed bulk item which is retried, 'N/A' is a connection error or timeout
+ES_BULK_RETRY_STATUS = ('N/A', 429, 502, 503, 504)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_es_connection():
+    """Get the Elasticsearch connection of the current process.
+
+    The connection pool doesn't survive fork, so there is one connection for each process.
+    """
+    pid = os.getpid()
+    conn = _registry.get(('connection', pid))
+    if conn is None:
+        with _registry_lock:
+            conn = _registry.get(('connection', pid))
+            if conn is None:
+                conn = Elasticsearch(hosts=ES_SERVICE_URL,
+                                     port=ES_SERVICE_PORT,
+                                     timeout=ES_TIMEOUT,
+                                     max_retries=ES_MAX_RETRIES,
+                                     retry_on_timeout=True,
+                                     maxsize=ES_POOL_SIZE)
+                _registry[('connection', pid)] = conn
+    return conn
+
+
+def get_bulk_buffer(index):
+    """Get the bulk buffer of an index in the current process.
+
+    """
+    pid = os.getpid()
+    buffer = _registry.get(('bulk', pid, index))
+    if buffer is None:
+        with _registry_lock:
+            buffer = _registry.get(('bulk', pid, index))
+            if buffer is None:
+                buffer = BulkBuffer(index)
+                _registry[('bulk', pid, index)] = buffer
+    return buffer
+
+
+class BulkBuffer(object):
+    """Buffer documents of an index, and index them with the bulk API in a background thread.
+
+    """
+
+    def __init__(self, index, size=ES_BULK_SIZE, interval=ES_BULK_INTERVAL,
+                 max_size=ES_BULK_QUEUE_SIZE, retry_age=ES_BULK_RETRY_AGE, max_backoff=ES_BULK_MAX_BACKOFF):
+        self.index = index
+        self.size = size
+        self.interval = interval
+        self.max_size = max_size
+        self.retry_age = retry_age
+        self.max_backoff = max_backoff
+
+        self._actions = deque()     # [(push time, action)]
+        self._failures = 0          # the consecutive bulks with retried documents
+        self._retry_time = 0        # the thread doesn't bulk before it
+        self._condition = threading.Condition()
+        self._metrics = {
+            'pushed': 0,
+            'indexed': 0,
+            'failed': 0,
+            'retried': 0,
+            'dropped': 0,
+            'bulks': 0,
+            'last_bulk_time': None,
+        }
+        self._thread = threading.Thread(target=self._run, name='es-bulk-{}'.format(index), daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def push(self, type, data):
+        self.push_action({
+            '_index': self.index,
+            '_type': type,
+            '_source': data
+        })
+
+    def push_action(self, action):
+        """Buffer a bulk action (index, update, ...), see elasticsearch.helpers.bulk.
+
+        The action is dropped if the buffer is full.
+        """
+        with self._condition:
+            if len(self._actions) >= self.max_size:
+                self._metrics['dropped'] += 1
+                logger.error('Bulk buffer of ES({}) is full({}), drop a document'.format(
+                    self.index, self.max_size))
+                return
+            self._actions.append((time.time(), action))
+            self._metrics['pushed'] += 1
+            if len(self._actions) >= self.size:
+                self._condition.notify()
+
+    def _ready(self):
+        if not self._actions or time.time() < self._retry_time:
+            return False
+        return len(self._actions) >= self.size or \
+            (time.time() - self._actions[0][0]) * 1000 >= self.interval
+
+    def _wait_time(self):
+        now = time.time()
+        if now < self._retry_time:
+            return self._retry_time - now
+        if self._actions:
+            return max(self.interval / 1000.0 - (now - self._actions[0][0]), 0.001)
+        return self.interval / 1000.0
+
+    def _take(self):
+        with self._condition:
+            count = min(len(self._actions), self.size)
+            return [self._actions.popleft() for _ in range(count)]
+
+    def _bulk(self, items):
+        """Index a list of buffered actions, requeue the ones failed with a transient error.
+
+        :param items: a list of (push time, action)
+        :return: False if some actions are requeued
+        """
+        if not items:
+            return True
+
+        indexed, failed, retry, errors = 0, 0, [], []
+        try:
+            results = helpers.streaming_bulk(get_es_connection(), [action for _, action in items],
+                                             chunk_size=self.size, max_retries=0, yield_ok=True,
+                                             raise_on_error=False, raise_on_exception=False)
+            # a result for each action, in the order of actions
+            for item, (ok, result) in zip(items, results):
+                if ok:
+                    indexed += 1
+                    continue
+                info = list(result.values())[0]
+                if info.get('status') in ES_BULK_RETRY_STATUS:
+                    retry.append(item)
+                else:
+                    failed += 1
+                    errors.append(info.get('error'))
+        except Exception as e:
+            # not a transport error (e.g. serialization), the actions can't be indexed
+            logger.error('Bulk push {} documents to ES({}) with error: {}'.format(
+                len(items), self.index, e))
+            failed = len(items) - indexed - len(retry)
+
+        if errors:
+            logger.error('Bulk push {} documents to ES({}) with {} errors: {}'.format(
+                len(items), self.index, len(errors), errors[:3]))
+        if retry:
+            logger.error('Bulk push {} documents to ES({}) failed, retry them'.format(
+                len(retry), self.index))
+        logger.debug('Bulk push {} documents to ES({})'.format(indexed, self.index))
+
+        with self._condition:
+            self._metrics['indexed'] += indexed
+            self._metrics['failed'] += failed
+            self._metrics['bulks'] += 1
+            self._metrics['last_bulk_time'] = int(time.time() * 1000)
+            if retry:
+                self._requeue(retry)
+                self._failures += 1
+                backoff = min(self.interval / 1000.0 * (2 ** (self._failures - 1)), self.max_backoff)
+                self._retry_time = time.time() + backoff
+            else:
+                self._failures = 0
+                self._retry_time = 0
+        return not retry
+
+    def _requeue(self, items):
+        # at the head, the retried actions keep their push time
+        deadline = time.time() - self.retry_age / 1000.0
+        dropped = 0
+        for item in reversed(items):
+            if item[0] < deadline:
+                dropped += 1
+                continue
+            self._actions.appendleft(item)
+        self._metrics['retried'] += len(items) - dropped
+        self._metrics['dropped'] += dropped
+        if dropped:
+            logger.error('Drop {} documents of ES({}) older than {}ms'.format(
+                dropped, self.index, self.retry_age))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._ready():
+                    self._condition.wait(self._wait_time())
+            self._bulk(self._take())
+
+    def flush(self):
+        """Index the buffered documents in the current thread.
+
+        :return: True if the buffer is empty, False if some documents fail and are requeued
+        """
+        while True:
+            items = self._take()
+            if not items:
+                return True
+            if not self._bulk(items):
+                return False
+
+    def metrics(self):
+        """The buffer metrics: queue depth, indexed, failed, retried and dropped documents.
+
+        """
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics['queue_depth'] = len(self._actions)
+        return metrics
 
 
-# TODO: optimize
 class NatrixESClient:
 
-    def __init__(self, app):
-        self.es_conn = Elasticsearch(hosts=ES_SERVICE_URL, port=ES_SERVICE_PORT)
-        self.es_index = natrix_config.get_value('ELASTICSEARCH', f'{app}_index')
+    def __init__(self, app, index=None):
+        """
+        :param app: the index is '<app>_index' of ELASTICSEARCH section
+        :param index: the index (an alias, or a comma separated list) instead of the app index
+        """
+        self.es_conn = get_es_connection()
+        self.es_index = index or natrix_config.get_value('ELASTICSEARCH', f'{app}_index')
 
     def push(self, type, data):
         res = self.es_conn.index(index=self.es_index,
@@ -25,6 +270,12 @@ class NatrixESClient:
                                  body=data)
         logger.info('push data to ES: {}'.format(res))
 
+    def bulk_push(self, type, data):
+        """Buffer a document, it's indexed in a bulk request later.
+
+        """
+        get_bulk_buffer(self.es_index).push(type, data)
+
     def pull(self, condition, size=None):
         if size:
             condition['size'] = size
@@ -38,11 +289,59 @@ class NatrixESClient:
 
         return records
 
-    def origin_search(self, condition, size=1000):
-        res = self.es_conn.search(index=self.es_index,
+    def origin_search(self, condition, size=1000, index=None, routing=None):
+        """Search the index of the client, or the indices (a comma separated list, the missing
+        ones are ignored).
+
+        """
+        res = self.es_conn.search(index=index or self.es_index,
                                   body=condition,
-                                  size=size)
+                                  size=size,
+                                  routing=routing,
+                                  ignore_unavailable=index is not None)
 
         return res
 
+    def multi_search(self, conditions):
+        """Send searches in one msearch request.
+
+        :param conditions: a list of (index, search body, routing), the index of the client if
+                           index is None, the missing indices are ignored
+        :return: the responses in the same order, a failed search is {'error': ...}
+        """
+        body = []
+        for index, condition, routing in conditions:
+            header = {
+                'index': index or self.es_index,
+                'ignore_unavailable': True
+            }
+            if routing is not None:
+                header['routing'] = routing
+            body.append(header)
+            body.append(condition)
+        res = self.es_conn.msearch(body=body)
+
+        return res.get('responses', [])
+
+    def scan(self, condition, source=None, page_size=ES_SCAN_SIZE, scroll=ES_SCROLL, routing=None):
+        """Iterate all hits matched the condition with the scroll API.
+
+        Only a page (page_size hits) is in memory at a time.
+
+        :param condition: the search body (query, ...)
+        :param source: _source filtering, a list of fields, False or
+                       {'includes': [...], 'excludes': [...]}
+        :param routing: search the shards of the routing only
+        :return: a generator of hits
+        """
+        body = dict(condition)
+        if source is not None:
+            body['_source'] = source
 
+        return helpers.scan(self.es_conn,
+                            query=body,
+                            index=self.es_index,
+                            size=page_size,
+                            scroll=scroll,
+                            clear_scroll=True,
+                            routing=routing)
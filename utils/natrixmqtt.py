@@ -33,6 +33,9 @@ class NatrixMQTTClient(mqtt.Client):
     def connect(self, keepalive=60):
         return super(NatrixMQTTClient, self).connect(host=host, port=port, keepalive=keepalive)
 
+    def connect_async(self, keepalive=60):
+        return super(NatrixMQTTClient, self).connect_async(host=host, port=port, keepalive=keepalive)
+
     def is_connected(self):
         if self._sock:
             return True
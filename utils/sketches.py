@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Mergeable sketches.
+
+ - DDSketch: quantiles with a relative accuracy, the values are counted in logarithmic bins,
+   two sketches are merged by adding the bin counts.
+ - HyperLogLog: distinct count, each register keeps the max rank of the hashes, two sketches
+   are merged by the max of the registers.
+
+Both sketches are sparse maps (only the non-empty bins and registers), to_dict/from_dict
+convert them to/from a JSON object with string keys, so they can be stored in a document and
+merged by a script (see benchmark.backends.command_dispatcher.rollup).
+
+"""
+from __future__ import unicode_literals
+import hashlib, math
+
+
+class DDSketch(object):
+    """Quantile sketch, a quantile q of the values is estimated within relative_accuracy.
+
+    The values not greater than min_value (zero, negative, ...) are counted as zero.
+    """
+    ZERO_KEY = 'z'
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-6):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def key(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if value <= self.min_value:
+            self.zero_count += count
+        else:
+            key = self.key(value)
+            self.bins[key] = self.bins.get(key, 0) + count
+        return self
+
+    def merge(self, other):
+        self.zero_count += other.zero_count
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        return self
+
+    def quantile(self, q):
+        """The estimated q quantile (0 <= q <= 1), None if the sketch is empty."""
+        count = self.count
+        if not count:
+            return None
+
+        rank = q * (count - 1)
+        accumulated = self.zero_count
+        if rank < accumulated:
+            return 0.0
+        for key in sorted(self.bins):
+            accumulated += self.bins[key]
+            if rank < accumulated:
+                return self.value(key)
+        return self.value(max(self.bins))
+
+    def to_dict(self):
+        data = dict((str(key), count) for key, count in self.bins.items())
+        if self.zero_count:
+            data[self.ZERO_KEY] = self.zero_count
+        return data
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        sketch = cls(**kwargs)
+        for key, count in (data or {}).items():
+            if key == cls.ZERO_KEY:
+                sketch.zero_count += int(count)
+            else:
+                sketch.bins[int(key)] = sketch.bins.get(int(key), 0) + int(count)
+        return sketch
+
+
+class HyperLogLog(object):
+    """Distinct count sketch with 2 ** precision registers, the standard error is
+    1.04 / sqrt(2 ** precision) (about 3% for the default precision).
+
+    The values are hashed by SHA-1, so a value has the same hash in all processes.
+    """
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = {}
+
+    def add(self, value):
+        if not isinstance(value, bytes):
+            value = str(value).encode('utf-8')
+        hash_value = int.from_bytes(hashlib.sha1(value).digest()[0: 8], 'big')
+        index = hash_value >> (64 - self.precision)
+        remainder = hash_value & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - remainder.bit_length() + 1
+        if rank > self.registers.get(index, 0):
+            self.registers[index] = rank
+        return self
+
+    def merge(self, other):
+        for index, rank in other.registers.items():
+            if rank > self.registers.get(index, 0):
+                self.registers[index] = rank
+        return self
+
+    def count(self):
+        size = self.size
+        if size == 16:
+            alpha = 0.673
+        elif size == 32:
+            alpha = 0.697
+        elif size == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / size)
+
+        zeros = size - len(self.registers)
+        estimate = alpha * size * size / (zeros + sum(2.0 ** -rank for rank in self.registers.values()))
+        if estimate <= 2.5 * size and zeros:
+            # small range correction (linear counting)
+            estimate = size * math.log(size / float(zeros))
+        return int(round(estimate))
+
+    def to_dict(self):
+        return dict((str(index), rank) for index, rank in self.registers.items())
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        sketch = cls(**kwargs)
+        for index, rank in (data or {}).items():
+            index, rank = int(index), int(rank)
+            if rank > sketch.registers.get(index, 0):
+                sketch.registers[index] = rank
+        return sketch
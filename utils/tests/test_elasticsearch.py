@@ -0,0 +1,126 @@
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from utils import elasticsearch
+
+
+class FakeBulk(object):
+    """helpers.streaming_bulk, the status of an action is action['status'] (201 by default)."""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, client, actions, chunk_size, **kwargs):
+        actions = list(actions)
+        self.requests.append(actions)
+        for action in actions:
+            status = action.get('status', 201)
+            yield status in (200, 201), {'index': {'status': status, 'error': 'error {}'.format(status)}}
+
+
+def action(n, status=201):
+    return {'_index': 'i', '_type': 't', '_source': {'n': n}, 'status': status}
+
+
+class BulkBufferTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.bulk = FakeBulk()
+        patchers = [mock.patch.object(elasticsearch.helpers, 'streaming_bulk', self.bulk),
+                    mock.patch.object(elasticsearch, 'get_es_connection'),
+                    mock.patch.object(elasticsearch, 'atexit')]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def buffer(self, **kwargs):
+        # the thread exits at once, the tests index in the current thread
+        with mock.patch.object(elasticsearch.BulkBuffer, '_run'):
+            return elasticsearch.BulkBuffer('i', **kwargs)
+
+    def sources(self, actions):
+        return [a['_source']['n'] for a in actions]
+
+    def test_size_and_interval(self):
+        buffer = self.buffer(size=3, interval=1000)
+        buffer.push_action(action(0))
+        buffer.push_action(action(1))
+        self.assertFalse(buffer._ready())
+        with mock.patch.object(elasticsearch.time, 'time', return_value=time.time() + 1):
+            self.assertTrue(buffer._ready())
+
+        buffer.push_action(action(2))
+        buffer.push_action(action(3))
+        self.assertTrue(buffer._ready())
+        # a bulk has at most size documents
+        self.assertEqual(self.sources(action for _, action in buffer._take()), [0, 1, 2])
+        self.assertEqual(buffer.metrics()['queue_depth'], 1)
+
+    def test_flush_at_exit(self):
+        buffer = self.buffer(size=2)
+        elasticsearch.atexit.register.assert_called_once_with(buffer.flush)
+        for n in range(5):
+            buffer.push_action(action(n))
+        self.assertTrue(buffer.flush())
+        self.assertEqual([self.sources(actions) for actions in self.bulk.requests], [[0, 1], [2, 3], [4]])
+        metrics = buffer.metrics()
+        self.assertEqual((metrics['indexed'], metrics['bulks'], metrics['queue_depth']), (5, 3, 0))
+
+    def test_full(self):
+        buffer = self.buffer(max_size=2)
+        for n in range(3):
+            buffer.push_action(action(n))
+        self.assertEqual((buffer.metrics()['queue_depth'], buffer.metrics()['dropped']), (2, 1))
+
+    def test_errors(self):
+        buffer = self.buffer(size=10, interval=1000)
+        buffer.push_action(action(0))
+        buffer.push_action(action(1, status=400))
+        buffer.push_action(action(2, status=429))
+        buffer.push_action(action(3, status='N/A'))
+        self.assertFalse(buffer.flush())
+
+        metrics = buffer.metrics()
+        self.assertEqual((metrics['indexed'], metrics['failed'], metrics['retried']), (1, 1, 2))
+        # the transient failures are requeued and retried with backoff
+        self.assertEqual(self.sources(action for _, action in buffer._actions), [2, 3])
+        self.assertFalse(buffer._ready())
+        self.assertAlmostEqual(buffer._wait_time(), 1, delta=0.1)
+
+        for _, requeued in buffer._actions:
+            requeued['status'] = 201
+        self.assertTrue(buffer.flush())
+        self.assertEqual(buffer.metrics()['indexed'], 3)
+        self.assertEqual(buffer._retry_time, 0)
+
+    def test_retry_expired(self):
+        buffer = self.buffer(retry_age=1000)
+        buffer.push_action(action(0, status=503))
+        buffer.push_action(action(1, status=503))
+        buffer._actions[0] = (time.time() - 2, buffer._actions[0][1])
+        self.assertFalse(buffer.flush())
+        self.assertEqual((buffer.metrics()['dropped'], buffer.metrics()['queue_depth']), (1, 1))
+
+    def test_exception(self):
+        buffer = self.buffer()
+        buffer.push_action(action(0))
+        with mock.patch.object(elasticsearch.helpers, 'streaming_bulk', side_effect=TypeError('not json')):
+            self.assertTrue(buffer.flush())
+        self.assertEqual(buffer.metrics()['failed'], 1)
+
+
+class BulkBufferThreadTestCase(SimpleTestCase):
+
+    def test_interval(self):
+        bulk = FakeBulk()
+        with mock.patch.object(elasticsearch.helpers, 'streaming_bulk', bulk), \
+                mock.patch.object(elasticsearch, 'get_es_connection'), \
+                mock.patch.object(elasticsearch, 'atexit'):
+            buffer = elasticsearch.BulkBuffer('i', size=100, interval=10)
+            buffer.push_action(action(0))
+            deadline = time.time() + 5
+            while buffer.metrics()['indexed'] < 1 and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(bulk.requests, [[action(0)]])